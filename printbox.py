@@ -11,73 +11,289 @@
 # - Código mais organizado, comentado e com tratamento de erros aprimorado.
 #
 # PRÉ-REQUISITOS:
-# pip install ttkthemes PyPDF2 pandas matplotlib
+# pip install ttkthemes PyPDF2 matplotlib
 # --------------------------------------------------------------------------------
+import time
+_INICIO = time.perf_counter()  # Referência para o relatório de tempo de abertura
+
 import os
-import shutil
-import subprocess
+import hashlib
 import sys
 import threading
 import sqlite3
 import datetime
+import json
+import logging
+import logging.handlers
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, simpledialog
 from typing import List, Optional
 
-# Libs de terceiros
-from PIL import ImageTk, Image
-import qrcode
-from ttkthemes import ThemedTk
-from PyPDF2 import PdfReader
+# Libs de terceiros (PyPDF2, qrcode/PIL, ttkthemes e matplotlib) são importadas
+# só quando usadas, para a janela abrir o quanto antes.
+
+# Motor de impressão, banco de dados e caches (sem dependência do Tk)
+import printbox_core
+from printbox_core import (
+    CACHE_DIR, ETAPA_INTERFACE, GRUPOS_DIR, JOBS_PAGE_SIZE, RESULTADO_SUCESSO, RETENTION_DAYS, SERVER_ENV, SYNC_DIR,
+    FileResult, GroupIndex, ImportResult, JobFilter, PrintScheduler, QueuedJob, SpoolTracker,
+    apply_retention, close_databases, import_group, logger, metadata_cache, metrics, render_cache, run_print_job, setup_database,
+)
+
+
+
+# --- CONFIGURAÇÕES DA INTERFACE ---
+
+IMPRESSORA_PADRAO = "(padrão do sistema)"
+# Nome exibido no gráfico de análise -> coluna retornada por get_daily_stats/get_group_stats
+METRICAS_GRAFICO = {"Trabalhos": 1, "Cópias": 2, "Páginas": 3, "Páginas impressas": 4}
+PIX_PAYLOAD = "00020101021126580014br.gov.bcb.pix0136e99fe61e-c0d7-4b28-8449-3b10bf07c8515204000053039865802BR5917ISAR BAERE LOIOLA6013RIO DE JANEIR62070503***6304D833"
+QR_CODE_DIR = os.path.join(CACHE_DIR, "qrcode")
+STARTUP_REPORT = os.path.join(CACHE_DIR, "startup_timing.json")
+STARTUP_TARGET_MS = 1000  # Meta de tempo até o primeiro quadro da janela
+LOG_FILE = os.path.join(CACHE_DIR, "printbox.log")
+LOG_MAX_BYTES = 1024 * 1024  # O arquivo é rotacionado ao passar disso (mantém 1 anterior)
+MONITOR_POLL_MS = 5000  # Intervalo da busca por impressões novas (inclusive de outras estações)
+TRABALHOS_LENTOS_LIMITE = 50  # Linhas da janela "Trabalhos Mais Lentos"
+FONTE_ESTACAO = "Esta estação"
+FONTE_CENTRAL = "Todas as estações"
+
+# --- MÓDULO DE INICIALIZAÇÃO ---
+
+class StartupTimer:
+    """
+    Marca quanto tempo cada etapa da abertura levou, contado desde o início
+    do módulo, e grava o relatório em `STARTUP_REPORT` (JSON). O relatório é
+    regravado a cada marca, então inclui também as tarefas de segundo plano
+    que terminam depois do primeiro quadro.
+    """
+    def __init__(self, inicio: float = _INICIO, report_path: str = STARTUP_REPORT,
+                 target_ms: float = STARTUP_TARGET_MS):
+        self.inicio = inicio
+        self.report_path = report_path
+        self.target_ms = target_ms
+        self.marcas = {}
+        self._lock = threading.Lock()
+
+    def mark(self, etapa: str, salvar: bool = False) -> float:
+        ms = (time.perf_counter() - self.inicio) * 1000
+        with self._lock:
+            self.marcas.setdefault(etapa, round(ms, 1))
+        if salvar or "primeiro_quadro" in self.marcas:
+            self.save()
+        return ms
+
+    def save(self):
+        with self._lock:
+            primeiro_quadro = self.marcas.get("primeiro_quadro")
+            relatorio = {
+                "gerado_em": datetime.datetime.now().isoformat(),
+                "meta_primeiro_quadro_ms": self.target_ms,
+                "primeiro_quadro_ms": primeiro_quadro,
+                "dentro_da_meta": primeiro_quadro is not None and primeiro_quadro <= self.target_ms,
+                "etapas_ms": dict(self.marcas),
+            }
+        try:
+            os.makedirs(os.path.dirname(self.report_path) or ".", exist_ok=True)
+            with open(self.report_path, "w", encoding="utf-8") as f:
+                json.dump(relatorio, f, ensure_ascii=False, indent=2)
+        except OSError:
+            pass
+        if primeiro_quadro is not None and (primeiro_quadro > self.target_ms or os.environ.get("PRINTBOX_STARTUP_REPORT")):
+            logger.info("Primeiro quadro em %.0f ms (meta: %d ms)", primeiro_quadro, self.target_ms)
+
+
+startup_timer = StartupTimer()
 
 
-# --- MÓDULO DE BANCO DE DADOS (Poderia ser um arquivo separado: database.py) ---
+class AvisoNaTela(logging.Handler):
+    """
+    Mostra numa caixa de aviso as falhas registradas pelo motor (gravação do
+    histórico, arquivamento, ...), que acontecem fora da thread da interface.
+    Cada mensagem aparece uma vez só; as repetições ficam só no LOG_FILE.
+    """
+    def __init__(self, root):
+        super().__init__(logging.ERROR)
+        self.root = root
+        self._mostradas = set()
+
+    def emit(self, record):
+        mensagem = self.format(record)
+        if mensagem in self._mostradas:
+            return
+        self._mostradas.add(mensagem)
+        try:
+            self.root.after(0, messagebox.showwarning, "PrintBox", mensagem)
+        except (tk.TclError, RuntimeError):
+            pass  # Janela já fechada
 
-DB_FILE = "print_log.db"
-GRUPOS_DIR = "grupos_de_arquivos"
 
-def setup_database():
-    """Cria o arquivo de banco de dados e a tabela de logs se não existirem."""
+def configurar_log(root):
+    """Manda os avisos do motor para o LOG_FILE e as falhas também para a tela."""
+    logger.setLevel(logging.INFO)
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS print_jobs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                filename TEXT NOT NULL,
-                group_name TEXT NOT NULL,
-                copies INTEGER NOT NULL,
-                status TEXT NOT NULL,
-                pages INTEGER
-            )
-        ''')
-        conn.commit()
-        conn.close()
-    except sqlite3.Error as e:
-        messagebox.showerror("Erro de Banco de Dados", f"Não foi possível inicializar o banco de dados: {e}")
-        sys.exit(1)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        arquivo = logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=1, encoding="utf-8")
+        arquivo.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+        logger.addHandler(arquivo)
+    except OSError:
+        logger.addHandler(logging.StreamHandler())
+    logger.addHandler(AvisoNaTela(root))
+
+
+def gerar_qr_code_png(dados: str, size: int) -> str:
+    """
+    Retorna o caminho de um PNG com o QR Code de `dados`, gerando-o apenas na
+    primeira vez. O Tk abre PNG sozinho, então nas aberturas seguintes nem o
+    qrcode nem o PIL precisam ser importados.
+    """
+    chave = hashlib.sha256(f"{size}:{dados}".encode()).hexdigest()[:16]
+    caminho = os.path.join(QR_CODE_DIR, f"qr_{chave}.png")
+    if os.path.exists(caminho):
+        return caminho
+
+    import qrcode
+    os.makedirs(QR_CODE_DIR, exist_ok=True)
+    img = qrcode.make(dados).resize((size, size))
+    tmp_path = f"{caminho}.{os.getpid()}.tmp"
+    img.save(tmp_path, format="PNG")
+    os.replace(tmp_path, caminho)
+    return caminho
+
+
+# --- COMPONENTES DA INTERFACE ---
+
+class VirtualCheckList(ttk.Frame):
+    """
+    Lista de caixas de seleção com rolagem virtual.
+
+    Só existem widgets para as linhas visíveis: ao rolar, as mesmas linhas
+    são reaproveitadas para mostrar outros itens. A seleção fica num `set`
+    com os nomes marcados, então trocar de grupo ou filtrar a lista não
+    cria nem destrói widgets.
+    """
+    def __init__(self, master, **kwargs):
+        super().__init__(master, **kwargs)
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+
+        self._items = []       # Todos os itens, na ordem de exibição
+        self._view = []        # Itens que passam pelo filtro atual
+        self._selected = set()
+        self._filter_text = ""
+        self._offset = 0       # Índice em _view da primeira linha visível
+        self._rows = []        # Pool de (Checkbutton, BooleanVar)
+        self._row_height = None
+
+        self._body = ttk.Frame(self)
+        self._body.grid(row=0, column=0, sticky="nsew")
+        self._body.grid_propagate(False)
+        self._body.columnconfigure(0, weight=1)
+        self._scrollbar = ttk.Scrollbar(self, orient="vertical", command=self._on_scrollbar)
+        self._scrollbar.grid(row=0, column=1, sticky="ns")
+
+        self._body.bind("<Configure>", lambda e: self._render())
+        self._bind_wheel(self._body)
+
+    # --- API ---
+
+    def set_items(self, items: List[str], keep_selection: bool = False):
+        """Troca o conteúdo da lista. Com `keep_selection`, mantém marcados os itens que continuarem nela."""
+        self._items = list(items)
+        self._selected = (self._selected & set(self._items)) if keep_selection else set()
+        self._apply_filter(self._filter_text)
+
+    def set_filter(self, text: str):
+        """Mostra apenas os itens que contêm `text` (sem diferenciar maiúsculas)."""
+        self._apply_filter(text)
+
+    def selected(self) -> List[str]:
+        """Itens marcados, na ordem da lista (inclusive os escondidos pelo filtro)."""
+        return [item for item in self._items if item in self._selected]
+
+    def select_all(self):
+        """Marca todos os itens visíveis com o filtro atual."""
+        self._selected.update(self._view)
+        self._render()
+
+    def select_none(self):
+        """Desmarca todos os itens visíveis com o filtro atual."""
+        self._selected.difference_update(self._view)
+        self._render()
+
+    # --- Desenho ---
+
+    def _apply_filter(self, text: str):
+        self._filter_text = text
+        termo = text.strip().lower()
+        self._view = [item for item in self._items if termo in item.lower()] if termo else list(self._items)
+        self._offset = 0
+        self._render()
+
+    def _visible_rows(self) -> int:
+        if self._row_height is None:
+            self._ensure_rows(1)
+            self._row_height = max(1, self._rows[0][0].winfo_reqheight())
+        return max(1, self._body.winfo_height() // self._row_height)
+
+    def _ensure_rows(self, count: int):
+        while len(self._rows) < count:
+            var = tk.BooleanVar()
+            idx = len(self._rows)
+            chk = ttk.Checkbutton(self._body, variable=var, command=lambda i=idx: self._on_toggle(i))
+            self._bind_wheel(chk)
+            self._rows.append((chk, var))
+
+    def _render(self):
+        visiveis = self._visible_rows()
+        self._ensure_rows(visiveis)
+        self._offset = max(0, min(self._offset, len(self._view) - visiveis))
+
+        for i, (chk, var) in enumerate(self._rows):
+            idx = self._offset + i
+            if i < visiveis and idx < len(self._view):
+                item = self._view[idx]
+                chk.configure(text=item)
+                var.set(item in self._selected)
+                chk.grid(row=i, column=0, sticky="w", padx=5)
+            else:
+                chk.grid_remove()
+
+        if self._view:
+            primeiro = self._offset / len(self._view)
+            ultimo = min(1.0, (self._offset + visiveis) / len(self._view))
+        else:
+            primeiro, ultimo = 0.0, 1.0
+        self._scrollbar.set(primeiro, ultimo)
+
+    # --- Eventos ---
+
+    def _on_toggle(self, row: int):
+        chk, var = self._rows[row]
+        item = self._view[self._offset + row]
+        if var.get():
+            self._selected.add(item)
+        else:
+            self._selected.discard(item)
+
+    def _on_scrollbar(self, *args):
+        visiveis = self._visible_rows()
+        if args[0] == "moveto":
+            self._offset = int(float(args[1]) * len(self._view))
+        elif args[0] == "scroll":
+            passo = visiveis if args[2] == "pages" else 1
+            self._offset += int(args[1]) * passo
+        self._render()
+
+    def _bind_wheel(self, widget):
+        widget.bind("<MouseWheel>", lambda e: self._scroll_units(-1 if e.delta > 0 else 1))
+        widget.bind("<Button-4>", lambda e: self._scroll_units(-1))  # Linux
+        widget.bind("<Button-5>", lambda e: self._scroll_units(1))
+
+    def _scroll_units(self, units: int):
+        self._offset += units * 3
+        self._render()
 
-def log_print_job(filename: str, group: str, copies: int, status: str, pages: Optional[int]):
-    """Registra um trabalho de impressão no banco de dados."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    timestamp = datetime.datetime.now().isoformat()
-    cursor.execute('''
-        INSERT INTO print_jobs (timestamp, filename, group_name, copies, status, pages)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (timestamp, filename, group, copies, status, pages))
-    conn.commit()
-    conn.close()
-
-def get_all_jobs() -> List[tuple]:
-    """Busca todos os trabalhos de impressão do banco de dados, ordenados por data."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT timestamp, filename, group_name, copies, pages, status FROM print_jobs ORDER BY timestamp DESC")
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
 
 # --- CLASSE PRINCIPAL DA APLICAÇÃO ---
 
@@ -86,14 +302,90 @@ class PDFPrinterApp:
     Aplicação com interface gráfica para gerenciar e imprimir
     grupos de arquivos PDF, com monitoramento e análise.
     """
-    def __init__(self, root: ThemedTk):
+    def __init__(self, root: tk.Tk):
         self.root = root
+        self.root.bind("<Map>", self._on_primeiro_quadro, add="+")
         self._setup_main_window()
         self._setup_variables()
         self._criar_diretorio_grupos()
 
+        # Com um servidor de impressão (PRINTBOX_SERVER), a janela é só um cliente dele
+        self.servidor = self._conectar_servidor()
+        self._meus_trabalhos = set()  # Trabalhos enviados por esta janela (para avisar das falhas)
+        self.historico = self.servidor or printbox_core  # query_jobs, get_daily_stats, ...
+
+        if self.servidor is not None:
+            from printbox_server import RemoteGroupIndex
+            self.group_index = RemoteGroupIndex(self.servidor)
+        else:
+            # Início rápido: mostra os grupos da última execução e confere a pasta em segundo plano
+            self.group_index = GroupIndex()
+        self.group_index.load_snapshot()
+        self.group_index.subscribe(
+            lambda alterados, lista_mudou: self.root.after(0, self._on_grupos_alterados, alterados, lista_mudou)
+        )
         self.grupos = self.carregar_grupos()
+        self.scheduler = self._criar_fila()
         self._setup_ui()
+        self.scheduler.start()
+        self.group_index.start()
+        self.root.protocol("WM_DELETE_WINDOW", self._ao_fechar)
+        threading.Thread(target=self._carregar_impressoras, daemon=True).start()
+
+        self.spool_tracker = None
+        self.sync_worker = None
+        if self.servidor is None:
+            # Confere no spooler se os trabalhos enviados foram de fato impressos
+            self.spool_tracker = SpoolTracker()
+            self.spool_tracker.start()
+            # Versões prontas para as impressoras com perfil (printer_profiles.json)
+            render_cache.watch(self.group_index)
+            if RETENTION_DAYS > 0:
+                # Leva o histórico antigo para os arquivos mensais (PRINTBOX_RETENTION_DAYS)
+                threading.Thread(target=self._arquivar_historico, daemon=True).start()
+            if SYNC_DIR:
+                # Envia o histórico para a pasta central (PRINTBOX_SYNC_DIR)
+                from printbox_sync import SyncWorker
+                self.sync_worker = SyncWorker(SYNC_DIR)
+                self.sync_worker.start()
+        startup_timer.mark("interface_montada")
+
+    def _arquivar_historico(self):
+        try:
+            apply_retention()
+        except (sqlite3.Error, OSError) as e:
+            logger.error("Falha ao arquivar o histórico: %s", e)
+
+    def _conectar_servidor(self):
+        """Retorna o cliente do servidor de impressão, ou None para trabalhar sozinho."""
+        endereco = os.environ.get(SERVER_ENV, "").strip()
+        if not endereco:
+            return None
+        from printbox_server import PrintBoxClient
+        servidor = PrintBoxClient(endereco)
+        if not servidor.ping():
+            messagebox.showwarning("Servidor de Impressão",
+                                   f"O servidor {endereco} não respondeu.\nEsta sessão vai imprimir diretamente, sem o servidor.")
+            return None
+        return servidor
+
+    def _criar_fila(self):
+        """Fila local (despachada por esta janela) ou a fila do servidor."""
+        atualizar = lambda: self.root.after(0, self.refresh_fila)
+        if self.servidor is None:
+            return PrintScheduler(self._processar_impressao_thread, on_change=atualizar)
+        from printbox_server import RemoteScheduler
+        return RemoteScheduler(
+            self.servidor, on_change=atualizar,
+            on_progress=lambda job_id, valor, mensagem: self.root.after(0, self._mostrar_progresso, job_id, valor, mensagem),
+            on_history=lambda *dados: self.root.after(0, self._trabalho_concluido, *dados),
+        )
+
+    def _on_primeiro_quadro(self, event):
+        """Registra o tempo até a janela aparecer pela primeira vez."""
+        if event.widget is self.root:
+            self.root.unbind("<Map>")
+            startup_timer.mark("primeiro_quadro", salvar=True)
         
 
     def _setup_main_window(self):
@@ -108,8 +400,9 @@ class PDFPrinterApp:
         """Inicializa as variáveis de controle do Tkinter."""
         self.grupo_var = tk.StringVar()
         self.num_copias_var = tk.IntVar(value=1)
-        self.check_vars = {}
-        self.is_printing = threading.Event() # Para controlar se uma impressão está em andamento
+        self.mesclar_var = tk.BooleanVar(value=False)
+        self.impressora_var = tk.StringVar(value=IMPRESSORA_PADRAO)
+        self.filtro_arquivos_var = tk.StringVar()
 
     def _setup_ui(self):
         """Constrói a interface gráfica do usuário."""
@@ -149,8 +442,17 @@ class PDFPrinterApp:
         files_frame.grid(row=1, column=0, columnspan=2, sticky="nsew", pady=10)
         self.print_tab.rowconfigure(1, weight=1)
 
-        self.checkbox_frame = ttk.Frame(files_frame)
-        self.checkbox_frame.pack(expand=True, fill='both')
+        list_tools = ttk.Frame(files_frame)
+        list_tools.pack(fill='x', pady=(0, 5))
+        ttk.Label(list_tools, text="Filtrar:").pack(side='left')
+        filtro_entry = ttk.Entry(list_tools, textvariable=self.filtro_arquivos_var, width=25)
+        filtro_entry.pack(side='left', padx=5)
+        filtro_entry.bind("<KeyRelease>", lambda e: self.lista_arquivos.set_filter(self.filtro_arquivos_var.get()))
+        ttk.Button(list_tools, text="Nenhum", command=lambda: self.lista_arquivos.select_none()).pack(side='right')
+        ttk.Button(list_tools, text="Todos", command=lambda: self.lista_arquivos.select_all()).pack(side='right', padx=5)
+
+        self.lista_arquivos = VirtualCheckList(files_frame)
+        self.lista_arquivos.pack(expand=True, fill='both')
 
         options_frame = ttk.Frame(self.print_tab)
         options_frame.grid(row=2, column=0, columnspan=2, sticky="ew", pady=10)
@@ -163,6 +465,16 @@ class PDFPrinterApp:
         self.print_button = ttk.Button(options_frame, text="Imprimir Selecionados", command=self.imprimir_selecionados)
         self.print_button.grid(row=0, column=2, padx=5, sticky="e")
         options_frame.columnconfigure(2, weight=1)
+
+        ttk.Checkbutton(
+            options_frame, text="Enviar como um único trabalho (mescla os PDFs)", variable=self.mesclar_var
+        ).grid(row=1, column=0, columnspan=3, padx=5, pady=(5, 0), sticky="w")
+
+        ttk.Label(options_frame, text="Impressora:").grid(row=2, column=0, padx=5, pady=(5, 0))
+        self.impressora_dropdown = ttk.Combobox(
+            options_frame, textvariable=self.impressora_var, values=[IMPRESSORA_PADRAO], state="readonly"
+        )
+        self.impressora_dropdown.grid(row=2, column=1, columnspan=2, padx=5, pady=(5, 0), sticky="w")
         
         # Frame de status
         status_frame = ttk.LabelFrame(self.print_tab, text="Status da Impressão", padding="10")
@@ -173,12 +485,67 @@ class PDFPrinterApp:
         self.status_label = ttk.Label(status_frame, text="Aguardando uma tarefa...")
         self.status_label.pack(fill="x", expand=True)
 
+        # Frame da fila de impressão
+        queue_frame = ttk.LabelFrame(self.print_tab, text="Fila de Impressão", padding="10")
+        queue_frame.grid(row=4, column=0, columnspan=2, sticky="ew")
+        queue_frame.columnconfigure(0, weight=1)
+
+        cols = ('#', 'Grupo', 'Arquivos', 'Cópias', 'Impressora', 'Status')
+        self.fila_treeview = ttk.Treeview(queue_frame, columns=cols, show='headings', height=4)
+        for col in cols:
+            self.fila_treeview.heading(col, text=col)
+        self.fila_treeview.column('#', width=40, anchor='center')
+        self.fila_treeview.column('Grupo', width=150)
+        self.fila_treeview.column('Arquivos', width=70, anchor='center')
+        self.fila_treeview.column('Cópias', width=60, anchor='center')
+        self.fila_treeview.column('Impressora', width=100)
+        self.fila_treeview.column('Status', width=90, anchor='center')
+        self.fila_treeview.grid(row=0, column=0, sticky="ew")
+
+        fila_actions = ttk.Frame(queue_frame)
+        fila_actions.grid(row=1, column=0, sticky="e", pady=(5, 0))
+        ttk.Button(fila_actions, text="Cancelar", command=self.cancelar_trabalho).pack(side='left', padx=5)
+        ttk.Button(fila_actions, text="Repetir", command=self.repetir_trabalho).pack(side='left', padx=5)
+        self.pausar_button = ttk.Button(fila_actions, text="Pausar Fila", command=self.alternar_pausa)
+        self.pausar_button.pack(side='left', padx=5)
+
+        self.refresh_fila()
+
     def _setup_monitoring_tab(self):
         """Configura a aba de monitoramento."""
         self.monitor_tab.columnconfigure(0, weight=1)
-        self.monitor_tab.rowconfigure(0, weight=1)
-        
-        cols = ('Data/Hora', 'Arquivo', 'Grupo', 'Cópias', 'Páginas', 'Status')
+        self.monitor_tab.rowconfigure(1, weight=1)
+
+        # Filtros do histórico
+        filter_frame = ttk.Frame(self.monitor_tab)
+        filter_frame.grid(row=0, column=0, columnspan=2, sticky="ew", pady=(0, 10))
+
+        self.filtro_data_inicio_var = tk.StringVar()
+        self.filtro_data_fim_var = tk.StringVar()
+        self.filtro_grupo_var = tk.StringVar()
+        self.filtro_status_var = tk.StringVar()
+        self.filtro_arquivo_var = tk.StringVar()
+
+        ttk.Label(filter_frame, text="De:").pack(side='left')
+        ttk.Entry(filter_frame, textvariable=self.filtro_data_inicio_var, width=11).pack(side='left', padx=(2, 8))
+        ttk.Label(filter_frame, text="Até:").pack(side='left')
+        ttk.Entry(filter_frame, textvariable=self.filtro_data_fim_var, width=11).pack(side='left', padx=(2, 8))
+        ttk.Label(filter_frame, text="Grupo:").pack(side='left')
+        self.filtro_grupo_dropdown = ttk.Combobox(
+            filter_frame, textvariable=self.filtro_grupo_var, values=[""] + self.grupos, width=16
+        )
+        self.filtro_grupo_dropdown.pack(side='left', padx=(2, 8))
+        ttk.Label(filter_frame, text="Status:").pack(side='left')
+        ttk.Combobox(
+            filter_frame, textvariable=self.filtro_status_var, values=["", "Sucesso", "Falha"], width=8, state="readonly"
+        ).pack(side='left', padx=(2, 8))
+        ttk.Label(filter_frame, text="Arquivo:").pack(side='left')
+        arquivo_entry = ttk.Entry(filter_frame, textvariable=self.filtro_arquivo_var, width=14)
+        arquivo_entry.pack(side='left', padx=(2, 8))
+        arquivo_entry.bind("<Return>", lambda e: self.refresh_monitoring_data())
+        ttk.Button(filter_frame, text="Filtrar", command=self.refresh_monitoring_data).pack(side='left')
+
+        cols = ('Data/Hora', 'Arquivo', 'Grupo', 'Cópias', 'Páginas', 'Status', 'Spooler')
         self.jobs_treeview = ttk.Treeview(self.monitor_tab, columns=cols, show='headings')
 
         for col in cols:
@@ -189,22 +556,32 @@ class PDFPrinterApp:
         self.jobs_treeview.column('Cópias', width=60, anchor='center')
         self.jobs_treeview.column('Páginas', width=60, anchor='center')
         self.jobs_treeview.column('Status', width=80, anchor='center')
+        self.jobs_treeview.column('Spooler', width=90, anchor='center')
         
-        self.jobs_treeview.grid(row=0, column=0, sticky="nsew")
+        self.jobs_treeview.grid(row=1, column=0, sticky="nsew")
+
+        # Scrollbar para a Treeview: ao chegar perto do fim, carrega a próxima página
+        self.jobs_scrollbar = ttk.Scrollbar(self.monitor_tab, orient="vertical", command=self.jobs_treeview.yview)
+        self.jobs_treeview.configure(yscrollcommand=self._on_jobs_scroll)
+        self.jobs_scrollbar.grid(row=1, column=1, sticky="ns")
 
-        # Scrollbar para a Treeview
-        scrollbar = ttk.Scrollbar(self.monitor_tab, orient="vertical", command=self.jobs_treeview.yview)
-        self.jobs_treeview.configure(yscrollcommand=scrollbar.set)
-        scrollbar.grid(row=0, column=1, sticky="ns")
+        self._jobs_cursor = None      # (timestamp, id) da última linha carregada
+        self._jobs_esgotados = False  # Não há mais páginas para o filtro atual
+        self._jobs_pagina_agendada = False
+        self._jobs_max_id = None      # Maior id já verificado pela atualização incremental
+        self._jobs_geracao = 0        # Descarta cargas em segundo plano que ficaram obsoletas
+        self._jobs_filtro = JobFilter()
 
         # Botões de Ação
         action_frame = ttk.Frame(self.monitor_tab)
-        action_frame.grid(row=1, column=0, columnspan=2, pady=10, sticky="e")
+        action_frame.grid(row=2, column=0, columnspan=2, pady=10, sticky="e")
         
+        ttk.Button(action_frame, text="Trabalhos Mais Lentos", command=self.mostrar_trabalhos_lentos).pack(side='left', padx=5)
         ttk.Button(action_frame, text="Gerar Gráfico de Análise", command=self.show_prints_per_day_chart).pack(side='left', padx=5)
         ttk.Button(action_frame, text="Atualizar Dados", command=self.refresh_monitoring_data).pack(side='left', padx=5)
 
         self.refresh_monitoring_data()
+        self.root.after(MONITOR_POLL_MS, self._poll_novos_jobs)
 
 
     def _setup_info_panel(self):
@@ -228,11 +605,10 @@ class PDFPrinterApp:
         ttk.Label(donation_frame, text="Apoie o projeto:", font=("Arial", 10)).pack()
         ttk.Label(donation_frame, text="Chave PIX: isarloiola@gmail.com", font=("Arial", 9, "italic")).pack()
         
-        try:
-            self.qr_code_image = self.criar_qr_code("00020101021126580014br.gov.bcb.pix0136e99fe61e-c0d7-4b28-8449-3b10bf07c8515204000053039865802BR5917ISAR BAERE LOIOLA6013RIO DE JANEIR62070503***6304D833", 150)
-            ttk.Label(donation_frame, image=self.qr_code_image).pack(pady=10)
-        except Exception as e:
-            ttk.Label(donation_frame, text=f"Erro ao gerar QR Code: {e}").pack()
+        # O QR Code vem do cache em disco; na primeira execução é gerado em segundo plano
+        self.qr_code_label = ttk.Label(donation_frame)
+        self.qr_code_label.pack(pady=10)
+        threading.Thread(target=self._carregar_qr_code, daemon=True).start()
         
         ttk.Button(self.info_frame, text="Ajuda", command=self.exibir_ajuda).pack(pady=10, fill='x')
 
@@ -251,51 +627,34 @@ class PDFPrinterApp:
                 sys.exit(1)
 
     def carregar_grupos(self) -> List[str]:
-        """Carrega os grupos de arquivos (pastas)."""
-        try:
-            return [nome for nome in os.listdir(GRUPOS_DIR) if os.path.isdir(os.path.join(GRUPOS_DIR, nome))]
-        except OSError as e:
-            messagebox.showerror("Erro", f"Erro ao carregar grupos: {e}")
-            return []
+        """Carrega os grupos de arquivos (pastas) a partir do índice em memória."""
+        return self.group_index.groups()
+
+    def _on_grupos_alterados(self, alterados: set, lista_mudou: bool):
+        """Recebe os avisos do índice de grupos e atualiza a interface."""
+        if lista_mudou:
+            self.grupos = self.carregar_grupos()
+            self.grupo_dropdown['values'] = self.grupos
+            self.filtro_grupo_dropdown['values'] = [""] + self.grupos
+        if self.grupo_var.get() in alterados:
+            self.carregar_pdfs()
 
     def carregar_pdfs(self, event=None):
         """Carrega os arquivos PDF de um grupo selecionado."""
-        for widget in self.checkbox_frame.winfo_children():
-            widget.destroy()
-
         grupo_selecionado = self.grupo_var.get()
         if not grupo_selecionado or grupo_selecionado == "Selecione um grupo":
+            self.lista_arquivos.set_items([])
             return
 
-        grupo_path = os.path.join(GRUPOS_DIR, grupo_selecionado)
-        try:
-            pdf_files = [f for f in os.listdir(grupo_path) if f.lower().endswith(".pdf")]
-        except OSError as e:
-            messagebox.showerror("Erro", f"Erro ao listar arquivos PDF: {e}")
-            return
-
-        self.check_vars = {}
-        for idx, file in enumerate(sorted(pdf_files)):
-            var = tk.BooleanVar()
-            self.check_vars[file] = var
-            chk = ttk.Checkbutton(self.checkbox_frame, text=file, variable=var)
-            chk.pack(anchor='w', padx=5)
+        # Preserva as marcações quando o mesmo grupo é recarregado (event=None)
+        self.lista_arquivos.set_items(self.group_index.files(grupo_selecionado), keep_selection=event is None)
 
     def _get_pdf_page_count(self, file_path: str) -> Optional[int]:
-        """Retorna o número de páginas de um arquivo PDF."""
-        try:
-            with open(file_path, 'rb') as f:
-                reader = PdfReader(f, strict=False)
-                return len(reader.pages)
-        except Exception:
-            return None
+        """Retorna o número de páginas de um arquivo PDF (consultando o cache de metadados)."""
+        return metadata_cache.get_page_count(file_path)
 
     def _iniciar_processo_impressao(self, arquivos_para_imprimir: List[str]):
-        """Valida e inicia a thread de impressão."""
-        if self.is_printing.is_set():
-            messagebox.showwarning("Atenção", "Um processo de impressão já está em andamento. Aguarde.")
-            return
-
+        """Valida o pedido e o coloca na fila de impressão."""
         grupo_selecionado = self.grupo_var.get()
         if not grupo_selecionado or grupo_selecionado == "Selecione um grupo":
             messagebox.showwarning("Atenção", "Selecione um grupo de arquivos primeiro.")
@@ -314,80 +673,125 @@ class PDFPrinterApp:
             messagebox.showerror("Erro", "Número de cópias inválido.")
             return
 
-        # Inicia a impressão em uma nova thread para não travar a GUI
-        print_thread = threading.Thread(
-            target=self._processar_impressao_thread,
-            args=(arquivos_para_imprimir, num_copias, grupo_selecionado)
-        )
-        print_thread.start()
+        # A fila despacha o trabalho em segundo plano; a interface fica livre para novos pedidos
+        impressora = self.impressora_var.get()
+        try:
+            job_id = self.scheduler.enqueue(
+                grupo_selecionado, sorted(arquivos_para_imprimir), num_copias,
+                merge=self.mesclar_var.get(), printer="" if impressora == IMPRESSORA_PADRAO else impressora
+            )
+        except (sqlite3.Error, OSError) as e:
+            messagebox.showerror("Erro", f"Não foi possível colocar o trabalho na fila: {e}")
+            return
+        self._meus_trabalhos.add(job_id)
+        self.status_label.config(text=f'Trabalho #{job_id} ({grupo_selecionado}) adicionado à fila.')
 
     def imprimir_grupo(self):
         """Prepara todos os arquivos do grupo para impressão."""
         grupo_selecionado = self.grupo_var.get()
-        grupo_path = os.path.join(GRUPOS_DIR, grupo_selecionado)
-        try:
-            pdf_files = [f for f in os.listdir(grupo_path) if f.lower().endswith(".pdf")]
-            self._iniciar_processo_impressao(pdf_files)
-        except OSError as e:
-            messagebox.showerror("Erro", f"Não foi possível ler os arquivos do grupo: {e}")
+        self._iniciar_processo_impressao(self.group_index.files(grupo_selecionado))
 
     def imprimir_selecionados(self):
         """Prepara os arquivos selecionados para impressão."""
-        selected_files = [file for file, var in self.check_vars.items() if var.get()]
+        selected_files = self.lista_arquivos.selected()
         self._iniciar_processo_impressao(selected_files)
 
-    def _processar_impressao_thread(self, files_to_print: List[str], num_copias: int, grupo: str):
+    def _processar_impressao_thread(self, job: QueuedJob) -> bool:
         """
-        Executa a impressão em uma thread separada para não bloquear a interface.
+        Worker da fila de impressão: executa um trabalho numa thread do pool,
+        sem bloquear a interface. Retorna True se todos os arquivos foram enviados.
         """
-        self.is_printing.set()
-        total_files = len(files_to_print)
-        grupo_path = os.path.join(GRUPOS_DIR, grupo)
-
-        for idx, filename in enumerate(files_to_print):
-            progress = (idx + 1) / total_files * 100
-            self.root.after(0, self.progress_bar.config, {'value': progress})
-            self.root.after(0, self.status_label.config, {'text': f'Imprimindo {idx+1}/{total_files}: {filename}'})
-            
-            full_path = os.path.join(grupo_path, filename)
-            pages = self._get_pdf_page_count(full_path)
-            
-            status = "Sucesso"
-            try:
-                for _ in range(num_copias):
-                    self._print_pdf_subprocess(full_path)
-            except Exception as e:
-                status = "Falha"
-                self.root.after(0, messagebox.showerror, "Erro de Impressão", f"Falha ao imprimir {filename}: {e}")
-
-            log_print_job(filename, grupo, num_copias, status, pages)
-
-        # Tarefa concluída
-        self.root.after(0, self.status_label.config, {'text': f'Impressão de {total_files} arquivo(s) concluída!'})
-        self.root.after(0, self.progress_bar.config, {'value': 0})
-        self.root.after(0, messagebox.showinfo, "Concluído", "Todos os arquivos foram enviados para a fila de impressão.")
-        self.root.after(0, self.refresh_monitoring_data) # Atualiza a aba de monitoramento
-        self.is_printing.clear()
-
-    def _print_pdf_subprocess(self, file_path: str):
-        """Chama o comando do sistema para imprimir o PDF."""
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"O arquivo {file_path} não foi encontrado.")
-            
+        def progresso(valor: float, mensagem: str):
+            self.root.after(0, self._mostrar_progresso, job.id, valor, mensagem, time.perf_counter())
+
+        resultados = run_print_job(job.group_name, job.files, job.copies, merge=job.merge, printer=job.printer,
+                                   on_progress=progresso, is_cancelled=lambda: self.scheduler.is_cancelled(job.id))
+
+        falhas = [r for r in resultados if r.status != RESULTADO_SUCESSO]
+        self.root.after(0, self._trabalho_concluido, job.id, job.group_name, len(job.files), falhas)
+        return not falhas and len(resultados) == len(job.files)
+
+    def _mostrar_progresso(self, job_id: int, valor: float, mensagem: str, agendado: Optional[float] = None):
+        if agendado is not None:
+            # Quanto a atualização esperou na fila de eventos do Tk
+            metrics.observe(ETAPA_INTERFACE, time.perf_counter() - agendado)
+        self.progress_bar.config(value=valor)
+        self.status_label.config(text=f'[#{job_id}] {mensagem}')
+
+    def _trabalho_concluido(self, job_id: int, grupo: str, total_files: int, falhas: List[FileResult]):
+        """Fim de um trabalho (desta janela ou, com servidor, de qualquer estação)."""
+        if self.servidor is not None and job_id not in self._meus_trabalhos:
+            self.atualizar_novos_jobs()
+            return
+        self._meus_trabalhos.discard(job_id)
+        if falhas:
+            detalhes = "\n".join(f"{r.filename}: {r.error}" for r in falhas[:10])
+            if len(falhas) > 10:
+                detalhes += f"\n... e mais {len(falhas) - 10} arquivo(s)"
+            messagebox.showerror("Erro de Impressão", f"Falha ao imprimir {len(falhas)} arquivo(s) do grupo {grupo}:\n{detalhes}")
+
+        self.status_label.config(text=f'[#{job_id}] Impressão de {total_files} arquivo(s) do grupo {grupo} concluída!')
+        self.progress_bar.config(value=0)
+        self.atualizar_novos_jobs() # Acrescenta as novas linhas na aba de monitoramento
+
+    def refresh_fila(self):
+        """Recarrega a lista de trabalhos da fila de impressão."""
+        for i in self.fila_treeview.get_children():
+            self.fila_treeview.delete(i)
+        for job in self.scheduler.list_jobs():
+            self.fila_treeview.insert("", "end", iid=str(job.id), values=(
+                job.id, job.group_name, len(job.files), job.copies, job.printer or IMPRESSORA_PADRAO, job.status
+            ))
+        self.pausar_button.config(text="Retomar Fila" if self.scheduler.paused else "Pausar Fila")
+
+    def _trabalho_selecionado(self) -> Optional[int]:
+        selecao = self.fila_treeview.selection()
+        if not selecao:
+            messagebox.showwarning("Atenção", "Selecione um trabalho na fila.")
+            return None
+        return int(selecao[0])
+
+    def cancelar_trabalho(self):
+        """Cancela o trabalho selecionado na fila."""
+        job_id = self._trabalho_selecionado()
+        if job_id is not None and not self.scheduler.cancel(job_id):
+            messagebox.showwarning("Atenção", "Só é possível cancelar trabalhos na fila ou imprimindo.")
+
+    def repetir_trabalho(self):
+        """Recoloca na fila um trabalho que falhou ou foi cancelado."""
+        job_id = self._trabalho_selecionado()
+        if job_id is not None and not self.scheduler.retry(job_id):
+            messagebox.showwarning("Atenção", "Só é possível repetir trabalhos com falha ou cancelados.")
+
+    def alternar_pausa(self):
+        """Pausa ou retoma o despacho da fila de impressão."""
+        if self.scheduler.paused:
+            self.scheduler.resume()
+        else:
+            self.scheduler.pause()
+
+    def _carregar_impressoras(self):
+        """Busca as impressoras disponíveis em segundo plano e preenche a lista."""
         try:
-            if sys.platform == "win32":
-                # Tenta usar o comando 'print' que é mais universal no Windows moderno
-                # Se falhar, pode-se adicionar um fallback para 'start acrord32.exe /p /h'
-                os.startfile(file_path, "print")
-            elif sys.platform == "darwin": # macOS
-                subprocess.run(["lpr", file_path], check=True)
-            else: # Linux e outros
-                subprocess.run(["lp", file_path], check=True)
-        except Exception as e:
-            raise OSError(f"Comando de impressão falhou: {e}")
+            impressoras = [IMPRESSORA_PADRAO] + self.historico.listar_impressoras()
+        except OSError:
+            impressoras = [IMPRESSORA_PADRAO]
+        self.root.after(0, self.impressora_dropdown.config, {'values': impressoras})
+
+    def _ao_fechar(self):
+        """Encerra a fila sem esperar: trabalhos pendentes continuam salvos para a próxima execução."""
+        self.scheduler.stop(wait=False)
+        self.group_index.stop()
+        if self.spool_tracker is not None:
+            self.spool_tracker.stop()
+        if self.sync_worker is not None:
+            self.sync_worker.stop()
+        render_cache.stop()
+        self.root.destroy()
+        close_databases()
 
     def upload_arquivos(self):
-        """Permite criar um novo grupo com arquivos PDF, via seleção de arquivos ou pasta."""
+        """Cria um grupo (ou atualiza um existente) com arquivos PDF, via seleção de arquivos ou pasta."""
         arquivos = []
         usar_pasta = messagebox.askyesno(
             "Upload",
@@ -401,6 +805,9 @@ class PDFPrinterApp:
                 return
             nome_grupo = os.path.basename(pasta)
             arquivos = [os.path.join(pasta, f) for f in os.listdir(pasta) if f.lower().endswith(".pdf")]
+            if not arquivos:
+                messagebox.showwarning("Atenção", "Nenhum arquivo PDF encontrado na pasta.")
+                return
         else:
             # Seleção de arquivos
             arquivos = filedialog.askopenfilenames(
@@ -413,33 +820,69 @@ class PDFPrinterApp:
             if not nome_grupo:
                 return
 
-        grupo_path = os.path.join(GRUPOS_DIR, nome_grupo)
+        # Importação em segundo plano, com progresso e cancelamento. Um grupo que
+        # já existe é atualizado: só os arquivos novos ou alterados são copiados.
+        cancelar = threading.Event()
+        janela = tk.Toplevel(self.root)
+        janela.title(f"Importando {nome_grupo}")
+        janela.transient(self.root)
+        janela.resizable(False, False)
+        mensagem_label = ttk.Label(janela, text=f"Preparando {len(arquivos)} arquivo(s)...", width=60)
+        mensagem_label.pack(padx=15, pady=(15, 5))
+        barra = ttk.Progressbar(janela, orient='horizontal', mode='determinate', length=400)
+        barra.pack(padx=15, pady=5)
+
+        def pedir_cancelamento():
+            cancelar.set()
+            cancelar_button.config(text="Cancelando...", state="disabled")
+
+        cancelar_button = ttk.Button(janela, text="Cancelar", command=pedir_cancelamento)
+        cancelar_button.pack(pady=(5, 15))
+        janela.protocol("WM_DELETE_WINDOW", pedir_cancelamento)
+
+        def mostrar(valor: float, mensagem: str):
+            if janela.winfo_exists():
+                barra.config(value=valor)
+                mensagem_label.config(text=mensagem)
+
+        def importar():
+            try:
+                resultado = import_group(nome_grupo, list(arquivos), is_cancelled=cancelar.is_set,
+                                         on_progress=lambda valor, mensagem: self.root.after(0, mostrar, valor, mensagem))
+            except (OSError, ValueError) as e:
+                self.root.after(0, self._importacao_concluida, janela, nome_grupo, None, str(e))
+                return
+            self.root.after(0, self._importacao_concluida, janela, nome_grupo, resultado, "")
 
-        if os.path.exists(grupo_path):
-            messagebox.showerror("Erro", f"O grupo '{nome_grupo}' já existe.")
-            return
+        threading.Thread(target=importar, daemon=True).start()
 
-        try:
-            os.makedirs(grupo_path)
-        except Exception as e:
-            messagebox.showerror("Erro", f"Erro ao criar o grupo: {e}")
+    def _importacao_concluida(self, janela: tk.Toplevel, nome_grupo: str, resultado: Optional[ImportResult], erro: str):
+        janela.destroy()
+        if resultado is None:
+            messagebox.showerror("Erro", f"Erro ao importar o grupo '{nome_grupo}': {erro}")
+            return
+        if resultado.cancelled:
+            messagebox.showinfo("Upload", f"Importação cancelada. O grupo '{nome_grupo}' não foi alterado.")
             return
-
-        copiados = 0
-        for arquivo in arquivos:
-            try:
-                shutil.copy(arquivo, grupo_path)
-                copiados += 1
-            except Exception as e:
-                messagebox.showwarning("Erro", f"Erro ao copiar {os.path.basename(arquivo)}: {e}")
 
         # Atualiza os grupos disponíveis
-        self.grupos = self.carregar_grupos()
-        self.grupo_dropdown['values'] = self.grupos
-        self.grupo_dropdown.set(nome_grupo)
-        self.carregar_pdfs()
-
-        messagebox.showinfo("Sucesso", f"{copiados} arquivo(s) foram adicionados ao grupo '{nome_grupo}'.")
+        self.group_index.refresh(nome_grupo)
+        if nome_grupo in self.group_index.groups():
+            self.grupo_dropdown.set(nome_grupo)
+            self.carregar_pdfs()
+
+        resumo = f"{len(resultado.added)} arquivo(s) adicionado(s) ao grupo '{nome_grupo}'."
+        if resultado.updated:
+            resumo += f"\n{len(resultado.updated)} arquivo(s) atualizado(s)."
+        if resultado.unchanged:
+            resumo += f"\n{len(resultado.unchanged)} arquivo(s) já estavam no grupo."
+        if resultado.invalid:
+            detalhes = "\n".join(f"{nome}: {motivo}" for nome, motivo in resultado.invalid[:10])
+            if len(resultado.invalid) > 10:
+                detalhes += f"\n... e mais {len(resultado.invalid) - 10} arquivo(s)"
+            messagebox.showwarning("Upload", f"{resumo}\n\n{len(resultado.invalid)} arquivo(s) ignorado(s):\n{detalhes}")
+        else:
+            messagebox.showinfo("Sucesso", resumo)
 
     def exibir_ajuda(self):
         """Exibe uma caixa de diálogo com informações de ajuda."""
@@ -454,70 +897,318 @@ class PDFPrinterApp:
             "6. **Monitoramento:** A aba 'Monitoramento' mostra um histórico de todas as impressões e permite gerar análises gráficas."
         )
 
-    def criar_qr_code(self, dados: str, size: int) -> ImageTk.PhotoImage:
-        """Cria uma imagem de QR Code."""
-        img = qrcode.make(dados)
-        img = img.resize((size, size))
-        return ImageTk.PhotoImage(img)
+    def criar_qr_code(self, dados: str, size: int) -> tk.PhotoImage:
+        """Cria uma imagem de QR Code (a partir do PNG em cache)."""
+        return tk.PhotoImage(file=gerar_qr_code_png(dados, size))
+
+    def _carregar_qr_code(self):
+        """Gera/localiza o PNG do QR Code fora da thread da interface e o exibe quando pronto."""
+        try:
+            gerar_qr_code_png(PIX_PAYLOAD, 150)
+        except Exception as e:
+            self.root.after(0, self.qr_code_label.config, {'text': f"Erro ao gerar QR Code: {e}"})
+            return
+
+        def exibir():
+            self.qr_code_image = self.criar_qr_code(PIX_PAYLOAD, 150)
+            self.qr_code_label.config(image=self.qr_code_image)
+            startup_timer.mark("qr_code")
+        self.root.after(0, exibir)
 
     def refresh_monitoring_data(self):
-        """Limpa e recarrega os dados na Treeview de monitoramento."""
+        """
+        Limpa a Treeview de monitoramento e carrega a primeira página do histórico.
+        A consulta roda em segundo plano e a tabela é preenchida quando ela termina.
+        """
+        try:
+            filtro = self._filtro_monitoramento()
+        except ValueError:
+            messagebox.showerror("Erro", "Data inválida. Use o formato DD/MM/AAAA.")
+            return
+
         for i in self.jobs_treeview.get_children():
             self.jobs_treeview.delete(i)
 
-        jobs = get_all_jobs()
+        self._jobs_filtro = filtro
+        self._jobs_cursor = None
+        self._jobs_esgotados = True   # Sem paginação nem atualização incremental até a carga terminar
+        self._jobs_max_id = None
+        self._jobs_geracao += 1
+        geracao = self._jobs_geracao
+
+        def carregar():
+            try:
+                # Lido antes da primeira página: linhas gravadas no meio do caminho
+                # aparecem na próxima atualização incremental (duplicatas são ignoradas)
+                max_id = self.historico.get_max_job_id()
+                jobs = self.historico.query_jobs(filtro)
+            except (sqlite3.Error, OSError) as e:
+                self.root.after(0, messagebox.showerror, "Erro de Banco de Dados", f"Não foi possível ler o histórico: {e}")
+                return
+            self.root.after(0, self._preencher_primeira_pagina_jobs, geracao, max_id, jobs)
+
+        threading.Thread(target=carregar, daemon=True).start()
+
+    def _preencher_primeira_pagina_jobs(self, geracao: int, max_id: int, jobs: List[tuple]):
+        if geracao != self._jobs_geracao:
+            return  # Outra atualização foi pedida enquanto esta carregava
+        self._jobs_max_id = max_id
+        self._jobs_esgotados = False
+        self._inserir_pagina_jobs(jobs)
+        startup_timer.mark("historico")
+
+    def atualizar_novos_jobs(self):
+        """
+        Acrescenta ao topo da Treeview apenas as impressões com id maior que o
+        último verificado, sem recarregar o histórico inteiro.
+        """
+        if self._jobs_max_id is None:
+            return  # A primeira página ainda está carregando
+        while True:
+            jobs = self.historico.query_jobs_since(self._jobs_max_id, self._jobs_filtro)
+            for job in jobs:
+                iid = str(job[0])
+                if not self.jobs_treeview.exists(iid):
+                    self.jobs_treeview.insert("", 0, iid=iid, values=self._valores_job(job))
+            if jobs:
+                self._jobs_max_id = jobs[-1][0]
+            if len(jobs) < JOBS_PAGE_SIZE:
+                break
+
+    def _poll_novos_jobs(self):
+        """Verifica periodicamente se há impressões novas (desta ou de outras estações)."""
+        try:
+            self.atualizar_novos_jobs()
+        except (sqlite3.Error, OSError):
+            pass  # Banco ocupado ou servidor fora do ar: tenta de novo no próximo ciclo
+        self.root.after(MONITOR_POLL_MS, self._poll_novos_jobs)
+
+    def _filtro_monitoramento(self) -> JobFilter:
+        """Monta o filtro a partir dos campos da aba de monitoramento."""
+        def data_iso(texto: str) -> Optional[str]:
+            texto = texto.strip()
+            if not texto:
+                return None
+            return datetime.datetime.strptime(texto, '%d/%m/%Y').date().isoformat()
+
+        return JobFilter(
+            date_from=data_iso(self.filtro_data_inicio_var.get()),
+            date_to=data_iso(self.filtro_data_fim_var.get()),
+            group=self.filtro_grupo_var.get() or None,
+            status=self.filtro_status_var.get() or None,
+            filename=self.filtro_arquivo_var.get().strip() or None,
+        )
+
+    def _carregar_proxima_pagina_jobs(self):
+        """Acrescenta à Treeview a próxima página do histórico, se houver."""
+        self._jobs_pagina_agendada = False
+        if self._jobs_esgotados:
+            return
+        self._inserir_pagina_jobs(self.historico.query_jobs(self._jobs_filtro, after=self._jobs_cursor))
+
+    def _inserir_pagina_jobs(self, jobs: List[tuple]):
+        if len(jobs) < JOBS_PAGE_SIZE:
+            self._jobs_esgotados = True
+        if not jobs:
+            return
+
         for job in jobs:
-            timestamp_str = datetime.datetime.fromisoformat(job[0]).strftime('%d/%m/%Y %H:%M:%S')
-            data = (timestamp_str,) + job[1:]
-            self.jobs_treeview.insert("", "end", values=data)
+            self.jobs_treeview.insert("", "end", iid=str(job[0]), values=self._valores_job(job))
+        self._jobs_cursor = (jobs[-1][1], jobs[-1][0])
+
+    @staticmethod
+    def _valores_job(job: tuple) -> tuple:
+        """Linha do histórico -> colunas da Treeview (Data/Hora ... Spooler)."""
+        timestamp_str = datetime.datetime.fromisoformat(job[1]).strftime('%d/%m/%Y %H:%M:%S')
+        return (timestamp_str,) + tuple(job[2:7]) + (job[7] or "",)
+
+    def _on_jobs_scroll(self, first: str, last: str):
+        """Atualiza a scrollbar e busca mais linhas quando o usuário se aproxima do fim da lista."""
+        self.jobs_scrollbar.set(first, last)
+        if float(last) > 0.9 and not self._jobs_esgotados and not self._jobs_pagina_agendada:
+            self._jobs_pagina_agendada = True
+            self.root.after_idle(self._carregar_proxima_pagina_jobs)
 
     def show_prints_per_day_chart(self):
-        # --- IMPORTS ATRASADOS ---
-        # Importa as bibliotecas pesadas somente quando esta função é chamada
-        import pandas as pd
-        import matplotlib.pyplot as plt
-        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-        # -------------------------
-        
-        """Busca dados e gera um gráfico de impressões por dia."""
-        jobs = get_all_jobs()
-        if not jobs:
+        """
+        Abre a janela de análise, com totais por dia ou por grupo.
+        Os dados vêm da tabela de estatísticas já consolidadas, então o custo
+        não depende do tamanho do histórico. O período e o grupo seguem os
+        filtros da aba de monitoramento.
+        """
+        filtro = self._jobs_filtro
+        # Com PRINTBOX_SYNC_DIR, o gráfico também pode somar todas as estações (central.db)
+        fontes = {FONTE_ESTACAO: self.historico}
+        if SYNC_DIR:
+            from printbox_sync import CentralStore
+            central = CentralStore(SYNC_DIR)
+            if central.available():
+                fontes[FONTE_CENTRAL] = central
+        try:
+            vazio = not any(fonte.get_daily_stats(filtro.date_from, filtro.date_to, filtro.group)
+                            for fonte in fontes.values())
+        except sqlite3.Error as e:
+            messagebox.showerror("Erro de Banco de Dados", f"Não foi possível ler as estatísticas: {e}")
+            return
+        if vazio:
             messagebox.showinfo("Análise de Dados", "Não há dados suficientes para gerar um gráfico.")
             return
 
-        df = pd.DataFrame(jobs, columns=['timestamp', 'filename', 'group', 'copies', 'pages', 'status'])
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df['date'] = df['timestamp'].dt.date
-        
-        # Agrupa por data e conta o número de trabalhos (linhas)
-        prints_per_day = df.groupby('date').size()
-
         # Cria uma nova janela para o gráfico
         chart_window = tk.Toplevel(self.root)
-        chart_window.title("Análise: Impressões por Dia")
-        chart_window.geometry("600x450")
-
-        fig, ax = plt.subplots(figsize=(8, 5))
-        prints_per_day.plot(kind='bar', ax=ax, color='skyblue')
-        ax.set_title('Total de Trabalhos de Impressão por Dia', fontsize=14)
-        ax.set_ylabel("Número de Impressões")
-        ax.set_xlabel("Data")
-        ax.tick_params(axis='x', rotation=45)
-        plt.tight_layout()
-
-        canvas = FigureCanvasTkAgg(fig, master=chart_window)
+        chart_window.title("Análise de Impressões")
+        chart_window.geometry("700x500")
+
+        controls = ttk.Frame(chart_window)
+        controls.pack(fill='x', padx=10, pady=(10, 0))
+        metrica_var = tk.StringVar(value="Trabalhos")
+        agrupamento_var = tk.StringVar(value="Dia")
+        ttk.Label(controls, text="Métrica:").pack(side='left')
+        metrica_box = ttk.Combobox(controls, textvariable=metrica_var, state="readonly", width=16,
+                                   values=list(METRICAS_GRAFICO))
+        metrica_box.pack(side='left', padx=(2, 10))
+        ttk.Label(controls, text="Por:").pack(side='left')
+        agrupamento_box = ttk.Combobox(controls, textvariable=agrupamento_var, state="readonly", width=8,
+                                       values=["Dia", "Grupo"])
+        agrupamento_box.pack(side='left', padx=2)
+        fonte_var = tk.StringVar(value=FONTE_ESTACAO)
+        if len(fontes) > 1:
+            ttk.Label(controls, text="Fonte:").pack(side='left', padx=(10, 0))
+            fonte_box = ttk.Combobox(controls, textvariable=fonte_var, state="readonly", width=16,
+                                     values=list(fontes))
+            fonte_box.pack(side='left', padx=2)
+
+        chart_frame = ttk.Frame(chart_window)
+        chart_frame.pack(expand=True, fill='both', padx=10, pady=10)
+
+        def redesenhar(event=None):
+            for widget in chart_frame.winfo_children():
+                widget.destroy()
+            coluna = METRICAS_GRAFICO[metrica_var.get()]
+            fonte = fontes[fonte_var.get()]
+            if agrupamento_var.get() == "Grupo":
+                linhas = fonte.get_group_stats(filtro.date_from, filtro.date_to)
+                rotulos = [linha[0] for linha in linhas]
+                titulo = f"{metrica_var.get()} por Grupo"
+            else:
+                linhas = fonte.get_daily_stats(filtro.date_from, filtro.date_to, filtro.group)
+                rotulos = [datetime.date.fromisoformat(linha[0]).strftime('%d/%m/%Y') for linha in linhas]
+                titulo = f"{metrica_var.get()} por Dia"
+            valores = [linha[coluna] or 0 for linha in linhas]
+            self._desenhar_grafico_barras(chart_frame, rotulos, valores, titulo, metrica_var.get())
+
+        metrica_box.bind("<<ComboboxSelected>>", redesenhar)
+        agrupamento_box.bind("<<ComboboxSelected>>", redesenhar)
+        if len(fontes) > 1:
+            fonte_box.bind("<<ComboboxSelected>>", redesenhar)
+        redesenhar()
+
+    def mostrar_trabalhos_lentos(self):
+        """
+        Abre uma janela com os trabalhos que mais demoraram no período dos
+        filtros da aba de monitoramento, e quanto tempo cada etapa levou.
+        """
+        filtro = self._jobs_filtro
+        try:
+            linhas = self.historico.get_slowest_jobs(filtro.date_from, filtro.date_to, filtro.group,
+                                                     limit=TRABALHOS_LENTOS_LIMITE)
+        except (sqlite3.Error, OSError) as e:
+            messagebox.showerror("Erro de Banco de Dados", f"Não foi possível ler os tempos de impressão: {e}")
+            return
+        if not linhas:
+            messagebox.showinfo("Trabalhos Mais Lentos", "Nenhum trabalho com tempos registrados no período.")
+            return
+
+        janela = tk.Toplevel(self.root)
+        janela.title("Trabalhos Mais Lentos")
+        janela.geometry("1000x400")
+
+        cols = ('Data/Hora', 'Grupo', 'Arquivos', 'Cópias', 'Backend', 'Status',
+                'Total (ms)', 'Páginas (ms)', 'Mesclagem (ms)', 'Envio (ms)', 'Banco (ms)', 'Interface (ms)')
+        tree = ttk.Treeview(janela, columns=cols, show='headings')
+        for col in cols:
+            tree.heading(col, text=col)
+            tree.column(col, width=80, anchor='center')
+        tree.column('Data/Hora', width=140)
+        tree.column('Grupo', width=120, anchor='w')
+        scrollbar = ttk.Scrollbar(janela, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side='right', fill='y')
+        tree.pack(expand=True, fill='both', padx=(10, 0), pady=10)
+
+        for (timestamp, grupo, arquivos, copias, mesclado, backend, status,
+             total, paginas, mesclagem, envio, banco, interface) in linhas:
+            data = datetime.datetime.fromisoformat(timestamp).strftime('%d/%m/%Y %H:%M:%S')
+            tempos = (f"{ms:.0f}" for ms in (total, paginas, mesclagem, envio, banco, interface))
+            tree.insert("", "end", values=(data, grupo, arquivos, copias, backend, status, *tempos))
+
+    def _desenhar_grafico_barras(self, master, rotulos: List[str], valores: List[int], titulo: str, eixo_y: str):
+        """Desenha um gráfico de barras com o matplotlib ou, se ele não estiver instalado, num Canvas do Tk."""
+        try:
+            # --- IMPORTS ATRASADOS ---
+            # Importa as bibliotecas pesadas somente quando esta função é chamada
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        except ImportError:
+            self._desenhar_grafico_canvas(master, rotulos, valores, titulo)
+            return
+
+        fig = Figure(figsize=(8, 5))
+        ax = fig.add_subplot()
+        ax.bar(range(len(valores)), valores, color='skyblue')
+        ax.set_xticks(range(len(rotulos)))
+        ax.set_xticklabels(rotulos, rotation=45, ha='right')
+        ax.set_title(titulo, fontsize=14)
+        ax.set_ylabel(eixo_y)
+        fig.tight_layout()
+
+        canvas = FigureCanvasTkAgg(fig, master=master)
         canvas.draw()
-        canvas.get_tk_widget().pack(expand=True, fill='both', padx=10, pady=10)
+        canvas.get_tk_widget().pack(expand=True, fill='both')
+
+    def _desenhar_grafico_canvas(self, master, rotulos: List[str], valores: List[int], titulo: str):
+        """Versão leve do gráfico de barras, sem dependências externas."""
+        largura, altura, margem = 660, 400, 40
+        canvas = tk.Canvas(master, width=largura, height=altura, background="white")
+        canvas.pack(expand=True, fill='both')
+        canvas.create_text(largura / 2, 15, text=titulo, font=("Arial", 12, "bold"))
+
+        maximo = max(valores) if valores else 0
+        if not maximo:
+            return
+        passo = (largura - 2 * margem) / len(valores)
+        for idx, (rotulo, valor) in enumerate(zip(rotulos, valores)):
+            x0 = margem + idx * passo + passo * 0.1
+            x1 = margem + (idx + 1) * passo - passo * 0.1
+            y1 = altura - margem
+            y0 = y1 - (altura - 2 * margem - 20) * valor / maximo
+            canvas.create_rectangle(x0, y0, x1, y1, fill="skyblue", outline="")
+            canvas.create_text((x0 + x1) / 2, y0 - 8, text=str(valor), font=("Arial", 8))
+            if passo >= 30:
+                canvas.create_text((x0 + x1) / 2, y1 + 12, text=rotulo, font=("Arial", 7))
 
 
 # --- PONTO DE ENTRADA DA APLICAÇÃO ---
 if __name__ == "__main__":
+    startup_timer.mark("imports")
+
     # Garante que o banco de dados está pronto
-    setup_database()
+    try:
+        setup_database()
+    except sqlite3.Error as e:
+        messagebox.showerror("Erro de Banco de Dados", f"Não foi possível inicializar o banco de dados: {e}")
+        sys.exit(1)
+    startup_timer.mark("banco_de_dados")
 
     # Cria a janela principal usando um tema moderno
     # Temas bons: "arc", "plastik", "radiance", "clam", "alt"
-    root = ThemedTk(theme="arc")
+    try:
+        from ttkthemes import ThemedTk
+        root = ThemedTk(theme="arc")
+    except ImportError:
+        root = tk.Tk()
+    configurar_log(root)
+    startup_timer.mark("janela")
     
     app = PDFPrinterApp(root)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,386 @@
+# --------------------------------------------------------------------------------
+# PrintBox - Medições de desempenho
+#
+# DESCRIÇÃO:
+# Gera dados sintéticos (pastas de grupos com PDFs e um print_log.db com o
+# histórico) numa pasta de trabalho e mede os caminhos críticos do programa:
+# - leitura dos grupos e dos arquivos (carregar_grupos / carregar_pdfs);
+# - contagem de páginas de PDFs de tamanhos diferentes, com e sem cache;
+# - gravação do histórico com várias threads ao mesmo tempo (log_print_job);
+# - consultas do Monitoramento e dos gráficos sobre 10^5 a 10^6 linhas;
+# - um trabalho de impressão completo pela fila, com impressora simulada.
+#
+# O resultado é um JSON que pode ser comparado entre versões:
+# python printbox_bench.py --output antes.json
+# python printbox_bench.py --output depois.json --compare antes.json
+#
+# Só a geração de dados:
+# python printbox_bench.py --generate-only --work-dir /tmp/printbox-sintetico --rows 1000000
+#
+# As medições apagam o cache de metadados, gravam histórico falso e rodam a
+# fila de impressão: a pasta de trabalho nunca pode ser a de uma instalação
+# de verdade. Uma pasta com print_log.db ou grupos_de_arquivos só é aceita
+# se tiver sido criada por este script (arquivo BENCH_MARKER).
+# --------------------------------------------------------------------------------
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, List, Optional
+
+import printbox_core as core
+
+STATUS_SINTETICOS = [("Sucesso", 0.95), ("Falha", 0.05)]
+PAGINAS_PDF = (1, 10, 100, 500)  # tamanhos dos PDFs usados na contagem de páginas
+BENCH_MARKER = ".printbox_bench"  # marca as pastas de trabalho com dados sintéticos
+
+
+# --- GERADOR DE DADOS SINTÉTICOS ---
+
+def pdf_bytes(pages: int, marca: str = "") -> bytes:
+    """PDF mínimo e válido com `pages` páginas em branco (`marca` torna o conteúdo único)."""
+    objetos = ["<< /Type /Catalog /Pages 2 0 R >>",
+               "<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(f"{3 + i} 0 R" for i in range(pages)), pages)]
+    objetos += ["<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] >>"] * pages
+
+    saida = bytearray(f"%PDF-1.4\n% {marca}\n".encode("ascii"))
+    offsets = []
+    for numero, objeto in enumerate(objetos, start=1):
+        offsets.append(len(saida))
+        saida += f"{numero} 0 obj\n{objeto}\nendobj\n".encode("ascii")
+    inicio_xref = len(saida)
+    saida += f"xref\n0 {len(objetos) + 1}\n0000000000 65535 f \n".encode("ascii")
+    saida += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("ascii")
+    saida += f"trailer\n<< /Size {len(objetos) + 1} /Root 1 0 R >>\nstartxref\n{inicio_xref}\n%%EOF\n".encode("ascii")
+    return bytes(saida)
+
+
+def generate_groups(groups: int, files_per_group: int, shared_files: int = 3, seed: int = 1) -> int:
+    """
+    Cria `groups` pastas em GRUPOS_DIR com `files_per_group` PDFs cada. Os
+    primeiros `shared_files` arquivos são iguais em todos os grupos, como os
+    formulários comuns das pastas reais. Retorna o total de arquivos criados.
+    """
+    rnd = random.Random(seed)
+    comuns = [pdf_bytes(rnd.choice(PAGINAS_PDF[:2]), f"comum-{i}") for i in range(shared_files)]
+    total = 0
+    for g in range(groups):
+        pasta = os.path.join(core.GRUPOS_DIR, f"Grupo {g:05d}")
+        os.makedirs(pasta, exist_ok=True)
+        for f in range(files_per_group):
+            dados = comuns[f] if f < shared_files else pdf_bytes(rnd.choice(PAGINAS_PDF[:2]), f"{g}-{f}")
+            with open(os.path.join(pasta, f"documento_{f:03d}.pdf"), "wb") as arquivo:
+                arquivo.write(dados)
+            total += 1
+    return total
+
+
+def generate_history(rows: int, groups: int, files_per_group: int, days: int = 365, seed: int = 1,
+                     batch: int = 50_000) -> int:
+    """
+    Insere `rows` linhas em print_jobs, espalhadas pelos últimos `days` dias
+    (o trigger de estatísticas diárias é mantido como no uso real).
+    """
+    rnd = random.Random(seed)
+    db = core.get_database()
+    fim = datetime.datetime.now()
+    passo = days * 86400 / max(rows, 1)
+    status = [s for s, _ in STATUS_SINTETICOS]
+    pesos = [p for _, p in STATUS_SINTETICOS]
+    inseridas = 0
+    while inseridas < rows:
+        lote = []
+        for i in range(inseridas, min(rows, inseridas + batch)):
+            quando = fim - datetime.timedelta(seconds=(rows - i) * passo)
+            lote.append((quando.isoformat(), f"documento_{rnd.randrange(files_per_group):03d}.pdf",
+                         f"Grupo {rnd.randrange(groups):05d}", rnd.randint(1, 5),
+                         rnd.choices(status, pesos)[0], rnd.randint(1, 20)))
+        with db.transaction() as conn:
+            conn.executemany('''
+                INSERT INTO print_jobs (timestamp, filename, group_name, copies, status, pages)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', lote)
+        inseridas += len(lote)
+    return inseridas
+
+
+# --- MEDIÇÕES ---
+
+def _medir(func: Callable[[], Optional[int]], repeat: int = 3, setup: Optional[Callable[[], None]] = None) -> dict:
+    """
+    Roda `func` `repeat` vezes e guarda o melhor tempo e a mediana. Se `func`
+    retornar um número, ele é a quantidade de operações feitas (para ops/s).
+    """
+    tempos, ops = [], 1
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        inicio = time.perf_counter()
+        resultado = func()
+        tempos.append(time.perf_counter() - inicio)
+        if isinstance(resultado, int):
+            ops = resultado
+    melhor = min(tempos)
+    return {"best_s": round(melhor, 6), "median_s": round(statistics.median(tempos), 6), "ops": ops,
+            "ops_per_s": round(ops / melhor, 1) if melhor > 0 else None}
+
+
+def bench_groups(results: dict, repeat: int):
+    index = core.GroupIndex(snapshot_path=core.GROUP_INDEX_SNAPSHOT)
+
+    def varredura_fria():
+        index._groups = {}
+        index._apply(index._scan())
+        return len(index.groups())
+
+    results["groups.scan_cold"] = _medir(varredura_fria, repeat)
+    results["groups.scan_unchanged"] = _medir(lambda: index._apply(index._scan()) or len(index.groups()), repeat)
+
+    def snapshot():
+        novo = core.GroupIndex(snapshot_path=core.GROUP_INDEX_SNAPSHOT)
+        novo.load_snapshot()
+        return len(novo.groups())
+
+    results["groups.load_snapshot"] = _medir(snapshot, repeat)
+    grupos = index.groups()
+    results["groups.files_all_groups"] = _medir(lambda: sum(len(index.files(g)) for g in grupos), repeat)
+
+
+def bench_page_count(results: dict, repeat: int):
+    if importlib.util.find_spec("PyPDF2") is None:
+        results["page_count"] = {"skipped": "PyPDF2 não instalado"}
+        return
+    pasta = os.path.join(core.CACHE_DIR, "bench_pdfs")
+    os.makedirs(pasta, exist_ok=True)
+    for paginas in PAGINAS_PDF:
+        caminho = os.path.join(pasta, f"{paginas}_paginas.pdf")
+        with open(caminho, "wb") as f:
+            f.write(pdf_bytes(paginas, f"bench-{paginas}"))
+        cache = core.PDFMetadataCache()
+
+        def esvaziar_cache():
+            # Frio de verdade: sem LRU, sem linha no SQLite e sem reaproveitar pelo hash
+            core.flush_print_log()
+            cache.invalidate()
+            cache.db.execute("DELETE FROM pdf_metadata")
+
+        results[f"page_count.cold_{paginas}p"] = _medir(lambda: cache.get_page_count(caminho) and 1, repeat,
+                                                        setup=esvaziar_cache)
+        results[f"page_count.warm_{paginas}p"] = _medir(
+            lambda: sum(1 for _ in range(1000) if cache.get_page_count(caminho)), repeat)
+    shutil.rmtree(pasta, ignore_errors=True)
+
+
+def bench_log_writes(results: dict, repeat: int, threads: int = 8, per_thread: int = 2000):
+    def gravar():
+        def worker(n: int):
+            for i in range(per_thread):
+                core.log_print_job(f"bench_{n}_{i}.pdf", "Bench", 1, "Sucesso", 1)
+        pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        core.flush_print_log()
+        return threads * per_thread
+
+    results[f"history.log_print_job_{threads}_threads"] = _medir(gravar, repeat)
+
+
+def bench_history(results: dict, repeat: int):
+    primeira = core.query_jobs()
+    results["history.first_page"] = _medir(lambda: len(core.query_jobs()), repeat)
+
+    def pagina_funda(paginas: int = 50):
+        cursor = (primeira[-1][1], primeira[-1][0]) if primeira else None
+        total = 0
+        for _ in range(paginas):
+            pagina = core.query_jobs(after=cursor)
+            if not pagina:
+                break
+            total += len(pagina)
+            cursor = (pagina[-1][1], pagina[-1][0])
+        return total
+
+    results["history.scroll_50_pages"] = _medir(pagina_funda, repeat)
+    filtro = core.JobFilter(group="Grupo 00001", status="Falha")
+    results["history.filtered_first_page"] = _medir(lambda: len(core.query_jobs(filtro)), repeat)
+    results["history.filename_search"] = _medir(lambda: len(core.query_jobs(core.JobFilter(filename="documento_01"))), repeat)
+    ultimo = core.get_max_job_id()
+    results["history.since_last_id"] = _medir(lambda: len(core.query_jobs_since(ultimo - 100)), repeat)
+    results["stats.daily_all"] = _medir(lambda: len(core.get_daily_stats()), repeat)
+    results["stats.groups_all"] = _medir(lambda: len(core.get_group_stats()), repeat)
+    results["history.get_all_jobs"] = _medir(lambda: len(core.get_all_jobs()), max(1, repeat // 3))
+
+
+def bench_print_pipeline(results: dict, repeat: int, jobs: int = 50):
+    """Trabalhos completos pela fila persistente, com a impressora simulada (dry-run e um `lp` falso)."""
+    grupo = core.GroupIndex(snapshot_path=core.GROUP_INDEX_SNAPSHOT)
+    grupo._apply(grupo._scan())
+    nome = grupo.groups()[0]
+    arquivos = grupo.files(nome)
+
+    backends = {"dry-run": core.DryRunBackend()}
+    if sys.platform != "win32":
+        lp_falso = os.path.join(core.CACHE_DIR, "lp_falso.sh")
+        with open(lp_falso, "w") as f:
+            f.write("#!/bin/sh\necho \"request id is Bench-$$ (1 file(s))\"\n")
+        os.chmod(lp_falso, 0o755)
+        backends["stub-lp"] = core.LpBackend(command=lp_falso)
+
+    for nome_backend, backend in backends.items():
+        for merge in (False, True):
+            def rodar():
+                concluidos = threading.Semaphore(0)
+
+                def worker(job: core.QueuedJob) -> bool:
+                    try:
+                        core.run_print_job(job.group_name, job.files, job.copies, merge=job.merge, backend=backend)
+                        return True
+                    finally:
+                        concluidos.release()
+
+                scheduler = core.PrintScheduler(worker)
+                scheduler.start()
+                for i in range(jobs):
+                    scheduler.enqueue(nome, arquivos, 1, merge=merge, printer=f"p{i % core.MAX_PRINT_WORKERS}")
+                for _ in range(jobs):
+                    concluidos.acquire()
+                scheduler.stop()
+                return jobs * len(arquivos)
+
+            modo = "merge" if merge else "per_file"
+            results[f"print.{nome_backend}.{modo}_{jobs}_jobs"] = _medir(rodar, repeat)
+
+
+# --- EXECUÇÃO ---
+
+def _git_commit() -> Optional[str]:
+    pasta = os.path.dirname(os.path.abspath(__file__))
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=pasta, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(atual: dict, anterior: dict) -> List[str]:
+    """Linhas de texto com a variação do melhor tempo de cada medição."""
+    linhas = []
+    if atual.get("params") != anterior.get("params"):
+        linhas.append(f"Atenção: parâmetros diferentes ({anterior.get('params')} -> {atual.get('params')})")
+    linhas.append(f"{'medição':<45} {'antes (ms)':>12} {'agora (ms)':>12} {'variação':>10}")
+    for nome, dados in atual["results"].items():
+        antes = anterior.get("results", {}).get(nome)
+        if not antes or "best_s" not in dados or "best_s" not in antes:
+            continue
+        variacao = (dados["best_s"] / antes["best_s"] - 1) * 100 if antes["best_s"] else 0.0
+        linhas.append(f"{nome:<45} {antes['best_s'] * 1000:>12.2f} {dados['best_s'] * 1000:>12.2f} {variacao:>+9.1f}%")
+    return linhas
+
+
+def _pasta_sintetica(work_dir: str) -> bool:
+    """True se a pasta não tem dados do PrintBox ou se os dados foram gerados aqui."""
+    if os.path.exists(os.path.join(work_dir, BENCH_MARKER)):
+        return True
+    return not any(os.path.exists(os.path.join(work_dir, nome)) for nome in (core.DB_FILE, core.GRUPOS_DIR))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="printbox-bench", description="Medições de desempenho do PrintBox.")
+    parser.add_argument("--work-dir", help="pasta para os dados sintéticos (padrão: uma pasta temporária)")
+    parser.add_argument("--groups", type=int, default=500)
+    parser.add_argument("--files-per-group", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=100_000, help="linhas de histórico (10^5 a 10^6)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", nargs="+", choices=["groups", "page_count", "writes", "history", "print"])
+    parser.add_argument("--generate-only", action="store_true", help="só gera os dados, sem medir")
+    parser.add_argument("--output", help="arquivo JSON com os resultados (padrão: saída padrão)")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para comparar")
+    args = parser.parse_args(argv)
+
+    temporaria = args.work_dir is None
+    if not temporaria and not _pasta_sintetica(args.work_dir):
+        parser.error(f"{args.work_dir} parece uma instalação do PrintBox (print_log.db ou {core.GRUPOS_DIR}); "
+                     "use uma pasta vazia ou criada pelo printbox_bench")
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="printbox-bench-")
+    os.makedirs(work_dir, exist_ok=True)
+    with open(os.path.join(work_dir, BENCH_MARKER), "a", encoding="utf-8"):
+        pass
+    saida = os.path.abspath(args.output) if args.output else None
+    anterior_path = os.path.abspath(args.compare) if args.compare else None
+    os.chdir(work_dir)  # Os caminhos do PrintBox são relativos à pasta atual
+
+    try:
+        core.setup_database()
+        geracao = {}
+        if not os.path.isdir(core.GRUPOS_DIR):
+            inicio = time.perf_counter()
+            geracao["files"] = generate_groups(args.groups, args.files_per_group, seed=args.seed)
+            geracao["files_s"] = round(time.perf_counter() - inicio, 3)
+        if core.get_max_job_id() < args.rows:
+            inicio = time.perf_counter()
+            geracao["rows"] = generate_history(args.rows - core.get_max_job_id(), args.groups,
+                                               args.files_per_group, seed=args.seed)
+            geracao["rows_s"] = round(time.perf_counter() - inicio, 3)
+        print(f"Dados em {work_dir}: {geracao or 'já existentes'}", file=sys.stderr)
+        if args.generate_only:
+            return 0
+
+        etapas = {
+            "groups": bench_groups,
+            "page_count": bench_page_count,
+            "history": bench_history,
+            "writes": bench_log_writes,  # Depois das consultas: acrescenta linhas ao histórico
+            "print": bench_print_pipeline,
+        }
+        results = {}
+        for nome, etapa in etapas.items():
+            if args.only and nome not in args.only:
+                continue
+            print(f"Medindo {nome}...", file=sys.stderr)
+            etapa(results, args.repeat)
+
+        relatorio = {
+            "commit": _git_commit(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sqlite": sqlite3.sqlite_version,
+            "params": {"groups": args.groups, "files_per_group": args.files_per_group, "rows": args.rows,
+                       "repeat": args.repeat, "seed": args.seed},
+            "generation": geracao,
+            "results": results,
+        }
+        texto = json.dumps(relatorio, ensure_ascii=False, indent=2)
+        if saida:
+            with open(saida, "w", encoding="utf-8") as f:
+                f.write(texto + "\n")
+        else:
+            print(texto)
+
+        if anterior_path:
+            with open(anterior_path, "r", encoding="utf-8") as f:
+                print("\n".join(compare(relatorio, json.load(f))), file=sys.stderr)
+        return 0
+    finally:
+        core.close_databases()
+        if temporaria:
+            os.chdir(tempfile.gettempdir())
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
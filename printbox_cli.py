@@ -0,0 +1,348 @@
+# --------------------------------------------------------------------------------
+# PrintBox - Linha de comando
+#
+# DESCRIÇÃO:
+# Imprime grupos sem abrir a interface gráfica, para scripts, tarefas agendadas
+# (cron) e estações sem monitor. Usa o mesmo motor do PrintBox (printbox_core):
+# o histórico vai para o mesmo print_log.db e aparece na aba de Monitoramento.
+#
+# EXEMPLOS:
+# python printbox_cli.py groups
+# python printbox_cli.py files --group "Ranger Raptor"
+# python printbox_cli.py print --group "Ranger Raptor" --copies 2 --merge
+# python printbox_cli.py batch pedidos.csv
+# python printbox_cli.py import --group "Ranger Raptor" ~/Downloads/raptor/*.pdf
+# python printbox_cli.py render                      # prepara as versões de printer_profiles.json
+# python printbox_cli.py dedup                       # guarda uma vez só os PDFs repetidos entre grupos
+# python printbox_cli.py archive --days 365           # arquiva o histórico com mais de um ano
+# python printbox_cli.py sync --central /mnt/matriz/printbox    # envia o histórico desta estação
+# python printbox_cli.py merge --central /mnt/matriz/printbox   # junta os envios no central.db
+# python printbox_cli.py --backend dry-run print --group "Ranger Raptor"   # não imprime (testes)
+#
+# Cada arquivo enviado gera uma linha JSON na saída padrão. O código de saída é
+# 0 se tudo foi impresso, 1 se algum arquivo falhou e 2 para erros de uso.
+# --------------------------------------------------------------------------------
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+from typing import List, NamedTuple
+
+
+class PedidoImpressao(NamedTuple):
+    """Uma linha do arquivo de lote (ou os argumentos do comando `print`)."""
+    group: str
+    files: List[str]  # vazio = todos os PDFs do grupo
+    copies: int = 1
+    printer: str = ""
+    merge: bool = False
+
+
+def _erro(mensagem: str) -> int:
+    print(f"printbox: {mensagem}", file=sys.stderr)
+    return 2
+
+
+def _emitir(dados: dict):
+    print(json.dumps(dados, ensure_ascii=False), flush=True)
+
+
+def _indice():
+    from printbox_core import GroupIndex
+    index = GroupIndex()
+    index.load_snapshot()
+    index.refresh()  # Confere a pasta; só relê os grupos que mudaram desde o snapshot
+    return index
+
+
+def _ler_lote(caminho: str) -> List[PedidoImpressao]:
+    """
+    Lê pedidos de um arquivo .json (lista de objetos) ou .csv (com cabeçalho).
+    Campos: group, files (lista, ou nomes separados por ';' no CSV), copies,
+    printer e merge.
+    """
+    with open(caminho, "r", encoding="utf-8", newline="") as f:
+        if caminho.lower().endswith(".json"):
+            linhas = json.load(f)
+        else:
+            linhas = list(csv.DictReader(f))
+    if not isinstance(linhas, list):
+        raise ValueError("o JSON deve ser uma lista de pedidos")
+
+    pedidos = []
+    for num, linha in enumerate(linhas, start=1):
+        if not isinstance(linha, dict):
+            raise ValueError(f"pedido {num}: esperado um objeto com os campos do pedido")
+        grupo = _texto(linha, "group", num)
+        if not grupo:
+            raise ValueError(f"pedido {num}: campo 'group' vazio")
+        arquivos = linha.get("files") or []
+        if isinstance(arquivos, str):
+            arquivos = [a.strip() for a in arquivos.split(";") if a.strip()]
+        if not isinstance(arquivos, list) or not all(isinstance(a, str) for a in arquivos):
+            raise ValueError(f"pedido {num}: 'files' deve ser uma lista de nomes de arquivo")
+        try:
+            copias = int(linha.get("copies") or 1)
+        except (TypeError, ValueError):
+            raise ValueError(f"pedido {num}: número de cópias inválido")
+        if copias < 1:
+            raise ValueError(f"pedido {num}: o número de cópias deve ser pelo menos 1")
+        merge = linha.get("merge")
+        if isinstance(merge, str):
+            merge = merge.strip().lower() in ("1", "true", "sim", "s", "yes")
+        pedidos.append(PedidoImpressao(grupo, arquivos, copias, _texto(linha, "printer", num), bool(merge)))
+    return pedidos
+
+
+def _texto(linha: dict, campo: str, num: int) -> str:
+    valor = linha.get(campo) or ""
+    if not isinstance(valor, str):
+        raise ValueError(f"pedido {num}: campo '{campo}' deve ser texto")
+    return valor.strip()
+
+
+def _imprimir(pedidos: List[PedidoImpressao], backend_name: str = "") -> int:
+    """Valida todos os pedidos antes de imprimir o primeiro, e depois os executa em ordem."""
+    from printbox_core import get_backend, run_print_job, RESULTADO_SUCESSO
+
+    try:
+        backend = get_backend(backend_name)
+    except ValueError as e:
+        return _erro(str(e))
+
+    index = _indice()
+    trabalhos = []
+    for pedido in pedidos:
+        disponiveis = index.files(pedido.group)
+        if pedido.group not in index.groups():
+            return _erro(f"grupo não encontrado: {pedido.group}")
+        faltando = [f for f in pedido.files if f not in disponiveis]
+        if faltando:
+            return _erro(f"arquivo(s) não encontrado(s) no grupo {pedido.group}: {', '.join(faltando)}")
+        arquivos = list(pedido.files) if pedido.files else disponiveis  # Na ordem pedida
+        if not arquivos:
+            return _erro(f"nenhum PDF no grupo {pedido.group}")
+        trabalhos.append((pedido, arquivos))
+
+    # Impressão síncrona, sem passar pela fila persistente: uma interface aberta
+    # na mesma pasta não deve despachar (de novo) os trabalhos da linha de comando.
+    sucesso = True
+    for pedido, arquivos in trabalhos:
+        def emitir_resultado(r, pedido=pedido):
+            # Uma linha por arquivo, assim que ele é enviado
+            _emitir({"group": pedido.group, "file": r.filename, "copies": pedido.copies, "pages": r.pages,
+                     "status": r.status, "job_id": r.job_id, "error": r.error})
+
+        resultados = run_print_job(pedido.group, arquivos, pedido.copies, merge=pedido.merge,
+                                   printer=pedido.printer, backend=backend, on_result=emitir_resultado)
+        if len(resultados) < len(arquivos) or any(r.status != RESULTADO_SUCESSO for r in resultados):
+            sucesso = False
+    return 0 if sucesso else 1
+
+
+# --- COMANDOS ---
+
+def cmd_groups(args) -> int:
+    for grupo in _indice().groups():
+        print(grupo)
+    return 0
+
+
+def cmd_files(args) -> int:
+    index = _indice()
+    if args.group not in index.groups():
+        return _erro(f"grupo não encontrado: {args.group}")
+    for arquivo in index.files(args.group):
+        print(arquivo)
+    return 0
+
+
+def cmd_print(args) -> int:
+    if args.copies < 1:
+        return _erro("o número de cópias deve ser pelo menos 1")
+    return _imprimir([PedidoImpressao(args.group, args.files or [], args.copies, args.printer, args.merge)], args.backend)
+
+
+def cmd_import(args) -> int:
+    from printbox_core import import_group
+    try:
+        resultado = import_group(args.group, args.paths)
+    except ValueError as e:
+        return _erro(str(e))
+    except OSError as e:
+        return _erro(f"não foi possível importar o grupo {args.group}: {e}")
+    for situacao, nomes in (("added", resultado.added), ("updated", resultado.updated),
+                            ("unchanged", resultado.unchanged)):
+        for nome in nomes:
+            _emitir({"group": args.group, "file": nome, "status": situacao})
+    for nome, motivo in resultado.invalid:
+        _emitir({"group": args.group, "file": nome, "status": "invalid", "error": motivo})
+    return 1 if resultado.invalid else 0
+
+
+def cmd_render(args) -> int:
+    from printbox_core import render_cache, GS_COMMAND, PRINTER_PROFILES_FILE
+    if not render_cache.profiles:
+        return _erro(f"nenhum perfil de impressora em {PRINTER_PROFILES_FILE}")
+    if not render_cache.enabled:
+        return _erro(f"Ghostscript não encontrado ({GS_COMMAND})")
+    index = _indice()
+    grupos = [args.group] if args.group else index.groups()
+    if args.group and args.group not in index.groups():
+        return _erro(f"grupo não encontrado: {args.group}")
+    agendados = render_cache.warm([os.path.join(index.root, g, f) for g in grupos for f in index.files(g)])
+    render_cache.wait()
+    _emitir({"rendered": agendados, "failed": len(render_cache.failures)})
+    return 1 if render_cache.failures else 0
+
+
+def cmd_dedup(args) -> int:
+    from printbox_core import blob_store
+    try:
+        convertidos, economizados = blob_store.deduplicate()
+    except OSError as e:
+        print(f"printbox: falha ao deduplicar os grupos: {e}", file=sys.stderr)
+        return 1
+    _emitir({"files": convertidos, "bytes_saved": economizados})
+    return 0
+
+
+def cmd_archive(args) -> int:
+    from printbox_core import RetentionPolicy, apply_retention
+    politica = RetentionPolicy()
+    if args.days is not None:
+        politica = politica._replace(hot_days=args.days)
+    if args.timing_days is not None:
+        politica = politica._replace(timing_days=args.timing_days)
+    if args.vacuum:
+        politica = politica._replace(vacuum=args.vacuum)
+    if politica.hot_days <= 0:
+        return _erro("informe --days (ou PRINTBOX_RETENTION_DAYS) com o número de dias mantidos no banco principal")
+    try:
+        resultado = apply_retention(politica)
+    except (sqlite3.Error, OSError) as e:
+        print(f"printbox: falha ao arquivar o histórico: {e}", file=sys.stderr)
+        return 1
+    _emitir(resultado._asdict())
+    return 0
+
+
+def cmd_sync(args) -> int:
+    from printbox_sync import push
+    if not args.central:
+        return _erro("informe --central (ou PRINTBOX_SYNC_DIR) com a pasta central")
+    try:
+        resultado = push(args.central)
+    except sqlite3.Error as e:
+        print(f"printbox: falha ao sincronizar o histórico: {e}", file=sys.stderr)
+        return 1
+    _emitir(resultado._asdict())
+    return 1 if resultado.offline else 0
+
+
+def cmd_merge(args) -> int:
+    from printbox_sync import merge_batches
+    if not args.central:
+        return _erro("informe --central (ou PRINTBOX_SYNC_DIR) com a pasta central")
+    try:
+        resultado = merge_batches(args.central)
+    except (sqlite3.Error, OSError) as e:
+        print(f"printbox: falha ao juntar o histórico: {e}", file=sys.stderr)
+        return 1
+    _emitir(resultado._asdict())
+    return 1 if resultado.rejected else 0
+
+
+def cmd_batch(args) -> int:
+    try:
+        pedidos = _ler_lote(args.manifest)
+    except (OSError, ValueError) as e:
+        return _erro(f"arquivo de lote inválido: {e}")
+    return _imprimir(pedidos, args.backend)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="printbox", description="Impressão de grupos de PDFs sem interface gráfica.")
+    parser.add_argument("--base-dir", help="pasta do PrintBox (onde ficam print_log.db e grupos_de_arquivos)")
+    parser.add_argument("--backend", default="", help="backend de impressão: lp, ipp, windows ou dry-run (padrão: lp)")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("groups", help="lista os grupos")
+    p.set_defaults(func=cmd_groups)
+
+    p = sub.add_parser("files", help="lista os PDFs de um grupo")
+    p.add_argument("--group", required=True)
+    p.set_defaults(func=cmd_files)
+
+    p = sub.add_parser("print", help="imprime um grupo (ou alguns arquivos dele)")
+    p.add_argument("--group", required=True)
+    p.add_argument("--files", nargs="+", help="arquivos do grupo (padrão: todos)")
+    p.add_argument("--copies", type=int, default=1)
+    p.add_argument("--printer", default="", help="impressora de destino (padrão: a do sistema)")
+    p.add_argument("--merge", action="store_true", help="envia tudo como um único documento")
+    p.set_defaults(func=cmd_print)
+
+    p = sub.add_parser("import", help="cria ou atualiza um grupo com os PDFs informados")
+    p.add_argument("--group", required=True)
+    p.add_argument("paths", nargs="+", help="arquivos PDF a importar")
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("render", help="prepara as versões dos PDFs para as impressoras com perfil")
+    p.add_argument("--group", help="só este grupo (padrão: todos)")
+    p.set_defaults(func=cmd_render)
+
+    p = sub.add_parser("dedup", help="troca os PDFs repetidos entre grupos por hardlinks (somente leitura)")
+    p.set_defaults(func=cmd_dedup)
+
+    p = sub.add_parser("archive", help="move o histórico antigo para os arquivos mensais e compacta o banco")
+    p.add_argument("--days", type=int, help="dias mantidos no banco principal (padrão: PRINTBOX_RETENTION_DAYS)")
+    p.add_argument("--timing-days", type=int, help="dias mantidos dos tempos de impressão (padrão: 90)")
+    p.add_argument("--vacuum", choices=["incremental", "full", "none"], help="compactação (padrão: incremental)")
+    p.set_defaults(func=cmd_archive)
+
+    p = sub.add_parser("sync", help="envia o histórico novo desta estação para a pasta central")
+    p.add_argument("--central", default=os.environ.get("PRINTBOX_SYNC_DIR", ""),
+                   help="pasta central (padrão: PRINTBOX_SYNC_DIR)")
+    p.set_defaults(func=cmd_sync)
+
+    p = sub.add_parser("merge", help="junta no central.db os envios das estações")
+    p.add_argument("--central", default=os.environ.get("PRINTBOX_SYNC_DIR", ""),
+                   help="pasta central (padrão: PRINTBOX_SYNC_DIR)")
+    p.set_defaults(func=cmd_merge)
+
+    p = sub.add_parser("batch", help="imprime os pedidos de um arquivo .csv ou .json")
+    p.add_argument("manifest")
+    p.set_defaults(func=cmd_batch)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    # Caminhos relativos são da pasta onde o comando foi chamado, não de --base-dir
+    if getattr(args, "paths", None):
+        args.paths = [os.path.abspath(caminho) for caminho in args.paths]
+    if getattr(args, "manifest", None):
+        args.manifest = os.path.abspath(args.manifest)
+    if getattr(args, "central", None):
+        args.central = os.path.abspath(args.central)
+    if args.base_dir:
+        try:
+            os.chdir(args.base_dir)
+        except OSError as e:
+            return _erro(f"não foi possível acessar {args.base_dir}: {e}")
+
+    from printbox_core import setup_database, close_databases
+    try:
+        setup_database()
+    except sqlite3.Error as e:
+        return _erro(f"não foi possível inicializar o banco de dados: {e}")
+    try:
+        return args.func(args)
+    finally:
+        close_databases()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
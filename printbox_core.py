@@ -0,0 +1,2794 @@
+# --------------------------------------------------------------------------------
+# PrintBox - Núcleo (sem interface gráfica)
+#
+# DESCRIÇÃO:
+# Tudo o que não depende do Tk: banco de dados do histórico, cache de metadados
+# e armazenamento deduplicado dos PDFs, índice de grupos, fila de impressão e
+# envio ao spooler. É usado pela interface (printbox.py) e pela linha de
+# comando (printbox_cli.py), que assim compartilham o mesmo motor de impressão.
+# --------------------------------------------------------------------------------
+import os
+import hashlib
+import logging
+import shutil
+import socket
+import stat
+import subprocess
+import sys
+import threading
+import sqlite3
+import contextlib
+import datetime
+import getpass
+import http.client
+import json
+import queue
+import struct
+import time
+import urllib.parse
+import uuid
+import atexit
+import multiprocessing
+import pathlib
+from collections import OrderedDict
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional, NamedTuple
+
+# Libs de terceiros (PyPDF2) são importadas só quando usadas.
+
+# Avisos do motor que acontecem em segundo plano (gravação do histórico,
+# perfis de impressora, renderização, ...). Sem configuração, os avisos vão
+# para o stderr; a interface os manda para um arquivo e para a tela.
+logger = logging.getLogger("printbox")
+
+
+# --- MÓDULO DE BANCO DE DADOS ---
+
+DB_FILE = "print_log.db"
+GRUPOS_DIR = "grupos_de_arquivos"
+BLOBS_DIR = os.path.join(GRUPOS_DIR, ".blobs")
+LINK_BLOBS = os.name != "nt"  # No Windows as pastas dos grupos recebem cópias dos blobs (ver BlobStore)
+CACHE_DIR = ".printbox_cache"
+MERGED_DIR = os.path.join(CACHE_DIR, "merged")
+MERGED_CACHE_MAX_FILES = 64
+RENDER_DIR = os.path.join(CACHE_DIR, "render")
+RENDER_CACHE_MAX_BYTES = 512 * 1024 * 1024
+RENDER_WORKERS = min(2, os.cpu_count() or 1)  # processos do Ghostscript rodando ao mesmo tempo
+RENDER_TIMEOUT = 300                          # segundos por documento
+PRINTER_PROFILES_FILE = "printer_profiles.json"
+GS_COMMAND = os.environ.get("PRINTBOX_GS_COMMAND") or ("gswin64c" if sys.platform == "win32" else "gs")
+GROUP_INDEX_SNAPSHOT = os.path.join(CACHE_DIR, "group_index.json")
+GROUP_INDEX_POLL_INTERVAL = 2.0  # segundos entre verificações da pasta de grupos
+GROUP_INDEX_DEBOUNCE = 1.0       # espera a pasta "assentar" antes de avisar a interface
+MAX_PRINT_WORKERS = 4
+IMPORT_WORKERS = 4                                 # threads copiando arquivos na importação
+IMPORT_PROCESSES = min(4, os.cpu_count() or 1)     # processos validando e contando páginas
+QUEUE_LEASE = 60.0  # segundos sem sinal de vida até um trabalho "Imprimindo" ser retomado por outro processo
+SERVER_ENV = "PRINTBOX_SERVER"  # Endereço do servidor de impressão local (ver printbox_server.py)
+# Comando compatível com o `lp` usado no lugar dele (ex.: um script falso para testes)
+PRINT_COMMAND = os.environ.get("PRINTBOX_PRINT_COMMAND", "")
+PRINT_BACKEND = os.environ.get("PRINTBOX_PRINT_BACKEND", "")  # lp, ipp, windows ou dry-run
+IPP_SERVER = os.environ.get("CUPS_SERVER", "localhost:631")
+SPOOL_POLL_INTERVAL = 10.0       # segundos entre consultas ao spooler sobre trabalhos em andamento
+SPOOL_TRACK_MAX_AGE = 24 * 3600  # depois disso um trabalho sem resposta do spooler fica "desconhecido"
+METRICS_FILE = os.environ.get("PRINTBOX_METRICS_FILE", "")  # .json ou texto do Prometheus; vazio = não grava
+METRICS_WRITE_INTERVAL = 10.0  # segundos entre regravações do METRICS_FILE (e uma última ao encerrar)
+
+# WAL permite leituras durante a gravação. Em pastas de rede (SMB/NFS) o WAL
+# não é suportado pelo SQLite: nesse caso use PRINTBOX_DB_JOURNAL_MODE=DELETE.
+DB_JOURNAL_MODE = os.environ.get("PRINTBOX_DB_JOURNAL_MODE", "WAL")
+DB_BUSY_TIMEOUT = 30.0   # segundos esperando um lock antes de "database is locked"
+DB_BATCH_INTERVAL = 0.5  # segundos acumulando gravações antes de um commit
+DB_BATCH_SIZE = 500
+JOBS_PAGE_SIZE = 200
+ARCHIVE_DIR = "print_log_archive"  # um banco SQLite por mês com o histórico antigo
+RETENTION_DAYS = int(os.environ.get("PRINTBOX_RETENTION_DAYS") or 0)  # 0 = tudo fica no banco principal
+TIMINGS_RETENTION_DAYS = 90
+RETENTION_VACUUM = os.environ.get("PRINTBOX_RETENTION_VACUUM", "incremental")  # incremental, full ou none
+RETENTION_INTERVAL = 24 * 3600  # segundos entre execuções automáticas da retenção
+SYNC_DIR = os.environ.get("PRINTBOX_SYNC_DIR", "")  # pasta central que recebe o histórico das estações
+
+
+class Database:
+    """
+    Acesso ao SQLite com conexões de longa duração (uma por thread), WAL e
+    cache de comandos preparados. As gravações de histórico passam por um
+    `BatchWriter`, que agrupa vários INSERTs num único commit.
+    """
+    def __init__(self, db_file: str = DB_FILE, journal_mode: str = DB_JOURNAL_MODE):
+        self.db_file = db_file
+        self.journal_mode = journal_mode
+        self._local = threading.local()
+        self._conns = []
+        self._lock = threading.Lock()
+        self._writer = None
+
+    def connection(self) -> sqlite3.Connection:
+        """Conexão da thread atual, criada na primeira chamada e reaproveitada depois."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: as transações são controladas por transaction()
+            conn = sqlite3.connect(self.db_file, timeout=DB_BUSY_TIMEOUT, isolation_level=None,
+                                   cached_statements=256, check_same_thread=False)
+            conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.depth = 0
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Abre uma transação (BEGIN IMMEDIATE) e faz commit ao sair do bloco, ou
+        rollback se houver exceção. Blocos aninhados participam da transação externa.
+        """
+        conn = self.connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn.execute("BEGIN IMMEDIATE")
+        self._local.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+        finally:
+            self._local.depth = 0
+
+    def execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        """Executa um comando de escrita na sua própria transação."""
+        with self.transaction() as conn:
+            return conn.execute(sql, params)
+
+    def query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        return self.connection().execute(sql, params).fetchall()
+
+    def query_one(self, sql: str, params: tuple = ()) -> Optional[tuple]:
+        return self.connection().execute(sql, params).fetchone()
+
+    @property
+    def writer(self) -> "BatchWriter":
+        with self._lock:
+            if self._writer is None:
+                self._writer = BatchWriter(self)
+            return self._writer
+
+    def close(self):
+        """Grava o que estiver pendente e fecha todas as conexões."""
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+        with self._lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns.clear()
+        self._local = threading.local()
+
+
+class BatchWriter:
+    """
+    Thread de gravação em segundo plano. Os comandos enviados por `submit` são
+    acumulados por até `interval` segundos (ou `max_batch` comandos) e gravados
+    numa única transação, em vez de um commit por linha.
+    """
+    _FLUSH = object()
+    _STOP = object()
+
+    def __init__(self, db: Database, interval: float = DB_BATCH_INTERVAL, max_batch: int = DB_BATCH_SIZE):
+        self.db = db
+        self.interval = interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="printbox-db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, sql: str, params: tuple = ()):
+        self._queue.put((sql, [params]))
+
+    def submit_many(self, sql: str, rows: List[tuple]):
+        """Envia várias linhas do mesmo comando; elas são gravadas juntas."""
+        self._queue.put((sql, list(rows)))
+
+    def flush(self):
+        """Bloqueia até que tudo o que foi enviado esteja gravado no banco."""
+        self._queue.put(self._FLUSH)
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                self._queue.task_done()
+                return
+            if item is self._FLUSH:
+                self._queue.task_done()
+                continue
+
+            batch = [item]
+            sentinela = None
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.max_batch:
+                try:
+                    proximo = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if proximo is self._FLUSH or proximo is self._STOP:
+                    sentinela = proximo
+                    break
+                batch.append(proximo)
+
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+            if sentinela is not None:
+                self._queue.task_done()
+                if sentinela is self._STOP:
+                    return
+
+    def _write(self, batch: list):
+        try:
+            with metrics.timer(ETAPA_BANCO), self.db.transaction() as conn:
+                for sql, rows in batch:
+                    conn.executemany(sql, rows)
+            return
+        except sqlite3.Error:
+            pass
+        # Se o lote falhar, grava comando a comando para não perder os demais
+        for sql, rows in batch:
+            try:
+                with self.db.transaction() as conn:
+                    conn.executemany(sql, rows)
+            except sqlite3.Error as e:
+                logger.error("Falha ao gravar no banco de dados: %s", e)
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+def get_database(db_file: str = DB_FILE) -> Database:
+    """Retorna a instância compartilhada de `Database` para o arquivo informado."""
+    with _databases_lock:
+        if db_file not in _databases:
+            _databases[db_file] = Database(db_file)
+        return _databases[db_file]
+
+@atexit.register
+def close_databases():
+    """Garante que as gravações pendentes cheguem ao disco ao encerrar o programa."""
+    with _databases_lock:
+        databases = list(_databases.values())
+    for db in databases:
+        db.close()
+
+def setup_database():
+    """
+    Cria o arquivo de banco de dados e as tabelas se não existirem.
+    Levanta `sqlite3.Error` se o banco não puder ser inicializado.
+    """
+    with get_database().transaction() as conn:
+        _create_schema(conn)
+
+def _create_schema(conn: sqlite3.Connection):
+    """Cria as tabelas e índices que ainda não existirem."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS print_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            group_name TEXT NOT NULL,
+            copies INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            pages INTEGER
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS pdf_metadata (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            sha256 TEXT NOT NULL,
+            pages INTEGER
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_print_jobs_timestamp ON print_jobs (timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_print_jobs_group ON print_jobs (group_name, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_print_jobs_status ON print_jobs (status, timestamp)")
+    _add_column(conn, "print_jobs", "spool_job_id", "TEXT")
+    _add_column(conn, "print_jobs", "spool_status", "TEXT")
+    # Índice parcial: só os trabalhos que o SpoolTracker ainda acompanha
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_print_jobs_spool ON print_jobs (spool_status)
+        WHERE spool_status IN ('pendente', 'imprimindo')
+    ''')
+    # Versão da última mudança de spool_job_id/spool_status, para a sincronização
+    # (printbox_sync.py) reenviar à central as linhas que o SpoolTracker atualizou
+    _add_column(conn, "print_jobs", "spool_seq", "INTEGER")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_print_jobs_spool_seq ON print_jobs (spool_seq) WHERE spool_seq IS NOT NULL")
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_print_jobs_spool_seq AFTER UPDATE OF spool_job_id, spool_status ON print_jobs
+        WHEN NEW.spool_status IS NOT OLD.spool_status OR NEW.spool_job_id IS NOT OLD.spool_job_id
+        BEGIN
+            UPDATE print_jobs SET spool_seq = (SELECT COALESCE(MAX(spool_seq), 0) + 1 FROM print_jobs)
+            WHERE id = NEW.id;
+        END
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pdf_metadata_sha256 ON pdf_metadata (sha256)")
+    _create_stats_schema(conn)
+    # Quanto tempo cada etapa de um trabalho levou (uma linha por chamada de run_print_job)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS print_job_timings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            group_name TEXT NOT NULL,
+            files INTEGER NOT NULL,
+            copies INTEGER NOT NULL,
+            merge INTEGER NOT NULL DEFAULT 0,
+            backend TEXT NOT NULL,
+            status TEXT NOT NULL,
+            total_ms REAL NOT NULL,
+            page_count_ms REAL NOT NULL DEFAULT 0,
+            merge_ms REAL NOT NULL DEFAULT 0,
+            dispatch_ms REAL NOT NULL DEFAULT 0,
+            db_ms REAL NOT NULL DEFAULT 0,
+            callback_ms REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_print_job_timings_timestamp ON print_job_timings (timestamp)")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS print_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            group_name TEXT NOT NULL,
+            files TEXT NOT NULL,
+            copies INTEGER NOT NULL,
+            merge INTEGER NOT NULL DEFAULT 0,
+            printer TEXT NOT NULL DEFAULT '',
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_print_queue_status ON print_queue (status, priority, id)")
+    _add_column(conn, "print_queue", "owner", "TEXT")
+    # Identificação da estação e até onde o histórico já foi enviado à central (printbox_sync.py)
+    conn.execute("CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+def _add_column(conn: sqlite3.Connection, table: str, column: str, declaration: str):
+    """Acrescenta uma coluna a uma tabela criada por uma versão anterior do programa."""
+    colunas = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in colunas:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+def _create_stats_schema(conn: sqlite3.Connection):
+    """
+    Tabela de estatísticas diárias por grupo e status, mantida por um trigger
+    a cada linha inserida em `print_jobs`. Os gráficos leem só esta tabela.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS print_stats_daily (
+            day TEXT NOT NULL,
+            group_name TEXT NOT NULL,
+            status TEXT NOT NULL,
+            jobs INTEGER NOT NULL DEFAULT 0,
+            copies INTEGER NOT NULL DEFAULT 0,
+            pages INTEGER NOT NULL DEFAULT 0,
+            printed_pages INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, group_name, status)
+        )
+    ''')
+    trigger_existe = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'trg_print_jobs_stats'"
+    ).fetchone()
+    if trigger_existe:
+        return
+
+    conn.execute('''
+        CREATE TRIGGER trg_print_jobs_stats AFTER INSERT ON print_jobs
+        BEGIN
+            INSERT INTO print_stats_daily (day, group_name, status, jobs, copies, pages, printed_pages)
+            VALUES (substr(NEW.timestamp, 1, 10), NEW.group_name, NEW.status, 1, NEW.copies,
+                    COALESCE(NEW.pages, 0), COALESCE(NEW.pages, 0) * NEW.copies)
+            ON CONFLICT (day, group_name, status) DO UPDATE SET
+                jobs = jobs + 1,
+                copies = copies + excluded.copies,
+                pages = pages + excluded.pages,
+                printed_pages = printed_pages + excluded.printed_pages;
+        END
+    ''')
+    # Primeira execução com o trigger: consolida o histórico que já existia
+    conn.execute("DELETE FROM print_stats_daily")
+    conn.execute('''
+        INSERT INTO print_stats_daily (day, group_name, status, jobs, copies, pages, printed_pages)
+        SELECT substr(timestamp, 1, 10), group_name, status, COUNT(*), SUM(copies),
+               SUM(COALESCE(pages, 0)), SUM(COALESCE(pages, 0) * copies)
+        FROM print_jobs
+        GROUP BY substr(timestamp, 1, 10), group_name, status
+    ''')
+
+_INSERT_PRINT_JOB = '''
+    INSERT INTO print_jobs (timestamp, filename, group_name, copies, status, pages, spool_job_id, spool_status)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def log_print_job(filename: str, group: str, copies: int, status: str, pages: Optional[int],
+                  spool_job_id: str = ""):
+    """Registra um trabalho de impressão no banco de dados (gravado em lote, em segundo plano)."""
+    log_print_jobs([(filename, group, copies, status, pages, spool_job_id)])
+
+def log_print_jobs(entries: List[tuple]):
+    """
+    Registra vários arquivos de uma vez, na mesma transação.
+    Cada item é (filename, group, copies, status, pages[, spool_job_id]); com
+    o id do spooler, o trabalho passa a ser acompanhado pelo `SpoolTracker`.
+    """
+    timestamp = datetime.datetime.now().isoformat()
+    rows = []
+    for entry in entries:
+        spool_job_id = entry[5] if len(entry) > 5 and entry[5] else None
+        rows.append((timestamp,) + tuple(entry[:5]) + (spool_job_id, _spool_inicial(spool_job_id)))
+    get_database().writer.submit_many(_INSERT_PRINT_JOB, rows)
+
+def _spool_inicial(spool_job_id: Optional[str]) -> Optional[str]:
+    if not spool_job_id:
+        return None
+    # O dry-run não tem spooler: o trabalho já nasce concluído e o SpoolTracker não o acompanha
+    return SPOOL_CONCLUIDO if spool_job_id.startswith(DRY_RUN_PREFIX) else SPOOL_PENDENTE
+
+def flush_print_log():
+    """Espera as gravações pendentes do histórico chegarem ao banco."""
+    get_database().writer.flush()
+
+class JobFilter(NamedTuple):
+    """Filtros da consulta ao histórico. Datas no formato ISO (AAAA-MM-DD), inclusivas."""
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    group: Optional[str] = None
+    status: Optional[str] = None
+    filename: Optional[str] = None
+
+def query_jobs(filtro: Optional[JobFilter] = None, after: Optional[tuple] = None,
+               limit: int = JOBS_PAGE_SIZE) -> List[tuple]:
+    """
+    Busca uma página do histórico, do mais recente para o mais antigo.
+
+    A paginação é por chave (keyset): para a próxima página, passe em `after`
+    o par (timestamp, id) da última linha recebida. Assim cada página custa o
+    mesmo, não importa quão fundo esteja no histórico.
+    Retorna tuplas (id, timestamp, filename, group_name, copies, pages, status, spool_status).
+
+    Os arquivos mensais do histórico antigo (ver `apply_retention`) entram
+    na mesma ordenação: linhas antigas ainda não enviadas à central ficam no
+    banco principal, então as duas fontes se intercalam. Só são abertos os
+    meses que ainda podem ter linhas dentro da página.
+    """
+    filtro = filtro or JobFilter()
+    where, params = _job_filter_sql(filtro)
+    if after is not None:
+        where.append("(timestamp, id) < (?, ?)")
+        params.extend(after)
+
+    sql = "SELECT id, timestamp, filename, group_name, copies, pages, status, spool_status FROM print_jobs"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+    rows = get_database().query(sql, tuple(params) + (limit,))
+    ate = filtro.date_to or (after[0][:10] if after is not None else None)
+    for mes, caminho in reversed(list_archives(filtro.date_from, ate)):
+        if len(rows) >= limit and rows[-1][1][:7] > mes:
+            break  # A página já está cheia com linhas mais novas que este mês
+        por_id = {row[0]: row for row in rows}
+        # Depois de uma queda no meio do arquivamento a mesma linha pode estar nos dois bancos
+        por_id.update((row[0], row) for row in _query_archive(caminho, sql, tuple(params) + (limit,)))
+        rows = sorted(por_id.values(), key=lambda row: (row[1], row[0]), reverse=True)[:limit]
+    return rows
+
+def query_jobs_since(last_id: int, filtro: Optional[JobFilter] = None, limit: int = JOBS_PAGE_SIZE) -> List[tuple]:
+    """
+    Busca as linhas com id maior que `last_id`, em ordem crescente de id.
+    Serve para atualizar a tela só com o que é novo (uma busca pela chave primária).
+    """
+    where, params = _job_filter_sql(filtro or JobFilter())
+    where.insert(0, "id > ?")
+    params.insert(0, last_id)
+    sql = ("SELECT id, timestamp, filename, group_name, copies, pages, status, spool_status FROM print_jobs WHERE "
+           + " AND ".join(where) + " ORDER BY id LIMIT ?")
+    params.append(limit)
+    return get_database().query(sql, tuple(params))
+
+def get_max_job_id() -> int:
+    row = get_database().query_one("SELECT MAX(id) FROM print_jobs")
+    return row[0] or 0
+
+def get_sync_state(key: str) -> Optional[str]:
+    row = get_database().query_one("SELECT value FROM sync_state WHERE key = ?", (key,))
+    return row[0] if row else None
+
+def set_sync_state(key: str, value: str):
+    get_database().execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, value))
+
+def sync_high_water_key(central_dir: str) -> str:
+    """Chave em `sync_state` do maior id de print_jobs já enviado para `central_dir`."""
+    return "high_water:" + os.path.abspath(central_dir)
+
+def sync_archive_limit() -> Optional[int]:
+    """
+    Maior id de print_jobs que pode sair do banco principal sem deixar de ir
+    para uma central: o menor ponto de envio entre todas as centrais que esta
+    estação já usou (e SYNC_DIR, mesmo antes do primeiro envio). None se a
+    estação nunca sincronizou. Uma central abandonada segura o arquivamento
+    até a sua chave ser apagada de sync_state.
+    """
+    pontos = [int(valor) for (valor,) in get_database().query(
+        "SELECT value FROM sync_state WHERE key LIKE 'high_water:%'")]
+    if SYNC_DIR:
+        pontos.append(int(get_sync_state(sync_high_water_key(SYNC_DIR)) or 0))
+    return min(pontos) if pontos else None
+
+def _job_filter_sql(filtro: JobFilter) -> tuple:
+    """Converte um `JobFilter` em (lista de condições WHERE, lista de parâmetros)."""
+    where, params = [], []
+    if filtro.date_from:
+        where.append("timestamp >= ?")
+        params.append(filtro.date_from)
+    if filtro.date_to:
+        dia_seguinte = datetime.date.fromisoformat(filtro.date_to) + datetime.timedelta(days=1)
+        where.append("timestamp < ?")
+        params.append(dia_seguinte.isoformat())
+    if filtro.group:
+        where.append("group_name = ?")
+        params.append(filtro.group)
+    if filtro.status:
+        where.append("status = ?")
+        params.append(filtro.status)
+    if filtro.filename:
+        termo = filtro.filename.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        where.append("filename LIKE ? ESCAPE '\\'")
+        params.append(f"%{termo}%")
+    return where, params
+
+def _stats_filter_sql(date_from: Optional[str], date_to: Optional[str], group: Optional[str]) -> tuple:
+    where, params = [], []
+    if date_from:
+        where.append("day >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("day <= ?")
+        params.append(date_to)
+    if group:
+        where.append("group_name = ?")
+        params.append(group)
+    return (" WHERE " + " AND ".join(where) if where else ""), params
+
+def get_daily_stats(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                    group: Optional[str] = None) -> List[tuple]:
+    """Totais por dia: (day, jobs, copies, pages, printed_pages), em ordem cronológica."""
+    where, params = _stats_filter_sql(date_from, date_to, group)
+    return get_database().query(
+        "SELECT day, SUM(jobs), SUM(copies), SUM(pages), SUM(printed_pages) FROM print_stats_daily"
+        + where + " GROUP BY day ORDER BY day", tuple(params))
+
+def get_group_stats(date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[tuple]:
+    """Totais por grupo: (group_name, jobs, copies, pages, printed_pages), do maior para o menor."""
+    where, params = _stats_filter_sql(date_from, date_to, None)
+    return get_database().query(
+        "SELECT group_name, SUM(jobs), SUM(copies), SUM(pages), SUM(printed_pages) FROM print_stats_daily"
+        + where + " GROUP BY group_name ORDER BY SUM(printed_pages) DESC", tuple(params))
+
+def get_all_jobs(include_archive: bool = False) -> List[tuple]:
+    """
+    Busca todos os trabalhos de impressão do banco de dados, ordenados por data.
+    Com `include_archive`, inclui também o histórico arquivado (bem mais lento).
+    """
+    sql = "SELECT timestamp, filename, group_name, copies, pages, status FROM print_jobs ORDER BY timestamp DESC"
+    rows = get_database().query(sql)
+    if include_archive:
+        for _, caminho in reversed(list_archives()):
+            rows += _query_archive(caminho, sql)
+    return rows
+
+_TIMING_COLUMNS = ("timestamp, group_name, files, copies, merge, backend, status, total_ms, "
+                   "page_count_ms, merge_ms, dispatch_ms, db_ms, callback_ms")
+_INSERT_JOB_TIMING = f"INSERT INTO print_job_timings ({_TIMING_COLUMNS}) VALUES ({', '.join('?' * 13)})"
+
+def get_slowest_jobs(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                     group: Optional[str] = None, limit: int = 50) -> List[tuple]:
+    """
+    Trabalhos mais demorados do período, com o tempo de cada etapa:
+    (timestamp, group_name, files, copies, merge, backend, status, total_ms,
+    page_count_ms, merge_ms, dispatch_ms, db_ms, callback_ms).
+    """
+    where, params = _job_filter_sql(JobFilter(date_from, date_to, group))
+    sql = f"SELECT {_TIMING_COLUMNS} FROM print_job_timings"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY total_ms DESC LIMIT ?"
+    params.append(limit)
+    return get_database().query(sql, tuple(params))
+
+# --- MÓDULO DE RETENÇÃO DO HISTÓRICO ---
+# O banco principal guarda só os últimos `hot_days` dias. As linhas mais
+# antigas vão para um banco SQLite por mês em ARCHIVE_DIR, que as consultas
+# ao histórico continuam lendo. Os totais de print_stats_daily não mudam:
+# o trigger só soma nos INSERTs, e nada é descontado quando uma linha sai.
+
+_ARCHIVE_COLUMNS = "id, timestamp, filename, group_name, copies, status, pages, spool_job_id, spool_status"
+
+
+class RetentionPolicy(NamedTuple):
+    hot_days: int = RETENTION_DAYS                  # 0 = não arquiva
+    timing_days: int = TIMINGS_RETENTION_DAYS       # print_job_timings (diagnóstico): apagado depois disso
+    vacuum: str = RETENTION_VACUUM                  # incremental, full ou none
+
+
+class RetentionResult(NamedTuple):
+    archived: int
+    months: List[str]
+    timings_deleted: int
+    bytes_before: int
+    bytes_after: int
+
+
+def archive_path(month: str) -> str:
+    return os.path.join(ARCHIVE_DIR, f"print_jobs-{month}.db")
+
+
+def list_archives(date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[tuple]:
+    """Arquivos mensais que cobrem o período (datas ISO, inclusivas): [(AAAA-MM, caminho)], do mais antigo ao mais novo."""
+    try:
+        nomes = os.listdir(ARCHIVE_DIR)
+    except OSError:
+        return []
+    meses = sorted(n[len("print_jobs-"):-len(".db")] for n in nomes if n.startswith("print_jobs-") and n.endswith(".db"))
+    return [(mes, archive_path(mes)) for mes in meses
+            if (not date_from or mes >= date_from[:7]) and (not date_to or mes <= date_to[:7])]
+
+
+def _query_archive(caminho: str, sql: str, params: tuple = ()) -> List[tuple]:
+    """Consulta um arquivo mensal (somente leitura)."""
+    uri = pathlib.Path(os.path.abspath(caminho)).as_uri() + "?mode=ro"
+    try:
+        conn = sqlite3.connect(uri, uri=True, timeout=DB_BUSY_TIMEOUT)
+    except sqlite3.Error:
+        return []
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def apply_retention(policy: Optional[RetentionPolicy] = None, db_file: str = DB_FILE) -> RetentionResult:
+    """
+    Move para os arquivos mensais as linhas de `print_jobs` com mais de
+    `policy.hot_days` dias, apaga os tempos de impressão antigos e compacta o
+    banco. Cada mês é movido numa transação; se o programa cair no meio, a
+    próxima execução termina o serviço sem duplicar linhas no arquivo.
+    Se o histórico já foi enviado a alguma central (por SYNC_DIR ou por
+    `printbox_cli.py sync`), só sai do banco principal o que já foi enviado a
+    todas elas (ver `sync_archive_limit`).
+    """
+    policy = policy or RetentionPolicy()
+    db = get_database(db_file)
+    flush_print_log()
+    tamanho_antes = _db_size(db_file)
+    arquivados, meses = 0, []
+    max_id = sync_archive_limit()
+
+    if policy.hot_days > 0:
+        limite = (datetime.date.today() - datetime.timedelta(days=policy.hot_days)).isoformat()
+        for (mes,) in db.query(
+                "SELECT DISTINCT substr(timestamp, 1, 7) FROM print_jobs WHERE timestamp < ? AND id <= ? ORDER BY 1",
+                (limite, max_id if max_id is not None else sys.maxsize)):
+            arquivados += _archive_month(db, mes, limite, max_id)
+            meses.append(mes)
+
+    apagados = 0
+    if policy.timing_days > 0:
+        limite = (datetime.date.today() - datetime.timedelta(days=policy.timing_days)).isoformat()
+        apagados = db.execute("DELETE FROM print_job_timings WHERE timestamp < ?", (limite,)).rowcount
+
+    if arquivados or apagados:
+        _compact(db, policy.vacuum)
+    return RetentionResult(arquivados, meses, apagados, tamanho_antes, _db_size(db_file))
+
+
+def _archive_month(db: Database, mes: str, limite: str, max_id: Optional[int] = None) -> int:
+    """Move um mês (até `limite`) para o seu arquivo. Retorna quantas linhas saíram do banco principal."""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    inicio = f"{mes}-01"
+    ano, numero = int(mes[:4]), int(mes[5:7])
+    fim = min(f"{ano + numero // 12:04d}-{numero % 12 + 1:02d}-01", limite)
+    intervalo = (inicio, fim, max_id if max_id is not None else sys.maxsize)
+
+    conn = db.connection()
+    conn.execute("ATTACH DATABASE ? AS arquivo", (archive_path(mes),))  # ATTACH não pode ficar numa transação
+    try:
+        with db.transaction():
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS arquivo.print_jobs (
+                    id INTEGER PRIMARY KEY,
+                    timestamp TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    group_name TEXT NOT NULL,
+                    copies INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    pages INTEGER,
+                    spool_job_id TEXT,
+                    spool_status TEXT
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS arquivo.idx_print_jobs_timestamp ON print_jobs (timestamp)")
+            conn.execute("CREATE INDEX IF NOT EXISTS arquivo.idx_print_jobs_group ON print_jobs (group_name, timestamp)")
+            conn.execute(f'''
+                INSERT OR IGNORE INTO arquivo.print_jobs ({_ARCHIVE_COLUMNS})
+                SELECT {_ARCHIVE_COLUMNS} FROM main.print_jobs WHERE timestamp >= ? AND timestamp < ? AND id <= ?
+            ''', intervalo)
+            return conn.execute("DELETE FROM main.print_jobs WHERE timestamp >= ? AND timestamp < ? AND id <= ?",
+                                intervalo).rowcount
+    finally:
+        conn.execute("DETACH DATABASE arquivo")
+
+
+def _compact(db: Database, modo: str):
+    """Devolve ao sistema o espaço das linhas removidas."""
+    conn = db.connection()
+    if modo == "full":
+        conn.execute("VACUUM")
+    elif modo == "incremental":
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # Só vale depois de um VACUUM; das próximas vezes basta o incremental_vacuum
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        else:
+            conn.execute("PRAGMA incremental_vacuum")
+    if modo in ("full", "incremental"):
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def _db_size(db_file: str) -> int:
+    return sum(os.path.getsize(p) for p in (db_file, f"{db_file}-wal") if os.path.exists(p))
+
+
+# --- MÓDULO DE MÉTRICAS ---
+# Tempo gasto em cada etapa do caminho de impressão, acumulado desde o início
+# do processo. Exportado em texto do Prometheus ou JSON (arquivo METRICS_FILE
+# e, no servidor, GET /metrics).
+
+ETAPA_CONTAGEM_PAGINAS = "page_count"  # PyPDF2 (ou o cache de metadados)
+ETAPA_MESCLAGEM = "merge"              # montagem do PDF único
+ETAPA_ENVIO = "dispatch"               # backend.submit: lp, IPP, ...
+ETAPA_BANCO = "db_write"               # commit de um lote do histórico
+ETAPA_CALLBACK = "callback"            # on_progress chamado pelo worker
+ETAPA_INTERFACE = "ui_callback"        # atraso até o Tk executar a atualização da tela
+ETAPA_TRABALHO = "job"                 # run_print_job inteiro
+ETAPA_RENDERIZACAO = "render"          # Ghostscript gerando a versão pronta para impressão
+
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class StageMetrics:
+    """
+    Histograma de durações por etapa, seguro para várias threads. O custo de
+    uma medição é um `perf_counter` e um incremento sob lock.
+    """
+    def __init__(self, buckets: tuple = METRICS_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._etapas = {}  # etapa -> [contagens por faixa, quantidade, soma, máximo]
+        self._ultima_gravacao = float("-inf")
+
+    def observe(self, etapa: str, segundos: float):
+        with self._lock:
+            dados = self._etapas.get(etapa)
+            if dados is None:
+                dados = self._etapas[etapa] = [[0] * len(self.buckets), 0, 0.0, 0.0]
+            for i, limite in enumerate(self.buckets):
+                if segundos <= limite:
+                    dados[0][i] += 1
+                    break
+            dados[1] += 1
+            dados[2] += segundos
+            dados[3] = max(dados[3], segundos)
+
+    @contextlib.contextmanager
+    def timer(self, etapa: str, acumulado: Optional[dict] = None):
+        """Mede o bloco; com `acumulado`, soma também a duração (em ms) em acumulado[etapa]."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            segundos = time.perf_counter() - inicio
+            self.observe(etapa, segundos)
+            if acumulado is not None:
+                acumulado[etapa] = acumulado.get(etapa, 0.0) + segundos * 1000
+
+    def reset(self):
+        with self._lock:
+            self._etapas.clear()
+
+    def snapshot(self) -> dict:
+        """{etapa: {"count", "sum_s", "max_s", "buckets": {limite: contagem acumulada}}}"""
+        with self._lock:
+            copia = {etapa: (list(d[0]), d[1], d[2], d[3]) for etapa, d in self._etapas.items()}
+        resultado = {}
+        for etapa, (faixas, quantidade, soma, maximo) in sorted(copia.items()):
+            acumulado, cumulativas = 0, {}
+            for limite, contagem in zip(self.buckets, faixas):
+                acumulado += contagem
+                cumulativas[str(limite)] = acumulado
+            cumulativas["+Inf"] = quantidade
+            resultado[etapa] = {"count": quantidade, "sum_s": round(soma, 6), "max_s": round(maximo, 6),
+                                "buckets": cumulativas}
+        return resultado
+
+    def prometheus(self) -> str:
+        """As métricas no formato de texto do Prometheus."""
+        linhas = [
+            "# HELP printbox_stage_duration_seconds Duração de cada etapa do caminho de impressão.",
+            "# TYPE printbox_stage_duration_seconds histogram",
+        ]
+        maximos = []
+        for etapa, dados in self.snapshot().items():
+            for limite, contagem in dados["buckets"].items():
+                linhas.append(f'printbox_stage_duration_seconds_bucket{{stage="{etapa}",le="{limite}"}} {contagem}')
+            linhas.append(f'printbox_stage_duration_seconds_sum{{stage="{etapa}"}} {dados["sum_s"]}')
+            linhas.append(f'printbox_stage_duration_seconds_count{{stage="{etapa}"}} {dados["count"]}')
+            maximos.append(f'printbox_stage_duration_max_seconds{{stage="{etapa}"}} {dados["max_s"]}')
+        if maximos:
+            linhas += ["# HELP printbox_stage_duration_max_seconds Maior duração observada de cada etapa.",
+                       "# TYPE printbox_stage_duration_max_seconds gauge"] + maximos
+        return "\n".join(linhas) + "\n"
+
+    def write_file(self, path: str = METRICS_FILE):
+        """Grava as métricas em `path` (JSON se terminar em .json); sem caminho, não faz nada."""
+        if not path:
+            return
+        if path.endswith(".json"):
+            conteudo = json.dumps({"generated_at": datetime.datetime.now().isoformat(), "pid": os.getpid(),
+                                   "stages": self.snapshot()}, indent=2)
+        else:
+            conteudo = self.prometheus()
+        temporario = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(temporario, "w", encoding="utf-8") as f:
+                f.write(conteudo)
+            os.replace(temporario, path)  # Quem lê o arquivo nunca vê uma gravação pela metade
+        except OSError as e:
+            logger.warning("Não foi possível gravar as métricas em %s: %s", path, e)
+
+    def write_file_throttled(self, path: str = METRICS_FILE, interval: float = METRICS_WRITE_INTERVAL):
+        """
+        Como `write_file`, mas no máximo uma vez a cada `interval` segundos:
+        chamado ao fim de cada trabalho, não regrava o arquivo a cada PDF de um
+        lote. O que ficar para trás é gravado ao encerrar o processo.
+        """
+        if not path:
+            return
+        agora = time.monotonic()
+        with self._lock:
+            if agora - self._ultima_gravacao < interval:
+                return
+            self._ultima_gravacao = agora
+        self.write_file(path)
+
+
+metrics = StageMetrics()
+
+
+@atexit.register
+def _gravar_metricas_ao_sair():
+    metrics.write_file()
+
+# --- MÓDULO DE CACHE DE METADADOS DOS PDFs ---
+
+class PDFMetadata(NamedTuple):
+    """Metadados de um arquivo PDF guardados no cache."""
+    path: str
+    size: int
+    mtime: float
+    sha256: str
+    pages: Optional[int]
+
+
+def _hash_file(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Calcula o SHA-256 do conteúdo de um arquivo, lendo em blocos."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """
+    Armazenamento deduplicado dos PDFs, endereçado pelo conteúdo.
+
+    Cada conteúdo é gravado uma única vez em `.blobs/<sha256>.pdf` e os
+    arquivos das pastas de grupo viram hardlinks para esses blobs. Assim a
+    estrutura de pastas continua a mesma para o resto do programa, mas os
+    bytes repetidos (fordpass.pdf, pesquisa.pdf, ...) ocupam espaço uma vez só.
+    Quando o sistema de arquivos não suporta hardlinks, cai para uma cópia.
+
+    Um hardlink é o mesmo arquivo em todas as pastas: gravar por cima de
+    Bronco/fordpass.pdf mudaria também o de Maverick. Por isso os blobs são
+    somente leitura (trocar um arquivo é apagar e copiar de novo) e o conteúdo
+    de um blob é conferido antes de ser reaproveitado. No Windows, onde um
+    arquivo somente leitura não pode ser apagado nem trocado por um rename, as
+    pastas recebem cópias.
+    """
+    def __init__(self, root: str = BLOBS_DIR):
+        self.root = root
+        self._inodes = None  # (st_dev, st_ino) -> caminho do blob
+        self._lock = threading.Lock()
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.abspath(os.path.join(self.root, f"{sha256}.pdf"))
+
+    def put(self, src_path: str, sha256: Optional[str] = None) -> tuple:
+        """
+        Guarda o conteúdo do arquivo no repositório. Retorna (sha256, se era novo).
+        Passe `sha256` se o hash já tiver sido calculado.
+        """
+        sha256 = sha256 or _hash_file(src_path)
+        destino = self.blob_path(sha256)
+        if os.path.exists(destino):
+            if _hash_file(destino) == sha256:
+                if LINK_BLOBS:
+                    os.chmod(destino, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)  # Blobs de versões anteriores
+                return sha256, False
+            # Alguém gravou por cima de um dos hardlinks: o blob não é mais o conteúdo do
+            # nome. Os arquivos ligados a ele ficam com o que foi gravado; o blob é refeito.
+            with self._lock:
+                self._inodes = None
+
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{destino}.{os.getpid()}.{threading.get_ident()}.tmp"
+        _copy_file(src_path, tmp_path)
+        if LINK_BLOBS:
+            os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(tmp_path, destino)
+        self._index_blob(destino)
+        return sha256, True
+
+    def link(self, sha256: str, dest_path: str, copiar_se_falhar: bool = True):
+        """Cria `dest_path` apontando para o blob (hardlink ou, se não der ou no Windows, cópia)."""
+        tmp_path = f"{dest_path}.{os.getpid()}.tmp"
+        try:
+            if not LINK_BLOBS:
+                raise OSError("hardlinks desativados")
+            os.link(self.blob_path(sha256), tmp_path)
+        except OSError:
+            if not copiar_se_falhar:
+                raise
+            shutil.copyfile(self.blob_path(sha256), tmp_path)
+        os.replace(tmp_path, dest_path)
+
+    def import_file(self, src_path: str, dest_dir: str) -> bool:
+        """Importa um arquivo para a pasta de um grupo. Retorna True se havia bytes novos."""
+        sha256, novo = self.put(src_path)
+        self.link(sha256, os.path.join(dest_dir, os.path.basename(src_path)))
+        return novo
+
+    def deduplicate(self, grupos_dir: str = GRUPOS_DIR) -> tuple:
+        """
+        Converte os PDFs das pastas de grupo em hardlinks para os blobs
+        (`printbox_cli.py dedup`; não roda sozinho). Os arquivos convertidos
+        passam a ser somente leitura. Retorna (arquivos convertidos, bytes economizados).
+        """
+        if not LINK_BLOBS:
+            return 0, 0
+        convertidos, economizados = 0, 0
+        for grupo in os.scandir(grupos_dir):
+            if not grupo.is_dir() or grupo.name.startswith("."):
+                continue
+            for entry in os.scandir(grupo.path):
+                if not entry.is_file() or not entry.name.lower().endswith(".pdf"):
+                    continue
+                caminho = os.path.abspath(entry.path)
+                if self.resolve(caminho) != caminho:
+                    continue  # Já aponta para um blob
+                try:
+                    tamanho = entry.stat().st_size
+                    sha256, novo = self.put(caminho)
+                    self.link(sha256, caminho, copiar_se_falhar=False)
+                except OSError:
+                    continue  # Sem suporte a hardlink, arquivo em uso ou sem permissão: fica como está
+                convertidos += 1
+                if not novo:
+                    economizados += tamanho
+        return convertidos, economizados
+
+    def discard(self, sha256: str) -> bool:
+        """Remove um blob se nenhum grupo o usa (ex.: arquivo recusado na importação)."""
+        caminho = self.blob_path(sha256)
+        try:
+            if os.stat(caminho).st_nlink > 1:
+                return False
+            os.remove(caminho)
+        except OSError:
+            return False
+        with self._lock:
+            self._inodes = None
+        return True
+
+    def prune(self) -> int:
+        """Remove blobs que não são mais usados por nenhum grupo."""
+        removidos = 0
+        if not os.path.isdir(self.root):
+            return 0
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".pdf") and entry.stat().st_nlink <= 1:
+                try:
+                    os.remove(entry.path)
+                    removidos += 1
+                except OSError:
+                    pass
+        with self._lock:
+            self._inodes = None
+        return removidos
+
+    def resolve(self, path: str) -> str:
+        """Retorna o caminho do blob se `path` for um hardlink para ele; senão, o próprio caminho."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return path
+        if st.st_nlink <= 1:
+            return path
+        with self._lock:
+            if self._inodes is None:
+                self._inodes = {}
+                if os.path.isdir(self.root):
+                    for entry in os.scandir(self.root):
+                        if entry.name.endswith(".pdf"):
+                            blob_st = entry.stat()
+                            self._inodes[(blob_st.st_dev, blob_st.st_ino)] = os.path.abspath(entry.path)
+            return self._inodes.get((st.st_dev, st.st_ino), path)
+
+    def _index_blob(self, blob_path: str):
+        with self._lock:
+            if self._inodes is not None:
+                st = os.stat(blob_path)
+                self._inodes[(st.st_dev, st.st_ino)] = blob_path
+
+
+blob_store = BlobStore()
+
+
+def _copy_file(src_path: str, dest_path: str):
+    """
+    Copia um arquivo sem trazer os bytes para o Python: `copy_file_range` no
+    Linux (que ainda pode virar um reflink em btrfs/XFS) ou `shutil.copyfile`,
+    que usa sendfile no Linux e fcopyfile no macOS.
+    """
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(src_path, "rb") as src, open(dest_path, "wb") as dst:
+                restante = os.fstat(src.fileno()).st_size
+                while restante > 0:
+                    copiados = os.copy_file_range(src.fileno(), dst.fileno(), restante)
+                    if not copiados:
+                        break
+                    restante -= copiados
+            return
+        except OSError:
+            pass  # Kernel antigo, outro sistema de arquivos (EXDEV), ...: copia do jeito comum
+    shutil.copyfile(src_path, dest_path)
+
+
+def _count_pdf_pages(file_path: str) -> Optional[int]:
+    """Abre o PDF com o PyPDF2 e conta as páginas (operação cara)."""
+    try:
+        from PyPDF2 import PdfReader
+
+        with open(file_path, 'rb') as f:
+            reader = PdfReader(f, strict=False)
+            return len(reader.pages)
+    except Exception:
+        return None
+
+
+class PDFMetadataCache:
+    """
+    Cache de metadados (páginas, tamanho, mtime e hash) dos PDFs.
+
+    Uma LRU em memória fica na frente da tabela `pdf_metadata` do SQLite.
+    Uma entrada só vale enquanto o tamanho e o mtime do arquivo não mudarem.
+    Quando mudam, o hash é recalculado e, se o mesmo conteúdo já estiver
+    no cache com outro caminho, o número de páginas é reaproveitado.
+    """
+    def __init__(self, db_file: str = DB_FILE, max_entries: int = 512, blob_store: Optional["BlobStore"] = None):
+        self.db = get_database(db_file)
+        self.blob_store = blob_store
+        self.max_entries = max_entries
+        self._lru: "OrderedDict[str, PDFMetadata]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, file_path: str) -> Optional[PDFMetadata]:
+        """Retorna os metadados do arquivo, recalculando-os só quando necessário."""
+        path = os.path.abspath(file_path)
+        if self.blob_store is not None:
+            # Cópias de um mesmo blob compartilham uma única entrada no cache
+            path = self.blob_store.resolve(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        meta = self._lru_get(path)
+        if meta is not None and self._is_fresh(meta, st):
+            return meta
+
+        meta = self._db_get(path)
+        if meta is None or not self._is_fresh(meta, st):
+            meta = self._build(path, st)
+            if meta is None:
+                return None
+            self._db_put(meta)
+
+        self._lru_put(meta)
+        return meta
+
+    def get_page_count(self, file_path: str) -> Optional[int]:
+        """Atalho para obter apenas o número de páginas."""
+        meta = self.get(file_path)
+        return meta.pages if meta else None
+
+    def prime(self, file_path: str, sha256: str, pages: int):
+        """Registra metadados já calculados (na importação), sem abrir o PDF de novo."""
+        path = os.path.abspath(file_path)
+        if self.blob_store is not None:
+            path = self.blob_store.resolve(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        meta = PDFMetadata(path, st.st_size, st.st_mtime, sha256, pages)
+        self._db_put(meta)
+        self._lru_put(meta)
+
+    def invalidate(self, file_path: Optional[str] = None):
+        """Descarta da LRU a entrada de um arquivo (ou todas, se nenhum for informado)."""
+        with self._lock:
+            if file_path is None:
+                self._lru.clear()
+            else:
+                path = os.path.abspath(file_path)
+                if self.blob_store is not None:
+                    path = self.blob_store.resolve(path)
+                self._lru.pop(path, None)
+
+    @staticmethod
+    def _is_fresh(meta: PDFMetadata, st: os.stat_result) -> bool:
+        # Sem o número de páginas (PyPDF2 ausente, erro de leitura), tenta de novo na próxima vez
+        return meta.pages is not None and meta.size == st.st_size and meta.mtime == st.st_mtime
+
+    def _build(self, path: str, st: os.stat_result) -> Optional[PDFMetadata]:
+        try:
+            sha256 = _hash_file(path)
+        except OSError:
+            return None
+        pages = self._db_pages_by_hash(sha256)
+        if pages is None:
+            pages = _count_pdf_pages(path)
+        return PDFMetadata(path, st.st_size, st.st_mtime, sha256, pages)
+
+    def _lru_get(self, path: str) -> Optional[PDFMetadata]:
+        with self._lock:
+            meta = self._lru.get(path)
+            if meta is not None:
+                self._lru.move_to_end(path)
+            return meta
+
+    def _lru_put(self, meta: PDFMetadata):
+        with self._lock:
+            self._lru[meta.path] = meta
+            self._lru.move_to_end(meta.path)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def _db_get(self, path: str) -> Optional[PDFMetadata]:
+        try:
+            row = self.db.query_one(
+                "SELECT path, size, mtime, sha256, pages FROM pdf_metadata WHERE path = ?", (path,)
+            )
+        except sqlite3.Error:
+            return None
+        return PDFMetadata(*row) if row else None
+
+    def _db_pages_by_hash(self, sha256: str) -> Optional[int]:
+        try:
+            row = self.db.query_one(
+                "SELECT pages FROM pdf_metadata WHERE sha256 = ? AND pages IS NOT NULL LIMIT 1", (sha256,)
+            )
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+
+    def _db_put(self, meta: PDFMetadata):
+        # Vai pelo gravador em lote: o cache é só uma otimização e não precisa
+        # segurar a impressão esperando um commit
+        self.db.writer.submit('''
+            INSERT OR REPLACE INTO pdf_metadata (path, size, mtime, sha256, pages)
+            VALUES (?, ?, ?, ?, ?)
+        ''', tuple(meta))
+
+
+metadata_cache = PDFMetadataCache(blob_store=blob_store)
+
+# --- MÓDULO DE DOCUMENTOS MESCLADOS ---
+# Só para backends sem `multi_document` (hoje, o do Windows). O lp, o IPP e o
+# dry-run recebem os arquivos como documentos de um mesmo trabalho e não
+# precisam de um PDF montado aqui.
+
+def merged_pdf_for(file_paths: List[str], cache: PDFMetadataCache = metadata_cache) -> str:
+    """
+    Retorna o caminho de um PDF único com `file_paths` concatenados, na ordem.
+
+    O documento fica em cache no disco, identificado pelos hashes dos arquivos
+    de origem: a mesma seleção de um grupo reaproveita o PDF já montado, e
+    qualquer alteração num arquivo gera um documento novo.
+    """
+    hashes = []
+    for path in file_paths:
+        meta = cache.get(path)
+        if meta is None:
+            raise FileNotFoundError(f"O arquivo {path} não foi encontrado.")
+        hashes.append(meta.sha256)
+    key = hashlib.sha256("\n".join(hashes).encode()).hexdigest()
+    destino = os.path.join(MERGED_DIR, f"{key}.pdf")
+
+    if os.path.exists(destino):
+        os.utime(destino)  # Marca como usado recentemente para a limpeza do cache
+        return destino
+
+    from PyPDF2 import PdfMerger
+
+    os.makedirs(MERGED_DIR, exist_ok=True)
+    tmp_path = f"{destino}.{os.getpid()}.{threading.get_ident()}.tmp"
+    merger = PdfMerger(strict=False)
+    try:
+        # Os arquivos ficam abertos até a escrita: as páginas são copiadas
+        # direto do disco, sem carregar cada PDF inteiro na memória
+        with contextlib.ExitStack() as stack:
+            for path in file_paths:
+                merger.append(stack.enter_context(open(path, 'rb')))
+            with open(tmp_path, 'wb') as f:
+                merger.write(f)
+        os.replace(tmp_path, destino)
+    finally:
+        merger.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    _prune_merged_cache()
+    return destino
+
+
+def _prune_merged_cache(max_files: int = MERGED_CACHE_MAX_FILES):
+    """Mantém apenas os documentos mesclados usados mais recentemente."""
+    try:
+        entries = [e for e in os.scandir(MERGED_DIR) if e.name.endswith(".pdf")]
+    except OSError:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    for entry in entries[max_files:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+# --- MÓDULO DE CACHE DE RENDERIZAÇÃO ---
+# Versões dos PDFs já preparadas para uma impressora (perfil em
+# printer_profiles.json), para as impressoras lentas com PDFs vetoriais
+# pesados não reprocessarem o documento a cada impressão. Exemplo:
+#
+#   {"": {"format": "pdf", "dpi": 150},            <- impressora padrão do sistema
+#    "Brother_HL_1200": {"format": "raster", "dpi": 300},
+#    "Laser_Recepcao": {"format": "postscript", "dpi": 300}}
+#
+# pdf: transparências achatadas, fontes reduzidas ao usado e imagens reamostradas para o dpi;
+# raster: cada página vira uma imagem no dpi; postscript: já convertido para PostScript.
+
+RENDER_FORMATS = {
+    "pdf": ("pdf", "pdf", [
+        "-sDEVICE=pdfwrite", "-dCompatibilityLevel=1.3", "-dSubsetFonts=true", "-dEmbedAllFonts=true",
+        "-dDetectDuplicateImages=true", "-dDownsampleColorImages=true", "-dDownsampleGrayImages=true",
+        "-dColorImageResolution={dpi}", "-dGrayImageResolution={dpi}",
+    ]),
+    "raster": ("pdf", "pdf", ["-sDEVICE=pdfimage24", "-r{dpi}"]),
+    "postscript": ("postscript", "ps", ["-sDEVICE=ps2write", "-r{dpi}"]),
+}  # formato do perfil -> (formato enviado ao backend, extensão, argumentos do Ghostscript)
+
+
+class PrinterProfile(NamedTuple):
+    """Como preparar os documentos de uma impressora."""
+    format: str = "pdf"
+    dpi: int = 150
+
+    @property
+    def key(self) -> str:
+        return f"{self.format}-{self.dpi}"
+
+
+def load_printer_profiles(path: str = PRINTER_PROFILES_FILE) -> dict:
+    """Lê os perfis (impressora -> `PrinterProfile`). Arquivo ausente ou inválido = sem perfis."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            dados = json.load(f)
+        perfis = {}
+        for impressora, perfil in dados.items():
+            perfil = PrinterProfile(str(perfil.get("format", "pdf")), int(perfil.get("dpi", 150)))
+            if perfil.format not in RENDER_FORMATS or perfil.dpi <= 0:
+                raise ValueError(f"perfil inválido para {impressora or 'a impressora padrão'}: {perfil}")
+            perfis[impressora] = perfil
+        return perfis
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        logger.warning("Ignorando %s: %s", path, e)
+        return {}
+
+
+def _render_document(src_path: str, dest_path: str, profile: PrinterProfile, command: str = GS_COMMAND):
+    """Gera `dest_path` a partir do PDF com o Ghostscript (num processo separado)."""
+    argumentos = [arg.format(dpi=profile.dpi) for arg in RENDER_FORMATS[profile.format][2]]
+    tmp_path = f"{dest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    comando = [command, "-dSAFER", "-dBATCH", "-dNOPAUSE", "-dQUIET", *argumentos, f"-sOutputFile={tmp_path}", src_path]
+    try:
+        subprocess.run(comando, check=True, capture_output=True, timeout=RENDER_TIMEOUT)
+        os.replace(tmp_path, dest_path)
+    except subprocess.CalledProcessError as e:
+        raise OSError(f"Ghostscript falhou: {(e.stderr or b'').decode(errors='replace').strip() or e}")
+    except subprocess.TimeoutExpired:
+        raise OSError(f"Ghostscript não terminou em {RENDER_TIMEOUT} s")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class RenderCache:
+    """
+    Cache em disco das versões prontas para impressão, por perfil e pelo hash
+    do conteúdo (`render/<perfil>/<sha256>.<ext>`), limitado a `max_bytes`:
+    as menos usadas recentemente são apagadas primeiro.
+
+    A impressão nunca espera a renderização. `lookup` devolve a versão pronta,
+    se houver; se não houver, a impressão usa o PDF original e, com `watch`
+    ativo, a versão é gerada em segundo plano para as próximas vezes. Cada
+    renderização é um processo do Ghostscript, com no máximo `workers` ao
+    mesmo tempo. Sem perfis ou sem o Ghostscript instalado, nada muda.
+    """
+    def __init__(self, root: str = RENDER_DIR, profiles_file: str = PRINTER_PROFILES_FILE,
+                 max_bytes: int = RENDER_CACHE_MAX_BYTES, command: str = GS_COMMAND,
+                 workers: int = RENDER_WORKERS, cache: PDFMetadataCache = metadata_cache):
+        self.root = root
+        self.profiles_file = profiles_file
+        self.max_bytes = max_bytes
+        self.command = command
+        self.workers = workers
+        self.cache = cache
+        self._profiles = {}
+        self._profiles_mtime = None
+        self._executor = None
+        self._background = False
+        self._pendentes = set()  # (sha256, perfil) sendo renderizados
+        self._falhas = set()     # não tenta de novo a cada impressão
+        self._lock = threading.Lock()
+
+    @property
+    def profiles(self) -> dict:
+        """Perfis do arquivo de configuração, relidos quando ele muda."""
+        try:
+            mtime = os.stat(self.profiles_file).st_mtime
+        except OSError:
+            mtime = None
+        with self._lock:
+            if mtime != self._profiles_mtime:
+                self._profiles = load_printer_profiles(self.profiles_file) if mtime is not None else {}
+                self._profiles_mtime = mtime
+            return self._profiles
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.profiles) and shutil.which(self.command) is not None
+
+    def path_for(self, sha256: str, profile: PrinterProfile) -> str:
+        extensao = RENDER_FORMATS[profile.format][1]
+        return os.path.join(self.root, profile.key, f"{sha256}.{extensao}")
+
+    def lookup(self, file_path: str, printer: str = "", formats: tuple = ("pdf", "postscript")) -> Optional[str]:
+        """Caminho da versão pronta de `file_path` para `printer`, ou None para usar o original."""
+        profile = self.profiles.get(printer or "")
+        if profile is None or RENDER_FORMATS[profile.format][0] not in formats:
+            return None
+        meta = self.cache.get(file_path)
+        if meta is None:
+            return None
+        destino = self.path_for(meta.sha256, profile)
+        try:
+            os.utime(destino)  # Marca como usado recentemente para a limpeza do cache
+            return destino
+        except OSError:
+            pass
+        if self._background:
+            self._schedule(meta.path, meta.sha256, profile)
+        return None
+
+    def warm(self, file_paths: List[str]) -> int:
+        """Agenda a renderização, para todos os perfis, dos arquivos que ainda não têm versão pronta."""
+        if not self.enabled:
+            return 0
+        perfis = set(self.profiles.values())
+        agendados = 0
+        for file_path in file_paths:
+            meta = self.cache.get(file_path)
+            if meta is None:
+                continue
+            for profile in perfis:
+                if not os.path.exists(self.path_for(meta.sha256, profile)):
+                    agendados += self._schedule(meta.path, meta.sha256, profile)
+        return agendados
+
+    def watch(self, group_index: "GroupIndex"):
+        """Renderiza em segundo plano os grupos atuais e, depois, os que forem alterados."""
+        self._background = True
+
+        def aquecer(grupos):
+            self.warm([os.path.join(group_index.root, g, f) for g in grupos for f in group_index.files(g)])
+
+        group_index.subscribe(lambda alterados, lista_mudou: threading.Thread(
+            target=aquecer, args=(alterados,), daemon=True).start())
+        threading.Thread(target=aquecer, args=(group_index.groups(),), daemon=True).start()
+
+    @property
+    def failures(self) -> set:
+        """(sha256, perfil) que o Ghostscript não conseguiu converter nesta execução."""
+        with self._lock:
+            return set(self._falhas)
+
+    def wait(self):
+        """Espera as renderizações agendadas terminarem."""
+        while True:
+            with self._lock:
+                if not self._pendentes:
+                    return
+            time.sleep(0.1)
+
+    def stop(self):
+        self._background = False
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def prune(self) -> int:
+        """Apaga as versões menos usadas até o cache caber em `max_bytes`. Retorna quantas apagou."""
+        arquivos = []
+        try:
+            for pasta in os.scandir(self.root):
+                if pasta.is_dir():
+                    for entry in os.scandir(pasta.path):
+                        if not entry.name.endswith(".tmp"):
+                            st = entry.stat()
+                            arquivos.append((st.st_mtime, st.st_size, entry.path))
+        except OSError:
+            return 0
+        total = sum(tamanho for _, tamanho, _ in arquivos)
+        removidos = 0
+        for _, tamanho, caminho in sorted(arquivos):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(caminho)
+                total -= tamanho
+                removidos += 1
+            except OSError:
+                pass
+        return removidos
+
+    def _schedule(self, src_path: str, sha256: str, profile: PrinterProfile) -> int:
+        chave = (sha256, profile)
+        with self._lock:
+            if chave in self._pendentes or chave in self._falhas:
+                return 0
+            self._pendentes.add(chave)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="printbox-render")
+            self._executor.submit(self._render, src_path, sha256, profile)
+        return 1
+
+    def _render(self, src_path: str, sha256: str, profile: PrinterProfile):
+        destino = self.path_for(sha256, profile)
+        try:
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            with metrics.timer(ETAPA_RENDERIZACAO):
+                _render_document(src_path, destino, profile, self.command)
+        except OSError as e:
+            logger.warning("Não foi possível preparar %s (%s): %s", src_path, profile.key, e)
+            with self._lock:
+                self._falhas.add((sha256, profile))
+        finally:
+            with self._lock:
+                self._pendentes.discard((sha256, profile))
+        self.prune()
+
+
+render_cache = RenderCache()
+
+# --- MÓDULO DE ÍNDICE DE GRUPOS ---
+
+class GroupIndex:
+    """
+    Índice em memória dos grupos (pastas) e dos PDFs de cada grupo.
+
+    É montado uma vez com `os.scandir` numa thread de fundo e depois mantido
+    por um observador que compara o mtime das pastas a cada poucos segundos,
+    relendo só os grupos que mudaram. Alterações em sequência (uma cópia de
+    vários arquivos, por exemplo) são agrupadas num único aviso. Uma cópia do
+    índice fica salva em disco para que a próxima abertura já mostre os
+    grupos antes mesmo da primeira leitura da pasta.
+
+    Os inscritos em `subscribe` recebem (grupos alterados, se a lista de
+    grupos mudou) na thread do observador.
+    """
+    def __init__(self, root: str = GRUPOS_DIR, snapshot_path: str = GROUP_INDEX_SNAPSHOT,
+                 poll_interval: float = GROUP_INDEX_POLL_INTERVAL, debounce: float = GROUP_INDEX_DEBOUNCE):
+        self.root = root
+        self.snapshot_path = snapshot_path
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self._lock = threading.Lock()
+        self._groups = {}  # nome do grupo -> {"mtime": float, "files": [pdfs ordenados]}
+        self._subscribers = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    # --- Consulta ---
+
+    def groups(self) -> List[str]:
+        with self._lock:
+            return sorted(self._groups)
+
+    def files(self, group: str) -> List[str]:
+        with self._lock:
+            info = self._groups.get(group)
+            return list(info["files"]) if info else []
+
+    def subscribe(self, callback: Callable[[set, bool], None]):
+        self._subscribers.append(callback)
+
+    # --- Ciclo de vida ---
+
+    def load_snapshot(self) -> bool:
+        """Carrega o índice salvo na última execução (início "quente")."""
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                dados = json.load(f)
+            groups = {nome: {"mtime": info["mtime"], "files": list(info["files"])}
+                      for nome, info in dados["groups"].items()}
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        with self._lock:
+            self._groups = groups
+        return True
+
+    def start(self):
+        """Começa a observar a pasta; a primeira passada confere o índice inteiro."""
+        self._thread = threading.Thread(target=self._watch_loop, name="printbox-group-index", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def refresh(self, group: Optional[str] = None):
+        """Relê agora um grupo (ou tudo) e avisa os inscritos, sem esperar o observador."""
+        self._apply(self._scan(only=group))
+
+    # --- Observação ---
+
+    def _watch_loop(self):
+        self._apply(self._scan())
+        while not self._stop.wait(self.poll_interval):
+            try:
+                mudancas = self._scan()
+            except OSError:
+                continue  # Pasta de rede indisponível: tenta de novo no próximo ciclo
+            if not mudancas[0] and not mudancas[1]:
+                self._apply(mudancas)  # Só mtimes mudaram (ex.: deduplicação); atualiza sem avisar
+                continue
+            # Debounce: só avisa quando a pasta passa um intervalo sem novas mudanças
+            while not self._stop.wait(self.debounce):
+                mais = self._scan(base=mudancas[2])
+                if not mais[0] and not mais[1]:
+                    break
+                mudancas = (mudancas[0] | mais[0], mudancas[1] or mais[1], mais[2])
+            self._apply(mudancas)
+
+    def _scan(self, only: Optional[str] = None, base: Optional[dict] = None) -> tuple:
+        """
+        Compara a pasta com o índice (ou com `base`). Só lista de novo os grupos
+        cujo mtime mudou. Retorna (grupos alterados, se a lista mudou, novo estado).
+        """
+        with self._lock:
+            atual = dict(self._groups if base is None else base)
+
+        novo = {}
+        if only is None:
+            for entry in os.scandir(self.root):
+                if entry.name.startswith(".") or not entry.is_dir():
+                    continue
+                novo[entry.name] = self._scan_group(entry, atual.get(entry.name))
+        else:
+            novo = dict(atual)
+            caminho = os.path.join(self.root, only)
+            if os.path.isdir(caminho):
+                novo[only] = self._scan_group(caminho, None)
+            else:
+                novo.pop(only, None)
+
+        alterados = {nome for nome in set(novo) | set(atual)
+                     if nome not in novo or nome not in atual or novo[nome]["files"] != atual[nome]["files"]}
+        lista_mudou = set(novo) != set(atual)
+        return alterados, lista_mudou, novo
+
+    @staticmethod
+    def _scan_group(entry, anterior: Optional[dict]) -> dict:
+        caminho = entry.path if isinstance(entry, os.DirEntry) else entry
+        mtime = entry.stat().st_mtime if isinstance(entry, os.DirEntry) else os.stat(caminho).st_mtime
+        if anterior is not None and anterior["mtime"] == mtime:
+            return anterior
+        try:
+            files = sorted(e.name for e in os.scandir(caminho) if e.name.lower().endswith(".pdf") and e.is_file())
+        except OSError:
+            files = []
+        return {"mtime": mtime, "files": files}
+
+    def _apply(self, mudancas: tuple):
+        alterados, lista_mudou, novo = mudancas
+        with self._lock:
+            mtimes_mudaram = any(self._groups.get(n, {}).get("mtime") != info["mtime"] for n, info in novo.items())
+            self._groups = novo
+        if alterados or lista_mudou or mtimes_mudaram:
+            self._save_snapshot()
+        if alterados or lista_mudou:
+            for callback in list(self._subscribers):
+                callback(alterados, lista_mudou)
+
+    def _save_snapshot(self):
+        with self._lock:
+            conteudo = json.dumps({"groups": self._groups}, ensure_ascii=False)
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+            tmp_path = f"{self.snapshot_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(conteudo)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError:
+            pass  # Sem o arquivo a próxima abertura só demora um pouco mais
+
+# --- MÓDULO DE IMPORTAÇÃO DE GRUPOS ---
+
+IMPORTACAO_NOVO = "novo"
+IMPORTACAO_ATUALIZADO = "atualizado"
+IMPORTACAO_INALTERADO = "inalterado"
+
+
+class ImportResult(NamedTuple):
+    """Resumo de uma importação: nomes dos arquivos em cada situação."""
+    group: str
+    added: List[str]
+    updated: List[str]
+    unchanged: List[str]
+    invalid: List[tuple]  # (arquivo, motivo)
+    cancelled: bool = False
+
+
+def _inspect_pdf(file_path: str) -> tuple:
+    """
+    Confere se o arquivo é um PDF legível e conta as páginas; roda num processo
+    separado durante a importação. Retorna (páginas, erro). Sem o PyPDF2, ou
+    com um PDF protegido por senha, só o cabeçalho é verificado.
+    """
+    try:
+        with open(file_path, "rb") as f:
+            if b"%PDF-" not in f.read(1024):
+                return None, "não é um arquivo PDF"
+    except OSError as e:
+        return None, str(e)
+    try:
+        from PyPDF2 import PdfReader
+    except ImportError:
+        return None, ""
+    try:
+        with open(file_path, "rb") as f:
+            reader = PdfReader(f, strict=False)
+            if reader.is_encrypted and not reader.decrypt(""):
+                return None, ""
+            return len(reader.pages), ""
+    except Exception as e:
+        return None, f"PDF inválido: {e}"
+
+
+def import_group(group: str, sources: List[str],
+                 on_progress: Optional[Callable[[float, str], None]] = None,
+                 is_cancelled: Optional[Callable[[], bool]] = None,
+                 grupos_dir: str = GRUPOS_DIR, workers: int = IMPORT_WORKERS,
+                 processes: int = IMPORT_PROCESSES) -> ImportResult:
+    """
+    Importa os PDFs `sources` para o grupo `group`, criando-o se necessário.
+
+    Os arquivos são copiados em paralelo para o repositório de blobs e ligados
+    numa pasta temporária dentro de `grupos_dir`. Cada conteúdo novo é validado
+    e tem as páginas contadas num processo separado, e o resultado já fica no
+    cache de metadados. Só no fim os arquivos vão para a pasta do grupo: um
+    grupo novo aparece de uma vez (rename da pasta) e, num grupo existente,
+    cada arquivo é trocado atomicamente. Arquivos com o mesmo conteúdo que já
+    está no grupo são pulados, e nada é apagado do grupo.
+
+    Se `is_cancelled()` retornar True antes do fim, o grupo não é alterado.
+    """
+    if not group or group.startswith(".") or os.sep in group or (os.altsep and os.altsep in group):
+        raise ValueError(f"nome de grupo inválido: {group!r}")
+
+    def progresso(valor: float, mensagem: str):
+        if on_progress is not None:
+            on_progress(valor, mensagem)
+
+    def cancelado() -> bool:
+        return is_cancelled is not None and is_cancelled()
+
+    arquivos = {}
+    for src in sources:
+        arquivos.setdefault(os.path.basename(src), src)  # Nomes repetidos: vale o primeiro
+    group_path = os.path.join(grupos_dir, group)
+    os.makedirs(grupos_dir, exist_ok=True)
+    # Na mesma pasta dos grupos (mesmo sistema de arquivos, para o rename) e
+    # começando com "." para o índice de grupos ignorá-la
+    staging = os.path.join(grupos_dir, f".importando-{os.getpid()}-{os.urandom(4).hex()}")
+    os.mkdir(staging)  # Não mkdtemp: a pasta vira a do grupo e deve ter as permissões de sempre
+
+    def preparar(nome: str, src: str) -> tuple:
+        """Hash, comparação com o grupo atual e cópia para a pasta temporária."""
+        if cancelado():
+            return nome, None, None, ""
+        try:
+            sha256 = _hash_file(src)
+            destino = os.path.join(group_path, nome)
+            situacao = IMPORTACAO_NOVO
+            if os.path.exists(destino):
+                if _hash_file(destino) == sha256:
+                    return nome, sha256, IMPORTACAO_INALTERADO, ""
+                situacao = IMPORTACAO_ATUALIZADO
+            if blob_store.put(src, sha256)[1]:
+                novos_blobs.add(sha256)
+            blob_store.link(sha256, os.path.join(staging, nome))
+        except OSError as e:
+            return nome, None, None, str(e)
+        return nome, sha256, situacao, ""
+
+    situacoes, hashes, paginas, invalidos = {}, {}, {}, []
+    novos_blobs, publicados = set(), set()  # Blobs criados nesta importação / que ficaram num grupo
+    validacoes = {}  # future -> sha256 (um mesmo conteúdo é validado uma vez só)
+    total = len(arquivos) * 2 or 1
+    feitos = 0
+    copias = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="printbox-import")
+    validador = None
+    futuros = []
+    try:
+        futuros = [copias.submit(preparar, nome, src) for nome, src in arquivos.items()]
+        for futuro in as_completed(futuros):
+            nome, sha256, situacao, erro = futuro.result()
+            feitos += 1
+            if erro:
+                invalidos.append((nome, erro))
+                feitos += 1
+            elif situacao == IMPORTACAO_INALTERADO:
+                situacoes[nome], hashes[nome] = situacao, sha256
+                feitos += 1
+            elif situacao is not None:
+                situacoes[nome], hashes[nome] = situacao, sha256
+                if sha256 not in validacoes.values():
+                    if validador is None:
+                        validador = _process_pool(processes) or copias
+                    try:
+                        validacoes[validador.submit(_inspect_pdf, blob_store.blob_path(sha256))] = sha256
+                    except BrokenExecutor:
+                        validador.shutdown(wait=False)
+                        validador = copias
+                        validacoes[validador.submit(_inspect_pdf, blob_store.blob_path(sha256))] = sha256
+            progresso(feitos / total * 100, f"Copiando {nome}")
+            if cancelado():
+                break
+
+        if not cancelado():
+            por_hash = {}
+            for nome, situacao in situacoes.items():
+                if situacao != IMPORTACAO_INALTERADO:
+                    por_hash.setdefault(hashes[nome], []).append(nome)
+            for futuro in as_completed(validacoes):
+                if cancelado():
+                    break
+                try:
+                    pages, erro = futuro.result()
+                except BrokenExecutor:
+                    # Um processo do pool morreu (ex.: sem memória): valida aqui mesmo
+                    pages, erro = _inspect_pdf(blob_store.blob_path(validacoes[futuro]))
+                for nome in por_hash[validacoes[futuro]]:
+                    feitos += 1
+                    if erro:
+                        invalidos.append((nome, erro))
+                        os.remove(os.path.join(staging, nome))
+                        del situacoes[nome]
+                    else:
+                        paginas[nome] = pages
+                    progresso(feitos / total * 100, f"Validando {nome}")
+
+        if cancelado():
+            progresso(0, "Importação cancelada.")
+            return ImportResult(group, [], [], [], [], cancelled=True)
+
+        alterados = [nome for nome, situacao in situacoes.items() if situacao != IMPORTACAO_INALTERADO]
+        if alterados:
+            _publish_staging(staging, group_path, alterados)
+            publicados.update(hashes[nome] for nome in alterados)
+        for nome in alterados:
+            if paginas.get(nome) is not None:
+                metadata_cache.prime(os.path.join(group_path, nome), hashes[nome], paginas[nome])
+        progresso(100, "Importação concluída.")
+        return ImportResult(
+            group,
+            sorted(n for n, s in situacoes.items() if s == IMPORTACAO_NOVO),
+            sorted(n for n, s in situacoes.items() if s == IMPORTACAO_ATUALIZADO),
+            sorted(n for n, s in situacoes.items() if s == IMPORTACAO_INALTERADO),
+            sorted(invalidos),
+        )
+    finally:
+        for futuro in futuros + list(validacoes):
+            futuro.cancel()
+        if validador is not None and validador is not copias:
+            validador.shutdown(wait=False)
+        # Espera as cópias em andamento antes de apagar a pasta temporária
+        copias.shutdown(wait=True)
+        shutil.rmtree(staging, ignore_errors=True)
+        # Arquivos recusados ou importação cancelada: os blobs criados aqui não ficam órfãos
+        for sha256 in novos_blobs - publicados:
+            blob_store.discard(sha256)
+
+
+def _process_pool(processes: int) -> Optional[ProcessPoolExecutor]:
+    """
+    Pool de processos para validar os PDFs fora do GIL. Usa "spawn" porque o
+    chamador pode ter threads (Tk, fila, SQLite) que um fork copiaria no meio
+    de uma operação. Retorna None se não der para criar processos.
+    """
+    if processes <= 1:
+        return None
+    try:
+        return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+    except (OSError, NotImplementedError, ImportError):
+        return None
+
+
+def _publish_staging(staging: str, group_path: str, nomes: List[str]):
+    """Leva os arquivos da pasta temporária para a pasta do grupo."""
+    if not os.path.exists(group_path):
+        try:
+            os.rename(staging, group_path)  # Grupo novo: aparece inteiro, de uma vez
+            return
+        except OSError:
+            os.makedirs(group_path, exist_ok=True)  # Criado por outro processo no meio do caminho
+    for nome in nomes:
+        os.replace(os.path.join(staging, nome), os.path.join(group_path, nome))
+
+
+# --- MÓDULO DE FILA DE IMPRESSÃO ---
+
+# Estados de um trabalho na fila
+FILA_PENDENTE = "Na fila"
+FILA_IMPRIMINDO = "Imprimindo"
+FILA_CONCLUIDO = "Concluído"
+FILA_FALHA = "Falha"
+FILA_CANCELADO = "Cancelado"
+
+
+class QueuedJob(NamedTuple):
+    """Um trabalho da fila de impressão (um grupo ou seleção de arquivos)."""
+    id: int
+    group_name: str
+    files: List[str]
+    copies: int
+    merge: bool
+    printer: str
+    priority: int
+    status: str
+    attempts: int
+    error: Optional[str]
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "QueuedJob":
+        id_, group_name, files, copies, merge, printer, priority, status, attempts, error = row
+        return cls(id_, group_name, json.loads(files), copies, bool(merge), printer, priority, status, attempts, error)
+
+
+_QUEUE_COLUMNS = "id, group_name, files, copies, merge, printer, priority, status, attempts, error"
+
+
+class PrintScheduler:
+    """
+    Fila de impressão persistente (tabela `print_queue`) com despacho concorrente.
+
+    Os trabalhos são atendidos por prioridade e, depois, por ordem de chegada.
+    Cada impressora de destino tem no máximo um trabalho em andamento, o que
+    preserva a ordem por impressora e deixa impressoras diferentes trabalharem
+    em paralelo dentro de um pool limitado de threads. Como a fila fica no
+    SQLite, trabalhos pendentes sobrevivem a um reinício do programa.
+
+    Vários processos (estações, o servidor) podem despachar a mesma fila:
+    cada trabalho é reservado com um UPDATE condicional, e quem o reservou
+    (`owner`) renova a reserva enquanto imprime. Trabalhos de um processo
+    que morreu voltam para a fila.
+
+    `worker` recebe o `QueuedJob` e retorna True em caso de sucesso.
+    """
+    def __init__(self, worker: Callable[[QueuedJob], bool], db_file: str = DB_FILE,
+                 max_workers: int = MAX_PRINT_WORKERS, on_change: Optional[Callable[[], None]] = None):
+        self.worker = worker
+        self.db = get_database(db_file)
+        self.on_change = on_change
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="printbox-worker")
+        self._cond = threading.Condition()
+        self._active = {}  # impressora -> id do trabalho em andamento
+        self._cancelados = set()
+        self._paused = False
+        self._stopped = False
+        self._acordar = False  # Houve mudança desde a última volta do despacho
+        self._thread = None
+
+    # --- Ciclo de vida ---
+
+    def start(self):
+        """Recupera trabalhos interrompidos por um reinício e começa a despachar."""
+        self._recover_stale()
+        self._thread = threading.Thread(target=self._dispatch_loop, name="printbox-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = True):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._executor.shutdown(wait=wait)
+
+    # --- Operações da fila ---
+
+    def enqueue(self, group: str, files: List[str], copies: int, merge: bool = False,
+                printer: str = "", priority: int = 0) -> int:
+        """Adiciona um trabalho à fila e retorna o seu id."""
+        agora = datetime.datetime.now().isoformat()
+        job_id = self._execute('''
+            INSERT INTO print_queue (created_at, updated_at, group_name, files, copies, merge, printer, priority, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (agora, agora, group, json.dumps(files), copies, int(merge), printer or "", priority, FILA_PENDENTE))
+        self._wake()
+        return job_id
+
+    def cancel(self, job_id: int) -> bool:
+        """
+        Cancela um trabalho. Se ele já estiver imprimindo, os arquivos que
+        ainda não foram enviados ao spooler são descartados.
+        """
+        with self._cond:
+            if job_id in self._active.values():
+                self._cancelados.add(job_id)
+                return True
+        alterado = self._set_status(job_id, FILA_CANCELADO, somente_se=(FILA_PENDENTE,))
+        self._notify_change()
+        return alterado
+
+    def retry(self, job_id: int) -> bool:
+        """Recoloca na fila um trabalho que falhou ou foi cancelado."""
+        alterado = self._set_status(job_id, FILA_PENDENTE, somente_se=(FILA_FALHA, FILA_CANCELADO))
+        self._wake()
+        return alterado
+
+    def pause(self):
+        """Suspende o despacho de novos trabalhos (os que já estão imprimindo terminam)."""
+        with self._cond:
+            self._paused = True
+        self._notify_change()
+
+    def resume(self):
+        with self._cond:
+            self._paused = False
+        self._wake()
+
+    @property
+    def paused(self) -> bool:
+        return self._paused
+
+    def is_cancelled(self, job_id: int) -> bool:
+        """Consultado pelo worker entre um arquivo e outro."""
+        with self._cond:
+            return job_id in self._cancelados
+
+    def get_job(self, job_id: int) -> Optional[QueuedJob]:
+        row = self.db.query_one(f"SELECT {_QUEUE_COLUMNS} FROM print_queue WHERE id = ?", (job_id,))
+        return QueuedJob.from_row(row) if row else None
+
+    def list_jobs(self, limit: int = 100) -> List[QueuedJob]:
+        """Trabalhos mais recentes da fila, do mais novo para o mais antigo."""
+        rows = self.db.query(f"SELECT {_QUEUE_COLUMNS} FROM print_queue ORDER BY id DESC LIMIT ?", (limit,))
+        return [QueuedJob.from_row(row) for row in rows]
+
+    # --- Despacho ---
+
+    def _dispatch_loop(self):
+        # `_cond` protege só o estado em memória. O SQLite pode esperar até
+        # DB_BUSY_TIMEOUT por outro processo, e nesse tempo cancel(), pause() e
+        # is_cancelled() (chamados pela interface) não podem ficar bloqueados.
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                pausado = self._paused
+                ativos = dict(self._active)
+                self._acordar = False
+
+            self._heartbeat(ativos)
+            if self._recover_stale(ativos):
+                self._notify_change()
+            if not pausado:
+                for job in self._next_jobs(ativos):
+                    with self._cond:
+                        if self._stopped or self._paused:
+                            break
+                    if not self._claim(job):
+                        continue  # Outro processo reservou o trabalho primeiro
+                    with self._cond:
+                        self._active[job.printer] = job.id
+                    self._executor.submit(self._run, job)
+                    self._notify_change()
+
+            with self._cond:
+                if not self._acordar and not self._stopped:
+                    # O timeout cobre trabalhos adicionados por outro processo no mesmo banco
+                    self._cond.wait(timeout=5)
+
+    def _claim(self, job: QueuedJob) -> bool:
+        """Reserva o trabalho para este processo, só se ele ainda estiver na fila."""
+        cursor = self.db.execute('''
+            UPDATE print_queue SET status = ?, owner = ?, attempts = attempts + 1, error = NULL, updated_at = ?
+            WHERE id = ? AND status = ?
+        ''', (FILA_IMPRIMINDO, self.owner, datetime.datetime.now().isoformat(), job.id, FILA_PENDENTE))
+        return cursor.rowcount > 0
+
+    def _heartbeat(self, ativos: dict):
+        """Renova a reserva dos trabalhos que este processo está imprimindo."""
+        if ativos:
+            self._execute("UPDATE print_queue SET updated_at = ? WHERE status = ? AND owner = ?",
+                          (datetime.datetime.now().isoformat(), FILA_IMPRIMINDO, self.owner))
+
+    def _recover_stale(self, ativos: Optional[dict] = None) -> int:
+        """
+        Devolve à fila os trabalhos "Imprimindo" cujo processo morreu: os de um
+        processo encerrado nesta máquina na hora, e os demais quando a reserva
+        passa `QUEUE_LEASE` segundos sem ser renovada.
+        """
+        limite = (datetime.datetime.now() - datetime.timedelta(seconds=QUEUE_LEASE)).isoformat()
+        rows = self.db.query("SELECT id, owner, updated_at FROM print_queue WHERE status = ?", (FILA_IMPRIMINDO,))
+        recuperados = 0
+        for job_id, owner, updated_at in rows:
+            if owner == self.owner:
+                if ativos and job_id in ativos.values():
+                    continue
+                parado = True  # Sobra de uma execução anterior que teve o mesmo pid
+            else:
+                parado = owner is None or updated_at < limite or _owner_is_dead(owner)
+            if parado:
+                cursor = self.db.execute('''
+                    UPDATE print_queue SET status = ?, owner = NULL, updated_at = ?
+                    WHERE id = ? AND status = ? AND owner IS ? AND updated_at = ?
+                ''', (FILA_PENDENTE, datetime.datetime.now().isoformat(), job_id, FILA_IMPRIMINDO, owner, updated_at))
+                recuperados += cursor.rowcount
+        return recuperados
+
+    def _next_jobs(self, ativos: dict) -> List[QueuedJob]:
+        """Próximo trabalho pendente de cada impressora que está livre."""
+        rows = self.db.query(f'''
+            SELECT {_QUEUE_COLUMNS} FROM print_queue WHERE status = ? ORDER BY priority DESC, id
+        ''', (FILA_PENDENTE,))
+
+        ocupadas = set(ativos)
+        escolhidos = []
+        for row in rows:
+            job = QueuedJob.from_row(row)
+            if job.printer not in ocupadas:
+                ocupadas.add(job.printer)
+                escolhidos.append(job)
+        return escolhidos
+
+    def _run(self, job: QueuedJob):
+        error = None
+        try:
+            ok = self.worker(job)
+        except Exception as e:
+            ok, error = False, str(e)
+
+        with self._cond:
+            cancelado = job.id in self._cancelados
+        status = FILA_CANCELADO if cancelado else (FILA_CONCLUIDO if ok else FILA_FALHA)
+        # Grava antes de liberar a impressora: enquanto está em `_active`, o trabalho
+        # "Imprimindo" deste processo não é confundido com uma sobra de execução anterior
+        self._execute("UPDATE print_queue SET status = ?, error = ?, updated_at = ? WHERE id = ? AND owner = ?",
+                      (status, error, datetime.datetime.now().isoformat(), job.id, self.owner))
+        with self._cond:
+            self._cancelados.discard(job.id)
+            self._active.pop(job.printer, None)
+            self._acordar = True
+            self._cond.notify_all()
+        self._notify_change()
+
+    # --- Auxiliares ---
+
+    def _set_status(self, job_id: int, status: str, somente_se: tuple) -> bool:
+        marcadores = ", ".join("?" for _ in somente_se)
+        cursor = self.db.execute(
+            f"UPDATE print_queue SET status = ?, updated_at = ? WHERE id = ? AND status IN ({marcadores})",
+            (status, datetime.datetime.now().isoformat(), job_id) + tuple(somente_se))
+        return cursor.rowcount > 0
+
+    def _execute(self, sql: str, params: tuple = ()) -> int:
+        return self.db.execute(sql, params).lastrowid
+
+    def _wake(self):
+        with self._cond:
+            self._acordar = True
+            self._cond.notify_all()
+        self._notify_change()
+
+    def _notify_change(self):
+        if self.on_change is not None:
+            self.on_change()
+
+
+def _owner_is_dead(owner: str) -> bool:
+    """True se `owner` ("máquina:pid") é um processo desta máquina que já terminou."""
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    if sys.platform == "win32":
+        return False  # os.kill(pid, 0) encerraria o processo no Windows; vale só o prazo da reserva
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass  # Existe, mas pertence a outro usuário
+    return False
+
+
+# --- MÓDULO DE BACKENDS DE IMPRESSÃO ---
+# Cada backend sabe enviar documentos a um spooler, consultar e cancelar o
+# trabalho criado. O padrão é o `lp`; PRINTBOX_PRINT_BACKEND escolhe outro.
+
+# Estado de um trabalho no spooler (coluna print_jobs.spool_status)
+SPOOL_PENDENTE = "pendente"
+SPOOL_IMPRIMINDO = "imprimindo"
+SPOOL_CONCLUIDO = "concluído"
+SPOOL_CANCELADO = "cancelado"
+SPOOL_FALHA = "falha"
+SPOOL_DESCONHECIDO = "desconhecido"
+SPOOL_EM_ANDAMENTO = (SPOOL_PENDENTE, SPOOL_IMPRIMINDO)
+DRY_RUN_PREFIX = "dry-run-"  # Ids do DryRunBackend, que nunca passam por um spooler
+
+
+class PrintBackend:
+    """
+    Interface dos backends de impressão.
+
+    `submit` envia um ou mais PDFs como um único trabalho (com `copies` cópias
+    agrupadas) e retorna o id do trabalho no spooler, ou "" se o spooler não
+    informa um. Backends com `multi_document` aceitam vários arquivos num
+    trabalho; os demais recebem sempre um arquivo por chamada. `formats` diz
+    que versões do cache de renderização o backend sabe enviar.
+    """
+    name = ""
+    multi_document = False
+    formats = ("pdf", "postscript")
+
+    def submit(self, file_paths: List[str], copies: int = 1, printer: str = "", title: str = "") -> str:
+        raise NotImplementedError
+
+    def status(self, job_id: str) -> str:
+        return SPOOL_DESCONHECIDO
+
+    def statuses(self, job_ids: List[str]) -> dict:
+        """Estado de vários trabalhos de uma vez (os backends podem otimizar)."""
+        return {job_id: self.status(job_id) for job_id in job_ids}
+
+    def cancel(self, job_id: str) -> bool:
+        return False
+
+    @staticmethod
+    def _check_files(file_paths: List[str]):
+        for file_path in file_paths:
+            if not os.path.exists(file_path):
+                raise FileNotFoundError(f"O arquivo {file_path} não foi encontrado.")
+
+
+class LpBackend(PrintBackend):
+    """`lp` do CUPS (ou `lpr` no macOS): um processo por trabalho, vários arquivos por trabalho."""
+    name = "lp"
+    multi_document = True
+
+    def __init__(self, command: str = PRINT_COMMAND):
+        self.command = command
+
+    def submit(self, file_paths: List[str], copies: int = 1, printer: str = "", title: str = "") -> str:
+        self._check_files(file_paths)
+        if sys.platform == "darwin" and not self.command:
+            destino = ["-P", printer] if printer else []
+            comando = ["lpr", *destino, "-#", str(copies), "-o", "collate=true", *file_paths]
+        else:
+            destino = ["-d", printer] if printer else []
+            titulo = ["-t", title] if title else []
+            comando = [self.command or "lp", *destino, *titulo, "-n", str(copies), "-o", "collate=true", *file_paths]
+        try:
+            saida = subprocess.run(comando, check=True, capture_output=True, text=True).stdout
+        except subprocess.CalledProcessError as e:
+            raise OSError(f"Comando de impressão falhou: {(e.stderr or '').strip() or e}")
+        except OSError as e:
+            raise OSError(f"Comando de impressão falhou: {e}")
+        # "request id is HP-42 (2 file(s))"
+        partes = saida.split("request id is ", 1)
+        return partes[1].split()[0] if len(partes) > 1 and partes[1].split() else ""
+
+    def status(self, job_id: str) -> str:
+        return self.statuses([job_id])[job_id]
+
+    def statuses(self, job_ids: List[str]) -> dict:
+        # O lpstat não distingue "na fila" de "imprimindo" nem "concluído" de
+        # "cancelado"; para estados exatos use o backend "ipp".
+        resultado = dict.fromkeys(job_ids, SPOOL_DESCONHECIDO)
+        for quais, estado in (("not-completed", SPOOL_PENDENTE), ("completed", SPOOL_CONCLUIDO)):
+            try:
+                saida = subprocess.run(["lpstat", "-W", quais, "-o"], capture_output=True, text=True, timeout=10).stdout
+            except (OSError, subprocess.SubprocessError):
+                return resultado
+            listados = {linha.split()[0] for linha in saida.splitlines() if linha.strip()}
+            for job_id in job_ids:
+                if job_id in listados and resultado[job_id] == SPOOL_DESCONHECIDO:
+                    resultado[job_id] = estado
+        return resultado
+
+    def cancel(self, job_id: str) -> bool:
+        try:
+            return subprocess.run(["cancel", job_id], capture_output=True, timeout=10).returncode == 0
+        except (OSError, subprocess.SubprocessError):
+            return False
+
+
+class WindowsBackend(PrintBackend):
+    """Verbo "print" do shell do Windows; não informa id nem aceita número de cópias."""
+    name = "windows"
+    formats = ("pdf",)  # O leitor de PDF associado não abre PostScript
+
+    def submit(self, file_paths: List[str], copies: int = 1, printer: str = "", title: str = "") -> str:
+        self._check_files(file_paths)
+        try:
+            # O verbo 'print' não aceita número de cópias, então repete o envio
+            for file_path in file_paths:
+                for _ in range(copies):
+                    os.startfile(file_path, "print")
+        except OSError as e:
+            raise OSError(f"Comando de impressão falhou: {e}")
+        return ""
+
+
+class DryRunBackend(PrintBackend):
+    """
+    Não imprime nada: confere os arquivos e devolve ids fictícios (para testes
+    e medições). Os ids levam um prefixo aleatório por instância, para não
+    repetir os de outro processo (ou de outra execução) no mesmo print_log.db.
+    """
+    name = "dry-run"
+    multi_document = True
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self._prefixo = f"{DRY_RUN_PREFIX}{uuid.uuid4().hex[:8]}-"
+        self._ids = iter(range(1, sys.maxsize))
+        self._lock = threading.Lock()
+
+    def submit(self, file_paths: List[str], copies: int = 1, printer: str = "", title: str = "") -> str:
+        self._check_files(file_paths)
+        if self.delay:
+            time.sleep(self.delay)
+        with self._lock:
+            return f"{self._prefixo}{next(self._ids)}"
+
+    def status(self, job_id: str) -> str:
+        return SPOOL_CONCLUIDO
+
+    def cancel(self, job_id: str) -> bool:
+        return True
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """Conexão HTTP por socket Unix (CUPS em /run/cups/cups.sock, servidor do PrintBox)."""
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+# Códigos do protocolo IPP (RFC 8011) usados pelo IppBackend
+_IPP_CREATE_JOB, _IPP_SEND_DOCUMENT, _IPP_CANCEL_JOB, _IPP_GET_JOB_ATTRIBUTES = 0x0005, 0x0006, 0x0008, 0x0009
+_IPP_CUPS_GET_DEFAULT = 0x4001
+_IPP_TAG_OPERATION, _IPP_TAG_JOB, _IPP_TAG_END = 0x01, 0x02, 0x03
+_IPP_INTEGER, _IPP_BOOLEAN, _IPP_ENUM = 0x21, 0x22, 0x23
+_IPP_NAME, _IPP_KEYWORD, _IPP_URI, _IPP_CHARSET, _IPP_LANGUAGE, _IPP_MIME = 0x42, 0x44, 0x45, 0x47, 0x48, 0x49
+# job-state -> estado no spooler
+_IPP_JOB_STATES = {3: SPOOL_PENDENTE, 4: SPOOL_PENDENTE, 5: SPOOL_IMPRIMINDO, 6: SPOOL_IMPRIMINDO,
+                   7: SPOOL_CANCELADO, 8: SPOOL_FALHA, 9: SPOOL_CONCLUIDO}
+
+
+def _ipp_attribute(tag: int, name: str, value) -> bytes:
+    if tag in (_IPP_INTEGER, _IPP_ENUM):
+        dados = struct.pack(">i", value)
+    elif tag == _IPP_BOOLEAN:
+        dados = b"\x01" if value else b"\x00"
+    else:
+        dados = str(value).encode("utf-8")
+    nome = name.encode("utf-8")
+    return struct.pack(">BH", tag, len(nome)) + nome + struct.pack(">H", len(dados)) + dados
+
+
+def _ipp_request(operation: int, request_id: int, attributes: List[tuple], job_attributes: List[tuple] = ()) -> bytes:
+    """Monta o cabeçalho de um pedido IPP 2.0 (o documento, se houver, vem logo depois)."""
+    partes = [struct.pack(">BBHI", 2, 0, operation, request_id), bytes([_IPP_TAG_OPERATION]),
+              _ipp_attribute(_IPP_CHARSET, "attributes-charset", "utf-8"),
+              _ipp_attribute(_IPP_LANGUAGE, "attributes-natural-language", "en")]
+    partes += [_ipp_attribute(*atributo) for atributo in attributes]
+    if job_attributes:
+        partes.append(bytes([_IPP_TAG_JOB]))
+        partes += [_ipp_attribute(*atributo) for atributo in job_attributes]
+    partes.append(bytes([_IPP_TAG_END]))
+    return b"".join(partes)
+
+
+def _ipp_parse(dados: bytes) -> tuple:
+    """Lê uma resposta IPP; retorna (status-code, {nome do atributo: [valores]})."""
+    if len(dados) < 8:
+        raise OSError("resposta IPP incompleta")
+    status = struct.unpack(">H", dados[2:4])[0]
+    atributos, nome, pos = {}, None, 8
+    while pos < len(dados):
+        tag = dados[pos]
+        pos += 1
+        if tag == _IPP_TAG_END:
+            break
+        if tag < 0x10:
+            continue  # Início de outro grupo de atributos
+        tamanho_nome = struct.unpack(">H", dados[pos:pos + 2])[0]
+        pos += 2
+        if tamanho_nome:
+            nome = dados[pos:pos + tamanho_nome].decode("utf-8", "replace")
+            pos += tamanho_nome
+        tamanho_valor = struct.unpack(">H", dados[pos:pos + 2])[0]
+        pos += 2
+        valor = dados[pos:pos + tamanho_valor]
+        pos += tamanho_valor
+        if tag in (_IPP_INTEGER, _IPP_ENUM) and tamanho_valor == 4:
+            valor = struct.unpack(">i", valor)[0]
+        elif tag == _IPP_BOOLEAN:
+            valor = valor != b"\x00"
+        elif 0x40 <= tag <= 0x4F:
+            valor = valor.decode("utf-8", "replace")
+        atributos.setdefault(nome, []).append(valor)  # Sem nome = mais um valor do atributo anterior
+    return status, atributos
+
+
+def _document_format(file_path: str) -> str:
+    """Tipo MIME do documento; no resto, o CUPS detecta o formato sozinho."""
+    extensao = os.path.splitext(file_path)[1].lower()
+    return {".pdf": "application/pdf", ".ps": "application/postscript"}.get(extensao, "application/octet-stream")
+
+
+class IppBackend(PrintBackend):
+    """
+    Fala IPP direto com o CUPS, sem abrir um processo por envio: um pedido
+    Create-Job e um Send-Document por arquivo, todos na mesma conexão HTTP,
+    que fica aberta para os próximos trabalhos (uma por thread).
+    O servidor vem de CUPS_SERVER (host[:porta] ou caminho de socket Unix).
+    """
+    name = "ipp"
+    multi_document = True
+
+    def __init__(self, server: str = IPP_SERVER, user: str = "", timeout: float = 60.0):
+        self.server = server
+        self.user = user or getpass.getuser()
+        self.timeout = timeout
+        self._local = threading.local()
+        self._request_ids = iter(range(1, sys.maxsize))
+        self._lock = threading.Lock()
+        self._default_printer = None
+
+    def submit(self, file_paths: List[str], copies: int = 1, printer: str = "", title: str = "") -> str:
+        self._check_files(file_paths)
+        nome = printer or self._get_default_printer()
+        path, uri = self._printer_uri(nome)
+        atributos = self._post(path, _ipp_request(_IPP_CREATE_JOB, self._next_id(), [
+            (_IPP_URI, "printer-uri", uri),
+            (_IPP_NAME, "requesting-user-name", self.user),
+            (_IPP_NAME, "job-name", title or os.path.basename(file_paths[0])),
+        ], [
+            (_IPP_INTEGER, "copies", copies),
+            (_IPP_KEYWORD, "multiple-document-handling", "separate-documents-collated-copies"),
+        ]))
+        numero = atributos["job-id"][0]
+        job_id = f"{nome}-{numero}"  # Mesmo formato do id informado pelo lp
+        try:
+            for idx, file_path in enumerate(file_paths):
+                cabecalho = _ipp_request(_IPP_SEND_DOCUMENT, self._next_id(), [
+                    (_IPP_URI, "printer-uri", uri),
+                    (_IPP_INTEGER, "job-id", numero),
+                    (_IPP_NAME, "requesting-user-name", self.user),
+                    (_IPP_NAME, "document-name", os.path.basename(file_path)),
+                    (_IPP_MIME, "document-format", _document_format(file_path)),
+                    (_IPP_BOOLEAN, "last-document", idx == len(file_paths) - 1),
+                ])
+                self._post(path, cabecalho, file_path)
+        except OSError:
+            self.cancel(job_id)  # Não deixa um trabalho incompleto parado no spooler
+            raise
+        return job_id
+
+    def status(self, job_id: str) -> str:
+        nome, _, numero = job_id.rpartition("-")
+        if not numero.isdigit():
+            return SPOOL_DESCONHECIDO
+        path, uri = self._printer_uri(nome)
+        try:
+            atributos = self._post(path, _ipp_request(_IPP_GET_JOB_ATTRIBUTES, self._next_id(), [
+                (_IPP_URI, "printer-uri", uri),
+                (_IPP_INTEGER, "job-id", int(numero)),
+                (_IPP_NAME, "requesting-user-name", self.user),
+                (_IPP_KEYWORD, "requested-attributes", "job-state"),
+            ]))
+        except OSError:
+            return SPOOL_DESCONHECIDO
+        return _IPP_JOB_STATES.get(atributos.get("job-state", [0])[0], SPOOL_DESCONHECIDO)
+
+    def cancel(self, job_id: str) -> bool:
+        nome, _, numero = job_id.rpartition("-")
+        if not numero.isdigit():
+            return False
+        path, uri = self._printer_uri(nome)
+        try:
+            self._post(path, _ipp_request(_IPP_CANCEL_JOB, self._next_id(), [
+                (_IPP_URI, "printer-uri", uri),
+                (_IPP_INTEGER, "job-id", int(numero)),
+                (_IPP_NAME, "requesting-user-name", self.user),
+            ]))
+        except OSError:
+            return False
+        return True
+
+    # --- Auxiliares ---
+
+    def _get_default_printer(self) -> str:
+        if self._default_printer is None:
+            atributos = self._post("/", _ipp_request(_IPP_CUPS_GET_DEFAULT, self._next_id(), [
+                (_IPP_KEYWORD, "requested-attributes", "printer-name"),
+            ]))
+            self._default_printer = atributos["printer-name"][0]
+        return self._default_printer
+
+    @staticmethod
+    def _printer_uri(nome: str) -> tuple:
+        path = "/printers/" + urllib.parse.quote(nome, safe="")
+        return path, "ipp://localhost" + path
+
+    def _next_id(self) -> int:
+        with self._lock:
+            return next(self._request_ids)
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.server.startswith("/"):
+            return UnixHTTPConnection(self.server, timeout=self.timeout)
+        host, _, porta = self.server.partition(":")
+        return http.client.HTTPConnection(host or "localhost", int(porta or 631), timeout=self.timeout)
+
+    def _post(self, path: str, cabecalho: bytes, documento: Optional[str] = None) -> dict:
+        """Envia um pedido IPP (com o documento em streaming, se houver) e retorna os atributos da resposta."""
+        tamanho = len(cabecalho) + (os.path.getsize(documento) if documento else 0)
+        for tentativa in range(2):
+            conn = getattr(self._local, "conn", None)
+            if conn is None:
+                conn = self._local.conn = self._connect()
+            try:
+                conn.request("POST", path, body=self._body(cabecalho, documento),
+                             headers={"Content-Type": "application/ipp", "Content-Length": str(tamanho)})
+                resposta = conn.getresponse()
+                dados = resposta.read()
+                break
+            except (http.client.HTTPException, OSError) as e:
+                # Conexão reaproveitada pode ter sido fechada pelo CUPS: tenta uma nova
+                conn.close()
+                self._local.conn = None
+                if tentativa:
+                    raise OSError(f"Servidor de impressão indisponível ({self.server}): {e}")
+        if resposta.status != 200:
+            raise OSError(f"Servidor de impressão respondeu HTTP {resposta.status}")
+        status, atributos = _ipp_parse(dados)
+        if status >= 0x0100:
+            mensagem = atributos.get("status-message", [f"0x{status:04x}"])[0]
+            raise OSError(f"Servidor de impressão recusou o pedido: {mensagem}")
+        return atributos
+
+    @staticmethod
+    def _body(cabecalho: bytes, documento: Optional[str]):
+        yield cabecalho
+        if documento:
+            with open(documento, "rb") as f:
+                while True:
+                    bloco = f.read(256 * 1024)
+                    if not bloco:
+                        break
+                    yield bloco
+
+
+PRINT_BACKENDS = {backend.name: backend for backend in (LpBackend, IppBackend, WindowsBackend, DryRunBackend)}
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name: str = "") -> PrintBackend:
+    """
+    Backend de impressão compartilhado pelo processo. Sem nome, usa
+    PRINTBOX_PRINT_BACKEND ou o padrão do sistema ("windows" ou "lp").
+    """
+    name = name or PRINT_BACKEND or ("windows" if sys.platform == "win32" and not PRINT_COMMAND else "lp")
+    with _backends_lock:
+        if name not in _backends:
+            if name not in PRINT_BACKENDS:
+                raise ValueError(f"Backend de impressão desconhecido: {name} (opções: {', '.join(PRINT_BACKENDS)})")
+            _backends[name] = PRINT_BACKENDS[name]()
+        return _backends[name]
+
+
+class SpoolTracker:
+    """
+    Acompanha no spooler os trabalhos enviados com id e grava o estado final
+    em `print_jobs.spool_status`, para o histórico mostrar o que de fato foi
+    impresso, e não só o que foi entregue ao spooler.
+    """
+    def __init__(self, backend: Optional[PrintBackend] = None, db_file: str = DB_FILE,
+                 interval: float = SPOOL_POLL_INTERVAL):
+        self.backend = backend or get_backend()
+        self.db = get_database(db_file)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="printbox-spool-tracker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def poll_once(self) -> int:
+        """Atualiza os trabalhos ainda em andamento; retorna quantas linhas mudaram."""
+        em_andamento = ", ".join(f"'{estado}'" for estado in SPOOL_EM_ANDAMENTO)  # Literal: usa o índice parcial
+        rows = self.db.query(f'''
+            SELECT id, timestamp, spool_job_id, spool_status FROM print_jobs
+            WHERE spool_status IN ({em_andamento}) ORDER BY id LIMIT 500
+        ''')
+        if not rows:
+            return 0
+        # Linhas antigas do dry-run (gravadas como pendentes) são encerradas sem consultar o spooler
+        consultar = sorted({row[2] for row in rows if not row[2].startswith(DRY_RUN_PREFIX)})
+        estados = self.backend.statuses(consultar) if consultar else {}
+        limite = (datetime.datetime.now() - datetime.timedelta(seconds=SPOOL_TRACK_MAX_AGE)).isoformat()
+        mudancas = []
+        for job_id, timestamp, spool_job_id, atual in rows:
+            if spool_job_id.startswith(DRY_RUN_PREFIX):
+                estado = SPOOL_CONCLUIDO
+            else:
+                estado = estados.get(spool_job_id, SPOOL_DESCONHECIDO)
+            if estado in SPOOL_EM_ANDAMENTO or estado == SPOOL_DESCONHECIDO:
+                if timestamp < limite:
+                    estado = SPOOL_DESCONHECIDO  # Desiste de acompanhar
+                elif estado == SPOOL_DESCONHECIDO:
+                    continue  # Pode ainda aparecer (spooler reiniciando, lpstat lento)
+            if estado != atual:
+                mudancas.append((estado, job_id))
+        if mudancas:
+            with self.db.transaction() as conn:
+                conn.executemany("UPDATE print_jobs SET spool_status = ? WHERE id = ?", mudancas)
+        return len(mudancas)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll_once()
+            except (sqlite3.Error, OSError):
+                continue  # Banco ocupado ou spooler fora do ar: tenta no próximo ciclo
+
+
+# --- MÓDULO DE IMPRESSÃO ---
+# Usado tanto pelo worker da fila da interface quanto pela linha de comando.
+
+RESULTADO_SUCESSO = "Sucesso"
+RESULTADO_FALHA = "Falha"
+
+
+class FileResult(NamedTuple):
+    """Resultado do envio de um arquivo, como gravado no histórico."""
+    filename: str
+    status: str
+    pages: Optional[int]
+    error: str = ""
+    job_id: str = ""  # id do trabalho no spooler, quando o backend informa
+
+
+def print_pdf(file_path: str, copies: int = 1, printer: str = "") -> str:
+    """Envia um PDF pelo backend padrão, com as cópias feitas pelo spooler; retorna o id do trabalho."""
+    return get_backend().submit([file_path], copies, printer)
+
+
+def run_print_job(group: str, files: List[str], copies: int, merge: bool = False, printer: str = "",
+                  on_progress: Optional[Callable[[float, str], None]] = None,
+                  is_cancelled: Optional[Callable[[], bool]] = None,
+                  backend: Optional[PrintBackend] = None,
+                  on_result: Optional[Callable[[FileResult], None]] = None) -> List[FileResult]:
+    """
+    Imprime `files` do grupo `group` e grava cada arquivo no histórico.
+    Com `merge`, os arquivos vão num único trabalho (cópias e collate por conta
+    da impressora): como vários documentos de um trabalho, se o backend
+    aceitar, ou como um PDF único montado aqui. Se nada disso for possível,
+    imprime arquivo por arquivo.
+    `on_progress(percentual, mensagem)` é chamado a cada etapa; `is_cancelled()`
+    é consultado antes de cada arquivo (ou do envio do trabalho único). `on_result(resultado)` é chamado assim
+    que cada arquivo é enviado (ou falha). Arquivos não enviados por
+    cancelamento ficam fora da lista retornada.
+
+    O tempo de cada etapa vai para `metrics` e para a tabela `print_job_timings`.
+    """
+    tempos = {}
+
+    def progresso(valor: float, mensagem: str):
+        if on_progress is not None:
+            with metrics.timer(ETAPA_CALLBACK, tempos):
+                on_progress(valor, mensagem)
+
+    inicio = time.perf_counter()
+    backend = backend or get_backend()
+    total_files = len(files)
+    full_paths = [os.path.join(GRUPOS_DIR, group, f) for f in files]
+    resultados = None
+    if merge and total_files > 1:
+        resultados = _print_merged(group, files, full_paths, copies, printer, progresso, backend, tempos,
+                                   is_cancelled)
+        if resultados is not None and on_result is not None:
+            for r in resultados:
+                on_result(r)
+
+    if resultados is None:
+        resultados = []
+        for idx, (filename, full_path) in enumerate(zip(files, full_paths)):
+            if is_cancelled is not None and is_cancelled():
+                break
+            progresso((idx + 1) / total_files * 100, f"Imprimindo {idx+1}/{total_files}: {filename}")
+            with metrics.timer(ETAPA_CONTAGEM_PAGINAS, tempos):
+                pages = metadata_cache.get_page_count(full_path)
+            # Versão pronta para a impressora, se houver (senão, o PDF original)
+            documento = render_cache.lookup(full_path, printer, backend.formats) or full_path
+            try:
+                with metrics.timer(ETAPA_ENVIO, tempos):
+                    job_id = backend.submit([documento], copies, printer, title=f"{group} - {filename}")
+                resultados.append(FileResult(filename, RESULTADO_SUCESSO, pages, job_id=job_id))
+            except Exception as e:
+                resultados.append(FileResult(filename, RESULTADO_FALHA, pages, str(e)))
+            r = resultados[-1]
+            log_print_job(filename, group, copies, r.status, pages, r.job_id)
+            if on_result is not None:
+                on_result(r)
+
+    # Garante que o histórico esteja gravado antes de o chamador consultá-lo
+    inicio_banco = time.perf_counter()
+    flush_print_log()
+    tempos[ETAPA_BANCO] = (time.perf_counter() - inicio_banco) * 1000
+    _record_job_timing(group, files, copies, merge, backend, resultados, inicio, tempos)
+    return resultados
+
+
+def _record_job_timing(group: str, files: List[str], copies: int, merge: bool, backend: PrintBackend,
+                       resultados: List[FileResult], inicio: float, tempos: dict):
+    """Grava a linha de `print_job_timings` do trabalho e atualiza o arquivo de métricas."""
+    total = time.perf_counter() - inicio
+    metrics.observe(ETAPA_TRABALHO, total)
+    if len(resultados) < len(files):
+        status = FILA_CANCELADO
+    elif any(r.status != RESULTADO_SUCESSO for r in resultados):
+        status = RESULTADO_FALHA
+    else:
+        status = RESULTADO_SUCESSO
+    get_database().writer.submit(_INSERT_JOB_TIMING, (
+        datetime.datetime.now().isoformat(), group, len(files), copies, int(merge), backend.name, status,
+        round(total * 1000, 3),
+        *(round(tempos.get(etapa, 0.0), 3) for etapa in (ETAPA_CONTAGEM_PAGINAS, ETAPA_MESCLAGEM, ETAPA_ENVIO,
+                                                          ETAPA_BANCO, ETAPA_CALLBACK)),
+    ))
+    metrics.write_file_throttled()
+
+
+def _print_merged(group: str, files: List[str], full_paths: List[str], copies: int, printer: str,
+                  progresso: Callable[[float, str], None], backend: PrintBackend,
+                  tempos: dict, is_cancelled: Optional[Callable[[], bool]] = None) -> Optional[List[FileResult]]:
+    """
+    Envia os arquivos como um só trabalho; retorna None se isso não for
+    possível, e uma lista vazia se o trabalho for cancelado antes do envio.
+    """
+    if backend.multi_document:
+        documentos = full_paths
+    else:
+        progresso(0, f"Preparando documento único com {len(files)} arquivo(s)...")
+        try:
+            with metrics.timer(ETAPA_MESCLAGEM, tempos):
+                documentos = [merged_pdf_for(full_paths)]
+        except Exception:
+            return None
+    documentos = [render_cache.lookup(d, printer, backend.formats) or d for d in documentos]
+    with metrics.timer(ETAPA_CONTAGEM_PAGINAS, tempos):
+        pages = [metadata_cache.get_page_count(p) for p in full_paths]
+    if is_cancelled is not None and is_cancelled():
+        return []  # Cancelado durante a preparação: nada chegou ao spooler
+
+    progresso(50, f"Enviando {len(files)} arquivo(s) em um único trabalho...")
+    status, erro, job_id = RESULTADO_SUCESSO, "", ""
+    try:
+        with metrics.timer(ETAPA_ENVIO, tempos):
+            job_id = backend.submit(documentos, copies, printer, title=group)
+    except Exception as e:
+        status, erro = RESULTADO_FALHA, str(e)
+
+    progresso(100, "Trabalho único enviado.")
+    resultados = [FileResult(filename, status, file_pages, erro, job_id) for filename, file_pages in zip(files, pages)]
+    log_print_jobs([(r.filename, group, copies, r.status, r.pages, r.job_id) for r in resultados])
+    return resultados
+
+
+def listar_impressoras() -> List[str]:
+    """Lista as impressoras configuradas no CUPS (vazio no Windows ou sem `lpstat`)."""
+    if sys.platform == "win32":
+        return []
+    try:
+        saida = subprocess.run(["lpstat", "-e"], capture_output=True, text=True, timeout=5).stdout
+    except (OSError, subprocess.SubprocessError):
+        return []
+    return [linha.strip() for linha in saida.splitlines() if linha.strip()]
@@ -0,0 +1,794 @@
+# --------------------------------------------------------------------------------
+# PrintBox - Servidor de impressão local
+#
+# DESCRIÇÃO:
+# Um processo de longa duração por local que concentra o índice de grupos, o
+# cache de metadados, a fila de impressão e o histórico (print_log.db). As
+# estações (interface gráfica) passam a ser clientes dele, em vez de cada uma
+# abrir o banco e chamar o `lp` por conta própria.
+#
+# A API é HTTP/JSON, numa porta local ou num socket Unix:
+#   GET  /status                      estado do servidor e da fila
+#   GET  /groups                      lista de grupos
+#   GET  /groups/<grupo>/files        PDFs de um grupo
+#   POST /groups/<grupo>/refresh      relê um grupo após um upload
+#   GET  /jobs?limit=N                trabalhos da fila
+#   POST /jobs                        {"group", "files", "copies", "merge", "printer", "priority"}
+#   GET  /jobs/<id>                   um trabalho da fila
+#   POST /jobs/<id>/cancel | retry
+#   POST /queue/pause | resume
+#   GET  /history, /history/since, /history/max_id, /stats/daily, /stats/groups, /stats/slowest
+#   GET  /metrics                     tempo por etapa da impressão (texto do Prometheus; ?format=json)
+#   GET  /printers
+#   GET  /events                      fluxo (Server-Sent Events) de mudanças na fila,
+#                                     progresso dos trabalhos, grupos e histórico
+#
+# EXEMPLOS:
+# python printbox_server.py                                # http://127.0.0.1:8631
+# python printbox_server.py --socket /tmp/printbox.sock
+# PRINTBOX_PRINT_COMMAND=/bin/true python printbox_server.py   # "lp" falso para testes
+# python printbox_server.py --backend ipp                  # envia direto ao CUPS, sem processos
+# python printbox_server.py --backend dry-run              # não imprime (medições)
+# PRINTBOX_SYNC_DIR=/mnt/matriz/printbox python printbox_server.py   # envia o histórico à matriz
+#
+# Para a interface usar o servidor: PRINTBOX_SERVER=http://127.0.0.1:8631 python printbox.py
+# (ou PRINTBOX_SERVER=unix:/tmp/printbox.sock).
+# --------------------------------------------------------------------------------
+import argparse
+import http.client
+import json
+import logging
+import os
+import queue
+import re
+import signal
+import socket
+import socketserver
+import sqlite3
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional
+from urllib.parse import parse_qs, quote, unquote, urlencode, urlsplit
+
+from printbox_core import (
+    RETENTION_DAYS, RETENTION_INTERVAL, SYNC_DIR, apply_retention,
+    FileResult, GroupIndex, UnixHTTPConnection, JobFilter, PrintBackend, PrintScheduler, SpoolTracker, QueuedJob, RESULTADO_SUCESSO, JOBS_PAGE_SIZE, SERVER_ENV,
+    close_databases, get_backend, logger, render_cache, get_daily_stats, get_group_stats, get_max_job_id, get_slowest_jobs, metrics,
+    PRINT_BACKENDS, listar_impressoras, query_jobs, query_jobs_since, run_print_job, setup_database,
+)
+from printbox_sync import SyncWorker
+
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8631
+SERVER_TIMEOUT = 10.0           # segundos esperando uma resposta do servidor
+EVENTS_KEEPALIVE = 15.0         # segundos entre comentários que mantêm o fluxo de eventos vivo
+EVENTS_MAX_PENDING = 1000       # eventos guardados para um cliente lento antes de desconectá-lo
+
+
+class PrintBoxServerError(OSError):
+    """O servidor não respondeu ou recusou o pedido."""
+
+
+def _job_to_dict(job: QueuedJob) -> dict:
+    return job._asdict()
+
+
+# --- MÓDULO DO SERVIDOR ---
+
+class EventHub:
+    """Distribui eventos para os clientes conectados em /events (uma fila por cliente)."""
+    def __init__(self, max_pending: int = EVENTS_MAX_PENDING):
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self) -> queue.Queue:
+        fila = queue.Queue(maxsize=self.max_pending)
+        with self._lock:
+            self._subscribers.add(fila)
+        return fila
+
+    def unsubscribe(self, fila: queue.Queue):
+        with self._lock:
+            self._subscribers.discard(fila)
+
+    def publish(self, tipo: str, **dados):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for fila in subscribers:
+            try:
+                fila.put_nowait((tipo, dados))
+            except queue.Full:
+                # Cliente parado: desconecta; ao reconectar ele relê o estado inteiro
+                self.unsubscribe(fila)
+                with fila.mutex:
+                    fila.queue.clear()
+                fila.put_nowait((None, None))
+
+
+class PrintBoxService:
+    """Estado "quente" do servidor: índice de grupos, fila de impressão e histórico."""
+    def __init__(self, backend: Optional[PrintBackend] = None):
+        self.backend = backend or get_backend()
+        self.spool_tracker = SpoolTracker(self.backend)
+        self.events = EventHub()
+        self.group_index = GroupIndex()
+        self.group_index.load_snapshot()
+        self.group_index.subscribe(self._on_grupos_alterados)
+        self.scheduler = PrintScheduler(self._worker, on_change=self._on_fila_alterada)
+        self._parar = threading.Event()
+        self.sync_worker = SyncWorker(SYNC_DIR) if SYNC_DIR else None
+
+    def start(self):
+        self.scheduler.start()
+        self.group_index.start()
+        self.spool_tracker.start()
+        # Versões prontas para as impressoras com perfil (printer_profiles.json)
+        render_cache.watch(self.group_index)
+        if RETENTION_DAYS > 0:
+            threading.Thread(target=self._retencao_loop, name="printbox-retention", daemon=True).start()
+        if self.sync_worker is not None:
+            self.sync_worker.start()
+
+    def stop(self):
+        self.scheduler.stop(wait=False)
+        self.group_index.stop()
+        self.spool_tracker.stop()
+        render_cache.stop()
+        if self.sync_worker is not None:
+            self.sync_worker.stop()
+        self._parar.set()
+
+    def status(self) -> dict:
+        return {"paused": self.scheduler.paused, "owner": self.scheduler.owner, "backend": self.backend.name,
+                "groups": len(self.group_index.groups())}
+
+    def enqueue(self, pedido: dict) -> int:
+        """Valida um pedido vindo da API e o coloca na fila."""
+        grupo = pedido.get("group")
+        if grupo not in self.group_index.groups():
+            raise ValueError(f"grupo não encontrado: {grupo}")
+        disponiveis = self.group_index.files(grupo)
+        # Os arquivos escolhidos saem na ordem pedida; sem `files`, na ordem do índice
+        arquivos = list(pedido.get("files") or disponiveis)
+        faltando = [f for f in arquivos if f not in disponiveis]
+        if faltando:
+            raise ValueError(f"arquivo(s) não encontrado(s) no grupo {grupo}: {', '.join(faltando)}")
+        if not arquivos:
+            raise ValueError(f"nenhum PDF no grupo {grupo}")
+        copias = int(pedido.get("copies", 1))
+        if copias < 1:
+            raise ValueError("o número de cópias deve ser pelo menos 1")
+        return self.scheduler.enqueue(grupo, arquivos, copias, merge=bool(pedido.get("merge")),
+                                      printer=pedido.get("printer") or "", priority=int(pedido.get("priority", 0)))
+
+    def jobs(self, limit: int = 100) -> dict:
+        return {"jobs": [_job_to_dict(job) for job in self.scheduler.list_jobs(limit)], "paused": self.scheduler.paused}
+
+    def _worker(self, job: QueuedJob) -> bool:
+        def progresso(valor: float, mensagem: str):
+            self.events.publish("progress", job=job.id, value=valor, message=mensagem)
+
+        resultados = run_print_job(job.group_name, job.files, job.copies, merge=job.merge, printer=job.printer,
+                                   on_progress=progresso, is_cancelled=lambda: self.scheduler.is_cancelled(job.id),
+                                   backend=self.backend)
+        falhas = [r._asdict() for r in resultados if r.status != RESULTADO_SUCESSO]
+        self.events.publish("history", job=job.id, group=job.group_name, files=len(job.files), failures=falhas)
+        return not falhas and len(resultados) == len(job.files)
+
+    def _retencao_loop(self):
+        """Arquiva o histórico antigo (PRINTBOX_RETENTION_DAYS) uma vez por dia."""
+        while not self._parar.is_set():
+            try:
+                resultado = apply_retention()
+                if resultado.archived:
+                    logger.info("%d linha(s) do histórico arquivada(s)", resultado.archived)
+            except (sqlite3.Error, OSError) as e:
+                logger.error("Falha ao arquivar o histórico: %s", e)
+            self._parar.wait(RETENTION_INTERVAL)
+
+    def _on_fila_alterada(self):
+        self.events.publish("jobs", **self.jobs())
+
+    def _on_grupos_alterados(self, alterados: set, lista_mudou: bool):
+        self.events.publish("groups", changed=sorted(alterados), list_changed=lista_mudou)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Mantém a conexão aberta entre pedidos do mesmo cliente
+    server_version = "PrintBox"
+
+    # (método, padrão do caminho, nome do método do handler)
+    ROTAS = [
+        ("GET", r"/status", "_get_status"),
+        ("GET", r"/groups", "_get_groups"),
+        ("GET", r"/groups/(?P<group>[^/]+)/files", "_get_files"),
+        ("POST", r"/groups/(?P<group>[^/]+)/refresh", "_post_refresh"),
+        ("GET", r"/jobs", "_get_jobs"),
+        ("POST", r"/jobs", "_post_job"),
+        ("GET", r"/jobs/(?P<job_id>\d+)", "_get_job"),
+        ("POST", r"/jobs/(?P<job_id>\d+)/(?P<acao>cancel|retry)", "_post_job_action"),
+        ("POST", r"/queue/(?P<acao>pause|resume)", "_post_queue_action"),
+        ("GET", r"/history", "_get_history"),
+        ("GET", r"/history/since", "_get_history_since"),
+        ("GET", r"/history/max_id", "_get_max_id"),
+        ("GET", r"/stats/daily", "_get_stats_daily"),
+        ("GET", r"/stats/groups", "_get_stats_groups"),
+        ("GET", r"/stats/slowest", "_get_stats_slowest"),
+        ("GET", r"/metrics", "_get_metrics"),
+        ("GET", r"/printers", "_get_printers"),
+        ("GET", r"/events", "_get_events"),
+    ]
+
+    @property
+    def service(self) -> PrintBoxService:
+        return self.server.service
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def setup(self):
+        # Respostas curtas em sequência: sem o algoritmo de Nagle cada pedido leva
+        # ~40 ms a mais no TCP (não se aplica a socket Unix)
+        self.disable_nagle_algorithm = isinstance(self.client_address, tuple)
+        super().setup()
+
+    def address_string(self) -> str:
+        # Em socket Unix o endereço do cliente é uma string vazia
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def _dispatch(self, metodo: str):
+        url = urlsplit(self.path)
+        self.params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        for metodo_rota, padrao, nome in self.ROTAS:
+            match = re.fullmatch(padrao, url.path)
+            if match and metodo_rota == metodo:
+                argumentos = {k: unquote(v) for k, v in match.groupdict().items()}
+                try:
+                    resposta = getattr(self, nome)(**argumentos)
+                except (ValueError, KeyError, TypeError) as e:
+                    self._send_json({"error": str(e)}, 400)
+                except sqlite3.Error as e:
+                    self._send_json({"error": f"erro de banco de dados: {e}"}, 500)
+                except ConnectionError:
+                    raise  # O cliente desconectou: não há para quem responder
+                except OSError as e:
+                    # Pasta de grupo que sumiu, sem permissão, disco cheio, ...
+                    self._send_json({"error": f"erro de arquivo: {e}"}, 500)
+                else:
+                    if resposta is not None:
+                        self._send_json(resposta)
+                return
+        self._send_json({"error": f"rota não encontrada: {metodo} {url.path}"}, 404)
+
+    def _read_json(self) -> dict:
+        tamanho = int(self.headers.get("Content-Length") or 0)
+        dados = json.loads(self.rfile.read(tamanho) or b"{}")
+        if not isinstance(dados, dict):
+            raise ValueError("o corpo do pedido deve ser um objeto JSON")
+        return dados
+
+    def _send_json(self, dados, codigo: int = 200):
+        self._send_text(json.dumps(dados, ensure_ascii=False), "application/json; charset=utf-8", codigo)
+
+    def _send_text(self, texto: str, content_type: str, codigo: int = 200):
+        corpo = texto.encode("utf-8")
+        self.send_response(codigo)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def _filtro(self) -> JobFilter:
+        return JobFilter(*(self.params.get(campo) or None for campo in JobFilter._fields))
+
+    def _limit(self, padrao: int) -> int:
+        return int(self.params.get("limit", padrao))
+
+    # --- Rotas ---
+
+    def _get_status(self):
+        return self.service.status()
+
+    def _get_groups(self):
+        return {"groups": self.service.group_index.groups()}
+
+    def _get_files(self, group: str):
+        if group not in self.service.group_index.groups():
+            self._send_json({"error": f"grupo não encontrado: {group}"}, 404)
+            return None
+        return {"files": self.service.group_index.files(group)}
+
+    def _post_refresh(self, group: str):
+        self.service.group_index.refresh(group)
+        return {"files": self.service.group_index.files(group)}
+
+    def _get_jobs(self):
+        return self.service.jobs(self._limit(100))
+
+    def _post_job(self):
+        return {"id": self.service.enqueue(self._read_json())}
+
+    def _get_job(self, job_id: str):
+        row = self.service.scheduler.get_job(int(job_id))
+        if row is None:
+            self._send_json({"error": f"trabalho não encontrado: {job_id}"}, 404)
+            return None
+        return _job_to_dict(row)
+
+    def _post_job_action(self, job_id: str, acao: str):
+        scheduler = self.service.scheduler
+        ok = scheduler.cancel(int(job_id)) if acao == "cancel" else scheduler.retry(int(job_id))
+        return {"ok": ok}
+
+    def _post_queue_action(self, acao: str):
+        if acao == "pause":
+            self.service.scheduler.pause()
+        else:
+            self.service.scheduler.resume()
+        return {"paused": self.service.scheduler.paused}
+
+    def _get_history(self):
+        after = None
+        if self.params.get("after_timestamp") and self.params.get("after_id"):
+            after = (self.params["after_timestamp"], int(self.params["after_id"]))
+        return {"rows": query_jobs(self._filtro(), after=after, limit=self._limit(JOBS_PAGE_SIZE))}
+
+    def _get_history_since(self):
+        return {"rows": query_jobs_since(int(self.params.get("last_id", 0)), self._filtro(),
+                                         limit=self._limit(JOBS_PAGE_SIZE))}
+
+    def _get_max_id(self):
+        return {"max_id": get_max_job_id()}
+
+    def _get_stats_daily(self):
+        filtro = self._filtro()
+        return {"rows": get_daily_stats(filtro.date_from, filtro.date_to, filtro.group)}
+
+    def _get_stats_groups(self):
+        filtro = self._filtro()
+        return {"rows": get_group_stats(filtro.date_from, filtro.date_to)}
+
+    def _get_stats_slowest(self):
+        filtro = self._filtro()
+        return {"rows": get_slowest_jobs(filtro.date_from, filtro.date_to, filtro.group, limit=self._limit(50))}
+
+    def _get_metrics(self):
+        if self.params.get("format") == "json":
+            return {"stages": metrics.snapshot()}
+        self._send_text(metrics.prometheus(), "text/plain; version=0.0.4; charset=utf-8")
+        return None
+
+    def _get_printers(self):
+        return {"printers": listar_impressoras()}
+
+    def _get_events(self):
+        """Fluxo de eventos (text/event-stream); começa pelo estado atual da fila."""
+        fila = self.service.events.subscribe()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            self._write_event("jobs", self.service.jobs())
+            while True:
+                try:
+                    tipo, dados = fila.get(timeout=EVENTS_KEEPALIVE)
+                except queue.Empty:
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+                    continue
+                if tipo is None:
+                    break
+                self._write_event(tipo, dados)
+        except OSError:
+            pass  # Cliente desconectou
+        finally:
+            self.service.events.unsubscribe(fila)
+        return None
+
+    def _write_event(self, tipo: str, dados: dict):
+        self.wfile.write(f"event: {tipo}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+
+class _TCPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+if hasattr(socket, "AF_UNIX"):
+    class _UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+        def server_bind(self):
+            # Remove o socket deixado por uma execução anterior
+            if os.path.exists(self.server_address):
+                os.unlink(self.server_address)
+            super().server_bind()
+
+
+def create_server(service: PrintBoxService, host: str = SERVER_HOST, port: int = SERVER_PORT,
+                  socket_path: Optional[str] = None) -> socketserver.BaseServer:
+    """Cria o servidor HTTP (TCP ou socket Unix) ligado ao serviço; não começa a atender."""
+    if socket_path:
+        if not hasattr(socket, "AF_UNIX"):
+            raise OSError("sockets Unix não são suportados neste sistema")
+        server = _UnixServer(socket_path, _Handler)
+    else:
+        server = _TCPServer((host, port), _Handler)
+    server.service = service
+    return server
+
+
+# --- MÓDULO DO CLIENTE ---
+
+class PrintBoxClient:
+    """
+    Cliente da API do servidor. Mantém uma conexão HTTP por thread, reaproveitada
+    entre pedidos, e expõe consultas de histórico com os mesmos nomes e retornos
+    das funções de `printbox_core`.
+    """
+    def __init__(self, endereco: str, timeout: float = SERVER_TIMEOUT):
+        self.endereco = endereco
+        self.timeout = timeout
+        self._local = threading.local()
+        self._listeners = []
+        self._events_thread = None
+        self._stop = threading.Event()
+
+    def _connect(self, timeout: Optional[float]) -> http.client.HTTPConnection:
+        if self.endereco.startswith("unix:"):
+            return UnixHTTPConnection(self.endereco[len("unix:"):], timeout=timeout)
+        url = urlsplit(self.endereco if "://" in self.endereco else f"http://{self.endereco}")
+        return http.client.HTTPConnection(url.hostname or SERVER_HOST, url.port or SERVER_PORT, timeout=timeout)
+
+    def request(self, metodo: str, caminho: str, corpo: Optional[dict] = None, **params):
+        """Faz um pedido e devolve o JSON da resposta; levanta `PrintBoxServerError` em falhas."""
+        params = {k: v for k, v in params.items() if v is not None and v != ""}
+        if params:
+            caminho += "?" + urlencode(params)
+        dados = json.dumps(corpo).encode("utf-8") if corpo is not None else None
+        headers = {"Content-Type": "application/json"} if dados is not None else {}
+
+        for tentativa in range(2):
+            conn = getattr(self._local, "conn", None)
+            if conn is None:
+                conn = self._local.conn = self._connect(self.timeout)
+            try:
+                conn.request(metodo, caminho, body=dados, headers=headers)
+                resposta = conn.getresponse()
+                conteudo = resposta.read()
+                break
+            except (http.client.HTTPException, OSError) as e:
+                # Conexão reaproveitada pode ter sido fechada pelo servidor: tenta uma nova
+                conn.close()
+                self._local.conn = None
+                if tentativa:
+                    raise PrintBoxServerError(f"servidor PrintBox indisponível ({self.endereco}): {e}")
+
+        try:
+            resultado = json.loads(conteudo or b"{}")
+        except ValueError:
+            raise PrintBoxServerError(f"resposta inválida do servidor ({resposta.status})")
+        if resposta.status >= 400:
+            raise PrintBoxServerError(resultado.get("error") or f"erro {resposta.status}")
+        return resultado
+
+    def ping(self) -> bool:
+        try:
+            self.request("GET", "/status")
+            return True
+        except PrintBoxServerError:
+            return False
+
+    # --- Grupos e fila ---
+
+    def groups(self) -> List[str]:
+        return self.request("GET", "/groups")["groups"]
+
+    def files(self, group: str) -> List[str]:
+        return self.request("GET", f"/groups/{quote(group, safe='')}/files")["files"]
+
+    def refresh(self, group: str) -> List[str]:
+        return self.request("POST", f"/groups/{quote(group, safe='')}/refresh")["files"]
+
+    def enqueue(self, group: str, files: List[str], copies: int, merge: bool = False,
+                printer: str = "", priority: int = 0) -> int:
+        return self.request("POST", "/jobs", {"group": group, "files": files, "copies": copies,
+                                               "merge": merge, "printer": printer, "priority": priority})["id"]
+
+    def list_jobs(self, limit: int = 100) -> List[QueuedJob]:
+        return [QueuedJob(**job) for job in self.request("GET", "/jobs", limit=limit)["jobs"]]
+
+    @property
+    def paused(self) -> bool:
+        return self.request("GET", "/status")["paused"]
+
+    def cancel(self, job_id: int) -> bool:
+        return self.request("POST", f"/jobs/{job_id}/cancel")["ok"]
+
+    def retry(self, job_id: int) -> bool:
+        return self.request("POST", f"/jobs/{job_id}/retry")["ok"]
+
+    def pause(self):
+        self.request("POST", "/queue/pause")
+
+    def resume(self):
+        self.request("POST", "/queue/resume")
+
+    def listar_impressoras(self) -> List[str]:
+        return self.request("GET", "/printers")["printers"]
+
+    # --- Histórico (mesma assinatura das funções de printbox_core) ---
+
+    def query_jobs(self, filtro: Optional[JobFilter] = None, after: Optional[tuple] = None,
+                   limit: int = JOBS_PAGE_SIZE) -> List[tuple]:
+        after_timestamp, after_id = after if after is not None else (None, None)
+        return self._rows("/history", filtro, after_timestamp=after_timestamp, after_id=after_id, limit=limit)
+
+    def query_jobs_since(self, last_id: int, filtro: Optional[JobFilter] = None,
+                         limit: int = JOBS_PAGE_SIZE) -> List[tuple]:
+        return self._rows("/history/since", filtro, last_id=last_id, limit=limit)
+
+    def get_max_job_id(self) -> int:
+        return self.request("GET", "/history/max_id")["max_id"]
+
+    def get_daily_stats(self, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                        group: Optional[str] = None) -> List[tuple]:
+        return self._rows("/stats/daily", JobFilter(date_from, date_to, group))
+
+    def get_group_stats(self, date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[tuple]:
+        return self._rows("/stats/groups", JobFilter(date_from, date_to))
+
+    def get_slowest_jobs(self, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                         group: Optional[str] = None, limit: int = 50) -> List[tuple]:
+        return self._rows("/stats/slowest", JobFilter(date_from, date_to, group), limit=limit)
+
+    def _rows(self, caminho: str, filtro: Optional[JobFilter], **params) -> List[tuple]:
+        params.update((filtro or JobFilter())._asdict())
+        return [tuple(row) for row in self.request("GET", caminho, **params)["rows"]]
+
+    # --- Eventos ---
+
+    def subscribe(self, callback: Callable[[str, dict], None]):
+        """
+        Recebe `callback(tipo, dados)` para cada evento do servidor ("jobs",
+        "progress", "groups", "history"), numa thread de fundo que reconecta
+        sozinha se o servidor cair.
+        """
+        self._listeners.append(callback)
+        if self._events_thread is None:
+            self._events_thread = threading.Thread(target=self._events_loop, name="printbox-events", daemon=True)
+            self._events_thread.start()
+
+    def close(self):
+        self._stop.set()
+
+    def _events_loop(self):
+        espera = 1.0
+        while not self._stop.is_set():
+            conn = self._connect(timeout=EVENTS_KEEPALIVE * 2)
+            try:
+                conn.request("GET", "/events")
+                resposta = conn.getresponse()
+                if resposta.status != 200:
+                    raise http.client.HTTPException(f"erro {resposta.status}")
+                espera = 1.0
+                self._emit("connected", {})
+                tipo, dados = None, []
+                while not self._stop.is_set():
+                    linha = resposta.readline()
+                    if not linha:
+                        break
+                    linha = linha.decode("utf-8").rstrip("\n")
+                    if linha.startswith("event: "):
+                        tipo = linha[len("event: "):]
+                    elif linha.startswith("data: "):
+                        dados.append(linha[len("data: "):])
+                    elif not linha and tipo:
+                        self._emit(tipo, json.loads("\n".join(dados)))
+                        tipo, dados = None, []
+            except (http.client.HTTPException, OSError, ValueError):
+                pass
+            finally:
+                conn.close()
+            self._emit("disconnected", {})
+            self._stop.wait(espera)
+            espera = min(espera * 2, 30.0)
+
+    def _emit(self, tipo: str, dados: dict):
+        for callback in self._listeners:
+            callback(tipo, dados)
+
+
+class RemoteGroupIndex:
+    """A parte da interface de `GroupIndex` usada pela janela, servida pelo servidor."""
+    def __init__(self, client: PrintBoxClient):
+        self.client = client
+        self._lock = threading.Lock()
+        self._groups = []
+        self._files = {}  # grupo -> PDFs, preenchido sob demanda
+        self._subscribers = []
+
+    def groups(self) -> List[str]:
+        with self._lock:
+            return list(self._groups)
+
+    def files(self, group: str) -> List[str]:
+        with self._lock:
+            if group in self._files:
+                return list(self._files[group])
+        try:
+            arquivos = self.client.files(group)
+        except PrintBoxServerError:
+            return []
+        with self._lock:
+            self._files[group] = arquivos
+        return list(arquivos)
+
+    def subscribe(self, callback: Callable[[set, bool], None]):
+        self._subscribers.append(callback)
+
+    def load_snapshot(self) -> bool:
+        try:
+            grupos = self.client.groups()
+        except PrintBoxServerError:
+            return False
+        with self._lock:
+            self._groups = grupos
+            self._files.clear()
+        return True
+
+    def start(self):
+        self.client.subscribe(self._on_event)
+
+    def stop(self):
+        self.client.close()
+
+    def refresh(self, group: Optional[str] = None):
+        if group is None:
+            self.load_snapshot()
+            self._notify(set(self.groups()), True)
+            return
+        arquivos = self.client.refresh(group)
+        with self._lock:
+            self._files[group] = arquivos
+            lista_mudou = group not in self._groups
+        if lista_mudou:
+            self.load_snapshot()
+        self._notify({group}, lista_mudou)
+
+    def _on_event(self, tipo: str, dados: dict):
+        if tipo == "connected":
+            # (Re)conexão: eventos podem ter sido perdidos enquanto estava fora
+            self.refresh()
+        elif tipo == "groups":
+            with self._lock:
+                for grupo in dados["changed"]:
+                    self._files.pop(grupo, None)
+            if dados["list_changed"]:
+                self.load_snapshot()
+            self._notify(set(dados["changed"]), dados["list_changed"])
+
+    def _notify(self, alterados: set, lista_mudou: bool):
+        for callback in self._subscribers:
+            callback(alterados, lista_mudou)
+
+
+class RemoteScheduler:
+    """
+    A parte da interface de `PrintScheduler` usada pela janela. Quem despacha
+    é o servidor; a lista da fila vem pronta nos eventos, sem consultas.
+    `on_progress(job_id, percentual, mensagem)` e `on_history(job_id, grupo,
+    total de arquivos, falhas)` acompanham os trabalhos em andamento.
+    """
+    def __init__(self, client: PrintBoxClient, on_change: Optional[Callable[[], None]] = None,
+                 on_progress: Optional[Callable[[int, float, str], None]] = None,
+                 on_history: Optional[Callable[[int, str, int, List[FileResult]], None]] = None):
+        self.client = client
+        self.on_change = on_change
+        self.on_progress = on_progress
+        self.on_history = on_history
+        self._jobs = []
+        self._paused = False
+
+    def start(self):
+        self.client.subscribe(self._on_event)
+
+    def stop(self, wait: bool = True):
+        self.client.close()
+
+    def enqueue(self, group: str, files: List[str], copies: int, merge: bool = False,
+                printer: str = "", priority: int = 0) -> int:
+        return self.client.enqueue(group, files, copies, merge=merge, printer=printer, priority=priority)
+
+    def cancel(self, job_id: int) -> bool:
+        return self.client.cancel(job_id)
+
+    def retry(self, job_id: int) -> bool:
+        return self.client.retry(job_id)
+
+    def pause(self):
+        self.client.pause()
+
+    def resume(self):
+        self.client.resume()
+
+    @property
+    def paused(self) -> bool:
+        return self._paused
+
+    def list_jobs(self, limit: int = 100) -> List[QueuedJob]:
+        return self._jobs[:limit]
+
+    def _on_event(self, tipo: str, dados: dict):
+        if tipo == "jobs":
+            self._jobs = [QueuedJob(**job) for job in dados["jobs"]]
+            self._paused = dados["paused"]
+            if self.on_change is not None:
+                self.on_change()
+        elif tipo == "progress" and self.on_progress is not None:
+            self.on_progress(dados["job"], dados["value"], dados["message"])
+        elif tipo == "history" and self.on_history is not None:
+            falhas = [FileResult(**falha) for falha in dados["failures"]]
+            self.on_history(dados["job"], dados["group"], dados["files"], falhas)
+
+
+def server_from_env() -> Optional[PrintBoxClient]:
+    """Cliente para o servidor indicado em PRINTBOX_SERVER, ou None se a variável não existir."""
+    endereco = os.environ.get(SERVER_ENV, "").strip()
+    return PrintBoxClient(endereco) if endereco else None
+
+
+# --- EXECUÇÃO DO SERVIDOR ---
+
+def _encerrar(signum, frame):
+    raise KeyboardInterrupt
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="printbox-server", description="Servidor de impressão local do PrintBox.")
+    parser.add_argument("--base-dir", help="pasta do PrintBox (onde ficam print_log.db e grupos_de_arquivos)")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--socket", help="atende num socket Unix em vez de TCP")
+    parser.add_argument("--backend", choices=list(PRINT_BACKENDS), help="backend de impressão (padrão: lp)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="PrintBox: %(message)s")
+
+    if args.base_dir:
+        os.chdir(args.base_dir)
+    try:
+        setup_database()
+    except sqlite3.Error as e:
+        print(f"printbox-server: não foi possível inicializar o banco de dados: {e}", file=sys.stderr)
+        return 1
+
+    service = PrintBoxService(get_backend(args.backend or ""))
+    try:
+        server = create_server(service, args.host, args.port, args.socket)
+    except OSError as e:
+        print(f"printbox-server: não foi possível abrir {args.socket or f'{args.host}:{args.port}'}: {e}", file=sys.stderr)
+        return 1
+    service.start()
+    signal.signal(signal.SIGTERM, _encerrar)  # systemd/kill: encerra como no Ctrl+C, gravando o histórico
+    print(f"PrintBox atendendo em {'unix:' + args.socket if args.socket else f'http://{args.host}:{args.port}'}",
+          file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+        close_databases()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
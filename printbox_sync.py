@@ -0,0 +1,362 @@
+# --------------------------------------------------------------------------------
+# PrintBox - Sincronização do histórico entre estações
+#
+# DESCRIÇÃO:
+# Cada estação (ou servidor de impressão) tem o seu print_log.db. Para a
+# matriz ver todas juntas, cada uma envia as linhas novas de print_jobs para
+# uma pasta central (compartilhamento de rede, pasta sincronizada, ...), em
+# lotes pequenos que nunca são reescritos:
+#
+#   <central>/inbox/<estação>-<primeiro id>-<último id>.json.gz
+#
+# A estação guarda até que id já enviou (sync_state no print_log.db) e só
+# avança depois que o lote está gravado. Sem acesso à pasta, tenta de novo no
+# próximo ciclo, a partir do mesmo ponto. As linhas já enviadas cuja situação
+# no spooler mudou depois (pendente -> concluído/falha) vão de novo, em lotes
+# <estação>-spool-<primeira versão>-<última versão>.json.gz, guiados pela
+# coluna print_jobs.spool_seq.
+#
+# Na central, `merge_batches` junta os lotes em <central>/central.db. A chave
+# (estação, id) torna a junção idempotente: um lote repetido não duplica nada,
+# e a situação no spooler só é trocada por uma versão (spool_seq) mais nova.
+# `CentralStore` lê esse banco com as mesmas consultas dos gráficos.
+#
+# EXEMPLOS:
+# PRINTBOX_SYNC_DIR=/mnt/matriz/printbox python printbox.py    # envia a cada minuto
+# python printbox_cli.py sync --central /mnt/matriz/printbox   # envia agora
+# python printbox_cli.py merge --central /mnt/matriz/printbox  # na matriz (cron)
+# --------------------------------------------------------------------------------
+import datetime
+import gzip
+import json
+import os
+import re
+import socket
+import sqlite3
+import threading
+import uuid
+from typing import List, NamedTuple, Optional
+
+from printbox_core import (
+    DB_BUSY_TIMEOUT, SYNC_DIR,
+    _add_column, flush_print_log, logger, get_database, get_sync_state, set_sync_state, sync_high_water_key, _stats_filter_sql,
+)
+
+SYNC_INTERVAL = 60.0     # segundos entre envios automáticos
+SYNC_BATCH_SIZE = 5000   # linhas por lote
+STATION_ENV = "PRINTBOX_STATION_ID"
+CENTRAL_DB = "central.db"
+INBOX_DIR = "inbox"
+BATCH_FORMAT = 1
+
+_BATCH_COLUMNS = ("id", "timestamp", "filename", "group_name", "copies", "status", "pages",
+                  "spool_job_id", "spool_status", "spool_seq")
+_OPTIONAL_COLUMNS = ("spool_seq",)  # Ausente nos lotes das primeiras versões
+_I_ID, _I_SPOOL_JOB, _I_SPOOL_STATUS, _I_SPOOL_SEQ = (
+    _BATCH_COLUMNS.index(c) for c in ("id", "spool_job_id", "spool_status", "spool_seq"))
+
+
+class SyncResult(NamedTuple):
+    station: str
+    batches: int
+    rows: int
+    high_water: int
+    offline: bool = False
+    updated: int = 0  # linhas reenviadas porque a situação no spooler mudou
+
+
+class MergeResult(NamedTuple):
+    batches: int
+    rows: int        # linhas novas na central
+    duplicates: int  # já estavam lá (lote reenviado)
+    rejected: List[str]
+    updated: int = 0  # linhas com a situação no spooler atualizada
+
+
+# --- MÓDULO DA ESTAÇÃO ---
+
+def station_id() -> str:
+    """
+    Identificação desta estação: PRINTBOX_STATION_ID ou, na primeira vez, o
+    nome da máquina com um sufixo aleatório (guardado no print_log.db, para
+    não mudar se a máquina for renomeada).
+    """
+    configurado = os.environ.get(STATION_ENV, "").strip()
+    if configurado:
+        return _nome_seguro(configurado)
+    atual = get_sync_state("station_id")
+    if atual is None:
+        atual = f"{_nome_seguro(socket.gethostname())}-{uuid.uuid4().hex[:6]}"
+        set_sync_state("station_id", atual)
+    return atual
+
+
+def _nome_seguro(nome: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "-", nome).strip("-.") or "estacao"
+
+
+def push(central_dir: str = SYNC_DIR, batch_size: int = SYNC_BATCH_SIZE) -> SyncResult:
+    """Envia para a central as linhas de print_jobs ainda não enviadas."""
+    if not central_dir:
+        raise ValueError("pasta central não configurada (PRINTBOX_SYNC_DIR)")
+    estacao = station_id()
+    chave = sync_high_water_key(central_dir)
+    chave_spool = "spool_" + chave
+    enviado = int(get_sync_state(chave) or 0)
+    versao = int(get_sync_state(chave_spool) or 0)
+    flush_print_log()
+    inbox = os.path.join(central_dir, INBOX_DIR)
+    colunas = ", ".join(_BATCH_COLUMNS)
+
+    lotes = linhas = atualizadas = 0
+    try:
+        # Linhas novas, em ordem de id
+        while True:
+            rows = get_database().query(
+                f"SELECT {colunas} FROM print_jobs WHERE id > ? ORDER BY id LIMIT ?", (enviado, batch_size))
+            if not rows:
+                break
+            os.makedirs(inbox, exist_ok=True)
+            _write_batch(inbox, f"{estacao}-{rows[0][0]:012d}-{rows[-1][0]:012d}", estacao, rows)
+            enviado = rows[-1][0]
+            set_sync_state(chave, str(enviado))
+            lotes += 1
+            linhas += len(rows)
+            if len(rows) < batch_size:
+                break
+        # Linhas já enviadas que o SpoolTracker atualizou depois, em ordem de versão
+        while True:
+            rows = get_database().query(
+                f"SELECT {colunas} FROM print_jobs WHERE spool_seq > ? AND id <= ? ORDER BY spool_seq LIMIT ?",
+                (versao, enviado, batch_size))
+            if not rows:
+                break
+            os.makedirs(inbox, exist_ok=True)
+            _write_batch(inbox, f"{estacao}-spool-{rows[0][-1]:012d}-{rows[-1][-1]:012d}", estacao, rows)
+            versao = rows[-1][-1]
+            set_sync_state(chave_spool, str(versao))
+            lotes += 1
+            atualizadas += len(rows)
+            if len(rows) < batch_size:
+                break
+    except OSError:
+        # Central fora do alcance: o ponto de envio não avança e o próximo ciclo tenta de novo
+        return SyncResult(estacao, lotes, linhas, enviado, offline=True, updated=atualizadas)
+    return SyncResult(estacao, lotes, linhas, enviado, updated=atualizadas)
+
+
+def _write_batch(inbox: str, nome: str, estacao: str, rows: List[tuple]) -> str:
+    """Grava um lote compactado; o nome só aparece quando o arquivo está completo."""
+    nome += ".json.gz"
+    destino = os.path.join(inbox, nome)
+    tmp_path = os.path.join(inbox, f".{nome}.{os.getpid()}.tmp")
+    lote = {"format": BATCH_FORMAT, "station": estacao, "columns": list(_BATCH_COLUMNS), "rows": rows}
+    try:
+        with open(tmp_path, "wb") as f:
+            with gzip.GzipFile(fileobj=f, mode="wb", mtime=0) as gz:
+                gz.write(json.dumps(lote, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, destino)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return destino
+
+
+class SyncWorker:
+    """Envia o histórico para a central a cada `interval` segundos, em segundo plano."""
+    def __init__(self, central_dir: str = SYNC_DIR, interval: float = SYNC_INTERVAL):
+        self.central_dir = central_dir
+        self.interval = interval
+        self.last_result: Optional[SyncResult] = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="printbox-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.last_result = push(self.central_dir)
+            except (sqlite3.Error, OSError) as e:
+                logger.warning("Falha ao sincronizar o histórico: %s", e)
+            self._stop.wait(self.interval)
+
+
+# --- MÓDULO DA CENTRAL ---
+
+def _central_connection(central_dir: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(os.path.join(central_dir, CENTRAL_DB), timeout=DB_BUSY_TIMEOUT, isolation_level=None)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS print_jobs (
+            station_id TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            timestamp TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            group_name TEXT NOT NULL,
+            copies INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            pages INTEGER,
+            spool_job_id TEXT,
+            spool_status TEXT,
+            PRIMARY KEY (station_id, id)
+        )
+    ''')
+    _add_column(conn, "print_jobs", "spool_seq", "INTEGER")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_print_jobs_timestamp ON print_jobs (timestamp)")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS print_stats_daily (
+            day TEXT NOT NULL,
+            station_id TEXT NOT NULL,
+            group_name TEXT NOT NULL,
+            status TEXT NOT NULL,
+            jobs INTEGER NOT NULL DEFAULT 0,
+            copies INTEGER NOT NULL DEFAULT 0,
+            pages INTEGER NOT NULL DEFAULT 0,
+            printed_pages INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, station_id, group_name, status)
+        )
+    ''')
+    # Linhas repetidas (INSERT OR IGNORE) não disparam o trigger: os totais não dobram
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_print_jobs_stats AFTER INSERT ON print_jobs
+        BEGIN
+            INSERT INTO print_stats_daily (day, station_id, group_name, status, jobs, copies, pages, printed_pages)
+            VALUES (substr(NEW.timestamp, 1, 10), NEW.station_id, NEW.group_name, NEW.status, 1, NEW.copies,
+                    COALESCE(NEW.pages, 0), COALESCE(NEW.pages, 0) * NEW.copies)
+            ON CONFLICT (day, station_id, group_name, status) DO UPDATE SET
+                jobs = jobs + 1,
+                copies = copies + excluded.copies,
+                pages = pages + excluded.pages,
+                printed_pages = printed_pages + excluded.printed_pages;
+        END
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stations (
+            station_id TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL,
+            last_merge TEXT NOT NULL
+        )
+    ''')
+    return conn
+
+
+def merge_batches(central_dir: str = SYNC_DIR) -> MergeResult:
+    """
+    Junta os lotes de `<central>/inbox` no central.db e apaga os que entraram.
+    Lotes ilegíveis ficam na pasta e são listados em `rejected`.
+    """
+    inbox = os.path.join(central_dir, INBOX_DIR)
+    try:
+        nomes = sorted(n for n in os.listdir(inbox) if n.endswith(".json.gz") and not n.startswith("."))
+    except FileNotFoundError:
+        nomes = []
+    conn = _central_connection(central_dir)
+    lotes = novas = repetidas = atualizadas_total = 0
+    rejeitados = []
+    try:
+        for nome in nomes:
+            caminho = os.path.join(inbox, nome)
+            try:
+                with gzip.open(caminho, "rb") as f:
+                    lote = json.loads(f.read().decode("utf-8"))
+                estacao, colunas, rows = lote["station"], lote["columns"], lote["rows"]
+                obrigatorias = set(_BATCH_COLUMNS) - set(_OPTIONAL_COLUMNS)
+                if lote.get("format") != BATCH_FORMAT or not obrigatorias <= set(colunas):
+                    raise ValueError("formato de lote desconhecido")
+            except FileNotFoundError:
+                continue  # Outro processo juntou este lote primeiro
+            except (OSError, ValueError, KeyError, TypeError):
+                rejeitados.append(nome)
+                continue
+
+            indices = [colunas.index(c) if c in colunas else None for c in _BATCH_COLUMNS]
+            valores = [[row[i] if i is not None else None for i in indices] for row in rows]
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Linhas que já estavam lá: só uma versão mais nova troca a situação no spooler.
+                # Vem antes do INSERT para um lote de spool que chegue antes do lote das linhas
+                # também servir (o INSERT grava a linha inteira, já com a versão nova).
+                atualizadas = conn.executemany('''
+                    UPDATE print_jobs SET spool_job_id = ?, spool_status = ?, spool_seq = ?
+                    WHERE station_id = ? AND id = ? AND COALESCE(spool_seq, 0) < ?
+                ''', ((v[_I_SPOOL_JOB], v[_I_SPOOL_STATUS], v[_I_SPOOL_SEQ], estacao, v[_I_ID], v[_I_SPOOL_SEQ])
+                      for v in valores if v[_I_SPOOL_SEQ])).rowcount
+                # rowcount não conta as linhas gravadas pelo trigger, só as novas de print_jobs
+                inseridas = conn.executemany(
+                    f"INSERT OR IGNORE INTO print_jobs (station_id, {', '.join(_BATCH_COLUMNS)}) "
+                    f"VALUES (?{', ?' * len(_BATCH_COLUMNS)})",
+                    ([estacao] + v for v in valores)).rowcount
+                conn.execute('''
+                    INSERT INTO stations (station_id, last_id, last_merge) VALUES (?, ?, ?)
+                    ON CONFLICT (station_id) DO UPDATE SET
+                        last_id = MAX(last_id, excluded.last_id), last_merge = excluded.last_merge
+                ''', (estacao, max((v[_I_ID] for v in valores), default=0), datetime.datetime.now().isoformat()))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass  # Se voltar a ser lido, nada é duplicado
+            lotes += 1
+            novas += inseridas
+            atualizadas_total += atualizadas
+            repetidas += len(rows) - inseridas - atualizadas
+    finally:
+        conn.close()
+    return MergeResult(lotes, novas, repetidas, rejeitados, atualizadas_total)
+
+
+class CentralStore:
+    """
+    Leitura do central.db, com o mesmo formato de `get_daily_stats` e
+    `get_group_stats` do printbox_core (e o filtro extra por estação).
+    """
+    def __init__(self, central_dir: str = SYNC_DIR):
+        self.central_dir = central_dir
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.central_dir, CENTRAL_DB)
+
+    def available(self) -> bool:
+        return bool(self.central_dir) and os.path.exists(self.path)
+
+    def _query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        # Somente leitura: quem grava no central.db é apenas `merge_batches`
+        uri = "file:" + os.path.abspath(self.path).replace("?", "%3f").replace("#", "%23") + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=DB_BUSY_TIMEOUT)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def get_daily_stats(self, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                        group: Optional[str] = None, station: Optional[str] = None) -> List[tuple]:
+        """Totais por dia de todas as estações (ou de `station`): (day, jobs, copies, pages, printed_pages)."""
+        where, params = _stats_filter_sql(date_from, date_to, group)
+        if station:
+            where += (" AND" if where else " WHERE") + " station_id = ?"
+            params.append(station)
+        return self._query(
+            "SELECT day, SUM(jobs), SUM(copies), SUM(pages), SUM(printed_pages) FROM print_stats_daily"
+            + where + " GROUP BY day ORDER BY day", tuple(params))
+
+    def get_group_stats(self, date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[tuple]:
+        """Totais por grupo de todas as estações: (group_name, jobs, copies, pages, printed_pages)."""
+        where, params = _stats_filter_sql(date_from, date_to, None)
+        return self._query(
+            "SELECT group_name, SUM(jobs), SUM(copies), SUM(pages), SUM(printed_pages) FROM print_stats_daily"
+            + where + " GROUP BY group_name ORDER BY SUM(printed_pages) DESC", tuple(params))
+
+    def stations(self) -> List[tuple]:
+        """Estações que já enviaram histórico: (station_id, last_id, last_merge)."""
+        return self._query("SELECT station_id, last_id, last_merge FROM stations ORDER BY station_id")
@@ -0,0 +1,52 @@
+# --------------------------------------------------------------------------------
+# Base dos testes: cada teste roda numa pasta temporária vazia (print_log.db,
+# grupos_de_arquivos e caches próprios) e imprime pelo backend dry-run.
+# --------------------------------------------------------------------------------
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from typing import List
+
+import printbox_core
+from printbox_bench import pdf_bytes
+from printbox_core import GRUPOS_DIR, blob_store, close_databases, get_backend, metadata_cache, setup_database
+
+
+class PrintBoxTestCase(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp(prefix="printbox-test-")
+        os.chdir(self.dir)
+        self._limpar_singletons()
+        setup_database()
+        self.backend = get_backend("dry-run")
+
+    def tearDown(self):
+        close_databases()
+        self._limpar_singletons()
+        os.chdir(self._cwd)
+        shutil.rmtree(self.dir, onerror=_remover_somente_leitura)
+
+    @staticmethod
+    def _limpar_singletons():
+        # Os caches do módulo guardam caminhos relativos da pasta do teste anterior
+        blob_store._inodes = None
+        metadata_cache.invalidate()
+        printbox_core.metrics.reset()
+
+    def criar_grupo(self, grupo: str, arquivos: List[str], pages: int = 1) -> str:
+        """Cria a pasta do grupo com um PDF válido (e de conteúdo único) por nome."""
+        pasta = os.path.join(GRUPOS_DIR, grupo)
+        os.makedirs(pasta, exist_ok=True)
+        for nome in arquivos:
+            with open(os.path.join(pasta, nome), "wb") as f:
+                f.write(pdf_bytes(pages, f"{grupo}/{nome}"))
+        return pasta
+
+
+def _remover_somente_leitura(funcao, caminho, _info):
+    # Os blobs são 0444 (e no Windows isso impede apagar)
+    os.chmod(caminho, stat.S_IWRITE | stat.S_IREAD)
+    funcao(caminho)
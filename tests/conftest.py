@@ -0,0 +1,6 @@
+# Os testes importam os módulos do PrintBox direto da raiz do repositório
+# (não há pacote instalável): `python -m pytest -q` na raiz, ou só `pytest`.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
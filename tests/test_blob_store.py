@@ -0,0 +1,106 @@
+import os
+import stat
+import unittest
+from unittest import mock
+
+import printbox_core
+from printbox_core import LINK_BLOBS, _hash_file, blob_store
+
+from base import PrintBoxTestCase
+
+
+def _somente_leitura(caminho: str) -> bool:
+    return not os.stat(caminho).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+
+
+@unittest.skipUnless(LINK_BLOBS, "hardlinks desativados nesta plataforma")
+class TestBlobStoreHardlinks(PrintBoxTestCase):
+    def setUp(self):
+        super().setUp()
+        self.origem = self.criar_grupo("origem", ["fordpass.pdf", "bronco.pdf"])
+        os.makedirs("grupos_de_arquivos/Bronco")
+        os.makedirs("grupos_de_arquivos/Maverick")
+
+    def test_mesmo_conteudo_vira_um_blob_so(self):
+        fordpass = os.path.join(self.origem, "fordpass.pdf")
+        self.assertTrue(blob_store.import_file(fordpass, "grupos_de_arquivos/Bronco"))
+        self.assertFalse(blob_store.import_file(fordpass, "grupos_de_arquivos/Maverick"))
+
+        blob = blob_store.blob_path(_hash_file(fordpass))
+        self.assertTrue(os.path.samefile("grupos_de_arquivos/Bronco/fordpass.pdf", blob))
+        self.assertTrue(os.path.samefile("grupos_de_arquivos/Maverick/fordpass.pdf", blob))
+        self.assertEqual(blob_store.resolve("grupos_de_arquivos/Maverick/fordpass.pdf"), blob)
+        self.assertEqual(len(os.listdir(blob_store.root)), 1)
+
+    def test_blobs_sao_somente_leitura(self):
+        blob_store.import_file(os.path.join(self.origem, "fordpass.pdf"), "grupos_de_arquivos/Bronco")
+        self.assertTrue(_somente_leitura("grupos_de_arquivos/Bronco/fordpass.pdf"))
+
+    def test_reaproveitar_blob_reaplica_somente_leitura(self):
+        fordpass = os.path.join(self.origem, "fordpass.pdf")
+        sha256, _ = blob_store.put(fordpass)
+        os.chmod(blob_store.blob_path(sha256), 0o644)  # Blob de uma versão anterior
+        self.assertEqual(blob_store.put(fordpass), (sha256, False))
+        self.assertTrue(_somente_leitura(blob_store.blob_path(sha256)))
+
+    def test_blob_alterado_e_refeito(self):
+        fordpass = os.path.join(self.origem, "fordpass.pdf")
+        blob_store.import_file(fordpass, "grupos_de_arquivos/Bronco")
+        vinculado = "grupos_de_arquivos/Bronco/fordpass.pdf"
+        os.chmod(vinculado, 0o644)
+        with open(vinculado, "wb") as f:
+            f.write(b"gravado por cima do hardlink")
+
+        sha256, novo = blob_store.put(fordpass)
+        self.assertTrue(novo)
+        self.assertEqual(_hash_file(blob_store.blob_path(sha256)), sha256)
+        self.assertFalse(os.path.samefile(vinculado, blob_store.blob_path(sha256)))
+        # O novo import do mesmo conteúdo volta a apontar para o blob correto
+        blob_store.import_file(fordpass, "grupos_de_arquivos/Maverick")
+        self.assertEqual(_hash_file("grupos_de_arquivos/Maverick/fordpass.pdf"), sha256)
+
+    def test_dedup_converte_copias_em_hardlinks(self):
+        copias = []
+        for grupo in ("Bronco", "Maverick"):
+            destino = os.path.join("grupos_de_arquivos", grupo, "fordpass.pdf")
+            with open(os.path.join(self.origem, "fordpass.pdf"), "rb") as f, open(destino, "wb") as g:
+                g.write(f.read())
+            copias.append(destino)
+        convertidos, economizados = blob_store.deduplicate()
+        # Os dois PDFs do grupo "origem" também são convertidos
+        self.assertEqual(convertidos, 4)
+        self.assertEqual(economizados, 2 * os.path.getsize(copias[0]))
+        self.assertTrue(os.path.samefile(*copias))
+        self.assertEqual(blob_store.deduplicate(), (0, 0))
+
+    def test_discard_so_remove_blob_sem_uso(self):
+        fordpass = os.path.join(self.origem, "fordpass.pdf")
+        blob_store.import_file(fordpass, "grupos_de_arquivos/Bronco")
+        sha256 = _hash_file(fordpass)
+        self.assertFalse(blob_store.discard(sha256))
+        os.remove("grupos_de_arquivos/Bronco/fordpass.pdf")
+        self.assertTrue(blob_store.discard(sha256))
+        self.assertFalse(os.path.exists(blob_store.blob_path(sha256)))
+
+    def test_prune_remove_blobs_orfaos(self):
+        blob_store.put(os.path.join(self.origem, "bronco.pdf"))
+        blob_store.import_file(os.path.join(self.origem, "fordpass.pdf"), "grupos_de_arquivos/Bronco")
+        self.assertEqual(blob_store.prune(), 1)
+        self.assertEqual(len(os.listdir(blob_store.root)), 1)
+
+
+class TestBlobStoreSemHardlinks(PrintBoxTestCase):
+    def test_grupos_recebem_copias_gravaveis(self):
+        origem = self.criar_grupo("origem", ["fordpass.pdf"])
+        os.makedirs("grupos_de_arquivos/Bronco")
+        with mock.patch.object(printbox_core, "LINK_BLOBS", False):
+            blob_store.import_file(os.path.join(origem, "fordpass.pdf"), "grupos_de_arquivos/Bronco")
+            self.assertEqual(blob_store.deduplicate(), (0, 0))
+        copia = "grupos_de_arquivos/Bronco/fordpass.pdf"
+        self.assertEqual(os.stat(copia).st_nlink, 1)
+        self.assertFalse(_somente_leitura(copia))
+        self.assertEqual(_hash_file(copia), _hash_file(os.path.join(origem, "fordpass.pdf")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import unittest
+
+from printbox_core import BLOBS_DIR, GRUPOS_DIR, LINK_BLOBS, _hash_file, blob_store, import_group, metadata_cache
+
+from base import PrintBoxTestCase
+
+
+class ImportTestCase(PrintBoxTestCase):
+    def setUp(self):
+        super().setUp()
+        self.origem = self.criar_grupo(".origem", ["a.pdf", "b.pdf", "c.pdf"], pages=3)
+        with open(os.path.join(self.origem, "quebrado.pdf"), "wb") as f:
+            f.write(b"isto nao e um PDF")
+
+    def fontes(self, *nomes: str) -> list:
+        return [os.path.join(self.origem, nome) for nome in nomes]
+
+    def importar(self, grupo: str, fontes: list, **kwargs):
+        kwargs.setdefault("processes", 1)
+        return import_group(grupo, fontes, **kwargs)
+
+    def blobs(self) -> list:
+        return sorted(os.listdir(BLOBS_DIR)) if os.path.isdir(BLOBS_DIR) else []
+
+    def sobras(self) -> list:
+        """Pastas temporárias de importação deixadas em grupos_de_arquivos."""
+        return [nome for nome in os.listdir(GRUPOS_DIR) if nome.startswith(".importando-")]
+
+
+class TestImportacao(ImportTestCase):
+    def test_grupo_novo(self):
+        resultado = self.importar("Bronco", self.fontes("a.pdf", "b.pdf"))
+        self.assertEqual((resultado.added, resultado.updated, resultado.invalid), (["a.pdf", "b.pdf"], [], []))
+        self.assertEqual(sorted(os.listdir("grupos_de_arquivos/Bronco")), ["a.pdf", "b.pdf"])
+        self.assertEqual(metadata_cache.get_page_count("grupos_de_arquivos/Bronco/a.pdf"), 3)
+        self.assertEqual(self.sobras(), [])
+        if LINK_BLOBS:
+            blob = blob_store.blob_path(_hash_file(self.fontes("a.pdf")[0]))
+            self.assertTrue(os.path.samefile("grupos_de_arquivos/Bronco/a.pdf", blob))
+
+    def test_reimportar_so_troca_o_que_mudou(self):
+        self.importar("Bronco", self.fontes("a.pdf", "b.pdf"))
+        with open(self.fontes("b.pdf")[0], "ab") as f:
+            f.write(b"\n% revisado\n")
+        resultado = self.importar("Bronco", self.fontes("a.pdf", "b.pdf", "c.pdf"))
+        self.assertEqual((resultado.added, resultado.updated, resultado.unchanged), (["c.pdf"], ["b.pdf"], ["a.pdf"]))
+        self.assertEqual(_hash_file("grupos_de_arquivos/Bronco/b.pdf"), _hash_file(self.fontes("b.pdf")[0]))
+
+    def test_valida_em_processos_separados(self):
+        resultado = self.importar("Bronco", self.fontes("a.pdf", "quebrado.pdf"), processes=2)
+        self.assertEqual(resultado.added, ["a.pdf"])
+        self.assertEqual([nome for nome, _ in resultado.invalid], ["quebrado.pdf"])
+
+    def test_nome_de_grupo_invalido(self):
+        for nome in ("", ".blobs", "a/b"):
+            with self.subTest(nome=nome), self.assertRaises(ValueError):
+                self.importar(nome, self.fontes("a.pdf"))
+
+
+class TestRecusaECancelamento(ImportTestCase):
+    def test_arquivo_invalido_fica_de_fora_e_sem_blob(self):
+        resultado = self.importar("Bronco", self.fontes("a.pdf", "quebrado.pdf"))
+        self.assertEqual(resultado.added, ["a.pdf"])
+        self.assertEqual([nome for nome, _ in resultado.invalid], ["quebrado.pdf"])
+        self.assertEqual(os.listdir("grupos_de_arquivos/Bronco"), ["a.pdf"])
+        self.assertEqual(self.blobs(), [f"{_hash_file(self.fontes('a.pdf')[0])}.pdf"])
+        self.assertEqual(self.sobras(), [])
+
+    def test_so_arquivos_invalidos_nao_cria_o_grupo(self):
+        resultado = self.importar("Bronco", self.fontes("quebrado.pdf"))
+        self.assertEqual(resultado.added, [])
+        self.assertFalse(os.path.exists("grupos_de_arquivos/Bronco"))
+        self.assertEqual(self.blobs(), [])
+
+    def test_cancelar_grupo_novo_nao_deixa_nada(self):
+        resultado = self.importar("Bronco", self.fontes("a.pdf", "b.pdf", "c.pdf"), workers=1,
+                                  is_cancelled=lambda: bool(self.blobs()))  # Cancela depois da primeira cópia
+        self.assertTrue(resultado.cancelled)
+        self.assertFalse(os.path.exists("grupos_de_arquivos/Bronco"))
+        self.assertEqual(self.blobs(), [])
+        self.assertEqual(self.sobras(), [])
+
+    def test_cancelar_grupo_existente_nao_altera_nada(self):
+        self.importar("Bronco", self.fontes("a.pdf"))
+        antes = _hash_file("grupos_de_arquivos/Bronco/a.pdf")
+        blobs_antes = self.blobs()
+        with open(self.fontes("a.pdf")[0], "ab") as f:
+            f.write(b"\n% revisado\n")
+
+        copias = []
+        resultado = self.importar("Bronco", self.fontes("a.pdf", "b.pdf"), workers=1,
+                                  on_progress=lambda valor, mensagem: copias.append(mensagem),
+                                  is_cancelled=lambda: bool(copias))
+        self.assertTrue(resultado.cancelled)
+        self.assertEqual(os.listdir("grupos_de_arquivos/Bronco"), ["a.pdf"])
+        self.assertEqual(_hash_file("grupos_de_arquivos/Bronco/a.pdf"), antes)
+        self.assertEqual(self.blobs(), blobs_antes)
+
+    def test_blob_de_outro_grupo_nao_e_apagado(self):
+        self.importar("Bronco", self.fontes("a.pdf"))
+        resultado = self.importar("Maverick", self.fontes("a.pdf", "b.pdf"), workers=1,
+                                  is_cancelled=lambda: len(self.blobs()) > 1)
+        self.assertTrue(resultado.cancelled)
+        self.assertEqual(self.blobs(), [f"{_hash_file(self.fontes('a.pdf')[0])}.pdf"])
+        self.assertEqual(_hash_file("grupos_de_arquivos/Bronco/a.pdf"), _hash_file(self.fontes("a.pdf")[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,207 @@
+import datetime
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+import unittest
+
+from printbox_core import (
+    FILA_CANCELADO, FILA_CONCLUIDO, FILA_FALHA, FILA_IMPRIMINDO, FILA_PENDENTE, QUEUE_LEASE, RESULTADO_SUCESSO,
+    PrintScheduler, get_database, run_print_job,
+)
+
+from base import PrintBoxTestCase
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FINAIS = (FILA_CONCLUIDO, FILA_FALHA, FILA_CANCELADO)
+
+# Outro processo despachando a mesma fila: cada trabalho que ele imprime vira uma linha em feitos-<pid>.txt
+_DESPACHANTE = textwrap.dedent('''
+    import os, time
+    from printbox_core import FILA_IMPRIMINDO, FILA_PENDENTE, PrintScheduler, get_database
+
+    def worker(job):
+        with open(f"feitos-{os.getpid()}.txt", "a") as f:
+            f.write(f"{job.id}\\n")
+        time.sleep(0.01)
+        return True
+
+    scheduler = PrintScheduler(worker)
+    scheduler.start()
+    prazo = time.monotonic() + 60
+    while time.monotonic() < prazo:
+        restantes = get_database().query_one(
+            "SELECT COUNT(*) FROM print_queue WHERE status IN (?, ?)", (FILA_PENDENTE, FILA_IMPRIMINDO))[0]
+        if not restantes:
+            break
+        time.sleep(0.05)
+    scheduler.stop()
+''')
+
+# Processo que reserva um trabalho e termina sem concluí-lo (como se tivesse caído)
+_RESERVA_E_CAI = textwrap.dedent('''
+    import sys
+    from printbox_core import PrintScheduler
+    scheduler = PrintScheduler(lambda job: True)
+    job = scheduler.get_job(int(sys.argv[1]))
+    assert scheduler._claim(job)
+    print(scheduler.owner)
+''')
+
+
+class QueueTestCase(PrintBoxTestCase):
+    def setUp(self):
+        super().setUp()
+        self.schedulers = []
+
+    def tearDown(self):
+        # O despacho precisa parar antes de o banco do teste ser fechado
+        for scheduler in self.schedulers:
+            scheduler.stop()
+            if scheduler._thread is not None:
+                scheduler._thread.join(10)
+        super().tearDown()
+
+    def novo_scheduler(self, worker=lambda job: True, owner: str = "") -> PrintScheduler:
+        scheduler = PrintScheduler(worker)
+        if owner:
+            scheduler.owner = owner
+        self.schedulers.append(scheduler)
+        return scheduler
+
+    def esperar(self, scheduler: PrintScheduler, job_id: int, estados=FINAIS, timeout: float = 10) -> str:
+        prazo = time.monotonic() + timeout
+        while time.monotonic() < prazo:
+            status = scheduler.get_job(job_id).status
+            if status in estados:
+                return status
+            time.sleep(0.02)
+        self.fail(f"trabalho {job_id} ficou em {status}")
+
+    def outro_processo(self, script: str, *args: str) -> subprocess.Popen:
+        ambiente = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [RAIZ, os.environ.get("PYTHONPATH")])))
+        return subprocess.Popen([sys.executable, "-c", script, *args], cwd=self.dir, env=ambiente,
+                                stdout=subprocess.PIPE, text=True)
+
+
+class TestFila(QueueTestCase):
+    def test_imprime_pelo_backend_dry_run(self):
+        self.criar_grupo("Bronco", ["a.pdf", "b.pdf"])
+
+        def worker(job):
+            resultados = run_print_job(job.group_name, job.files, job.copies, backend=self.backend)
+            return all(r.status == RESULTADO_SUCESSO for r in resultados)
+
+        scheduler = self.novo_scheduler(worker)
+        scheduler.start()
+        job_id = scheduler.enqueue("Bronco", ["b.pdf", "a.pdf"], 2)
+        self.assertEqual(self.esperar(scheduler, job_id), FILA_CONCLUIDO)
+        self.assertEqual(get_database().query("SELECT filename, copies FROM print_jobs ORDER BY id"),
+                         [("b.pdf", 2), ("a.pdf", 2)])
+
+    def test_prioridade_e_ordem_de_chegada(self):
+        ordem = []
+        scheduler = self.novo_scheduler(lambda job: ordem.append(job.group_name) or True)
+        for grupo, prioridade in (("a", 0), ("b", 5), ("c", 0), ("d", 5)):
+            scheduler.enqueue(grupo, ["x.pdf"], 1, priority=prioridade)
+        scheduler.start()
+        self.esperar(scheduler, 3)
+        self.assertEqual(ordem, ["b", "d", "a", "c"])
+
+    def test_cancelar_pendente_e_repetir(self):
+        scheduler = self.novo_scheduler()
+        job_id = scheduler.enqueue("a", ["x.pdf"], 1)
+        self.assertTrue(scheduler.cancel(job_id))
+        self.assertEqual(scheduler.get_job(job_id).status, FILA_CANCELADO)
+        self.assertTrue(scheduler.retry(job_id))
+        scheduler.start()
+        self.assertEqual(self.esperar(scheduler, job_id), FILA_CONCLUIDO)
+
+    def test_cancelar_durante_a_impressao(self):
+        liberar = threading.Event()
+        scheduler = self.novo_scheduler(lambda job: liberar.wait(10))
+        scheduler.start()
+        job_id = scheduler.enqueue("a", ["x.pdf"], 1)
+        self.esperar(scheduler, job_id, (FILA_IMPRIMINDO,))
+        self.assertTrue(scheduler.cancel(job_id))
+        self.assertTrue(scheduler.is_cancelled(job_id))
+        liberar.set()
+        self.assertEqual(self.esperar(scheduler, job_id), FILA_CANCELADO)
+
+    def test_erro_no_worker_vira_falha(self):
+        def worker(job):
+            raise RuntimeError("impressora sumiu")
+
+        scheduler = self.novo_scheduler(worker)
+        scheduler.start()
+        job_id = scheduler.enqueue("a", ["x.pdf"], 1)
+        self.assertEqual(self.esperar(scheduler, job_id), FILA_FALHA)
+        self.assertEqual(scheduler.get_job(job_id).error, "impressora sumiu")
+
+
+class TestFilaEntreProcessos(QueueTestCase):
+    def test_reserva_e_exclusiva(self):
+        a = self.novo_scheduler(owner="estacao-a:1")
+        b = self.novo_scheduler(owner="estacao-b:1")
+        job = a.get_job(a.enqueue("a", ["x.pdf"], 1))
+        self.assertTrue(a._claim(job))
+        self.assertFalse(b._claim(job))
+        self.assertEqual(b.get_job(job.id).attempts, 1)
+
+    def test_cada_trabalho_impresso_uma_vez(self):
+        scheduler = self.novo_scheduler()
+        ids = [scheduler.enqueue("a", [f"{i}.pdf"], 1, printer=f"p{i % 3}") for i in range(30)]
+        processos = [self.outro_processo(_DESPACHANTE) for _ in range(3)]
+        for processo in processos:
+            processo.communicate(timeout=90)
+            self.assertEqual(processo.returncode, 0)
+
+        feitos = []
+        for nome in os.listdir(self.dir):
+            if nome.startswith("feitos-"):
+                with open(os.path.join(self.dir, nome)) as f:
+                    feitos += [int(linha) for linha in f]
+        self.assertEqual(sorted(feitos), ids)
+        self.assertEqual({job.status for job in scheduler.list_jobs()}, {FILA_CONCLUIDO})
+
+    def test_trabalho_de_processo_que_morreu_volta_para_a_fila(self):
+        scheduler = self.novo_scheduler()
+        job_id = scheduler.enqueue("a", ["x.pdf"], 1)
+        processo = self.outro_processo(_RESERVA_E_CAI, str(job_id))
+        dono, _ = processo.communicate(timeout=30)
+        self.assertEqual(processo.returncode, 0)
+        self.assertEqual(scheduler.get_job(job_id).status, FILA_IMPRIMINDO)
+
+        self.assertEqual(scheduler._recover_stale(), 1)
+        self.assertEqual(scheduler.get_job(job_id).status, FILA_PENDENTE)
+        scheduler.start()
+        self.assertEqual(self.esperar(scheduler, job_id), FILA_CONCLUIDO)
+        self.assertEqual(scheduler.get_job(job_id).attempts, 2)
+        self.assertNotEqual(dono.strip(), scheduler.owner)
+
+    def test_reserva_de_outra_maquina_so_expira_pelo_prazo(self):
+        outra = self.novo_scheduler(owner="outra-maquina:4242")
+        scheduler = self.novo_scheduler()
+        job_id = scheduler.enqueue("a", ["x.pdf"], 1)
+        self.assertTrue(outra._claim(outra.get_job(job_id)))
+        self.assertEqual(scheduler._recover_stale(), 0)
+
+        vencida = (datetime.datetime.now() - datetime.timedelta(seconds=QUEUE_LEASE + 1)).isoformat()
+        get_database().execute("UPDATE print_queue SET updated_at = ? WHERE id = ?", (vencida, job_id))
+        self.assertEqual(scheduler._recover_stale(), 1)
+        self.assertEqual(scheduler.get_job(job_id).status, FILA_PENDENTE)
+
+    def test_reserva_renovada_nao_expira(self):
+        scheduler = self.novo_scheduler(owner="outra-maquina:4242")
+        job_id = scheduler.enqueue("a", ["x.pdf"], 1)
+        scheduler._claim(scheduler.get_job(job_id))
+        vencida = (datetime.datetime.now() - datetime.timedelta(seconds=QUEUE_LEASE + 1)).isoformat()
+        get_database().execute("UPDATE print_queue SET updated_at = ? WHERE id = ?", (vencida, job_id))
+        scheduler._heartbeat({"": job_id})
+        self.assertEqual(self.novo_scheduler()._recover_stale(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
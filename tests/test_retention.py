@@ -0,0 +1,143 @@
+import datetime
+import os
+import sqlite3
+import unittest
+from unittest import mock
+
+import printbox_core
+from printbox_core import (
+    ARCHIVE_DIR, JobFilter, RetentionPolicy, apply_retention, archive_path, get_database, list_archives, query_jobs,
+)
+from printbox_sync import merge_batches, push
+
+from base import PrintBoxTestCase
+
+POLITICA = RetentionPolicy(hot_days=30, timing_days=0, vacuum="none")
+
+
+def _dias_atras(dias: int, segundo: int = 0) -> str:
+    momento = datetime.datetime.now() - datetime.timedelta(days=dias)
+    return momento.replace(hour=12, minute=0, second=segundo % 60, microsecond=0).isoformat()
+
+
+class RetentionTestCase(PrintBoxTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(printbox_core, "SYNC_DIR", "")  # Sem sincronização automática
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def inserir(self, *timestamps: str):
+        with get_database().transaction() as conn:
+            conn.executemany(
+                "INSERT INTO print_jobs (timestamp, filename, group_name, copies, status, pages) "
+                "VALUES (?, 'a.pdf', 'G', 1, 'Sucesso', 1)", [(ts,) for ts in timestamps])
+
+    def ids_no_banco(self) -> list:
+        return [row[0] for row in get_database().query("SELECT id FROM print_jobs ORDER BY id")]
+
+    def ids_arquivados(self) -> list:
+        ids = []
+        for _, caminho in list_archives():
+            with sqlite3.connect(caminho) as conn:
+                ids += [row[0] for row in conn.execute("SELECT id FROM print_jobs")]
+        return sorted(ids)
+
+
+class TestArquivamento(RetentionTestCase):
+    def test_move_so_o_que_passou_do_prazo(self):
+        self.inserir(_dias_atras(400), _dias_atras(100), _dias_atras(1))
+        resultado = apply_retention(POLITICA)
+        self.assertEqual(resultado.archived, 2)
+        self.assertEqual(self.ids_no_banco(), [3])
+        self.assertEqual(self.ids_arquivados(), [1, 2])
+
+    def test_totais_diarios_nao_mudam(self):
+        self.inserir(*[_dias_atras(200, i) for i in range(5)])
+        antes = get_database().query("SELECT * FROM print_stats_daily")
+        apply_retention(POLITICA)
+        self.assertEqual(get_database().query("SELECT * FROM print_stats_daily"), antes)
+
+    def test_retoma_depois_de_queda_no_meio_do_mes(self):
+        self.inserir(*[_dias_atras(200, i) for i in range(4)])
+        mes = _dias_atras(200)[:7]
+        # Simula uma execução que copiou parte do mês para o arquivo e caiu antes do DELETE
+        os.makedirs(ARCHIVE_DIR)
+        with sqlite3.connect(archive_path(mes)) as conn:
+            conn.execute(f"CREATE TABLE print_jobs ({', '.join(printbox_core._ARCHIVE_COLUMNS.split(', '))},"
+                         " PRIMARY KEY (id))")
+            linhas = get_database().query(f"SELECT {printbox_core._ARCHIVE_COLUMNS} FROM print_jobs WHERE id <= 2")
+            conn.executemany(f"INSERT INTO print_jobs VALUES ({', '.join('?' * 9)})", linhas)
+
+        resultado = apply_retention(POLITICA)
+        self.assertEqual(resultado.archived, 4)
+        self.assertEqual(self.ids_no_banco(), [])
+        self.assertEqual(self.ids_arquivados(), [1, 2, 3, 4])
+
+    def test_nao_arquiva_o_que_nao_foi_para_a_central(self):
+        central = os.path.join(self.dir, "central")
+        self.inserir(*[_dias_atras(200, i) for i in range(10)])
+        self.assertEqual(push(central).high_water, 10)
+        self.inserir(*[_dias_atras(200, i) for i in range(5)])  # Antigas, mas ainda não enviadas
+
+        resultado = apply_retention(POLITICA)  # Sem PRINTBOX_SYNC_DIR: vale o que está em sync_state
+        self.assertEqual(resultado.archived, 10)
+        self.assertEqual(self.ids_no_banco(), list(range(11, 16)))
+
+        push(central)
+        merge_batches(central)
+        with sqlite3.connect(os.path.join(central, "central.db")) as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM print_jobs").fetchone()[0], 15)
+
+    def test_menor_ponto_entre_varias_centrais(self):
+        self.inserir(*[_dias_atras(200, i) for i in range(6)])
+        push(os.path.join(self.dir, "matriz"))
+        self.inserir(*[_dias_atras(200, i) for i in range(3)])
+        push(os.path.join(self.dir, "filial"))
+        self.assertEqual(apply_retention(POLITICA).archived, 6)
+
+
+class TestConsultaComArquivos(RetentionTestCase):
+    def paginas(self, limit: int, filtro=None) -> list:
+        ids, after = [], None
+        while True:
+            pagina = query_jobs(filtro, after=after, limit=limit)
+            ids += [row[0] for row in pagina]
+            if len(pagina) < limit:
+                return ids
+            after = (pagina[-1][1], pagina[-1][0])
+
+    def test_paginas_atravessam_banco_e_arquivos(self):
+        self.inserir(*[_dias_atras(dias) for dias in (300, 200, 100, 50, 10, 5, 1)])
+        apply_retention(POLITICA)
+        self.assertEqual(self.ids_no_banco(), [5, 6, 7])
+        for limit in (1, 2, 3, 4, 10):
+            with self.subTest(limit=limit):
+                self.assertEqual(self.paginas(limit), [7, 6, 5, 4, 3, 2, 1])
+
+    def test_linhas_antigas_nao_enviadas_se_intercalam_com_os_arquivos(self):
+        central = os.path.join(self.dir, "central")
+        self.inserir(_dias_atras(300), _dias_atras(100), _dias_atras(1))
+        push(central)
+        self.inserir(_dias_atras(200), _dias_atras(50))  # Ficam no banco principal até o próximo envio
+        apply_retention(POLITICA)
+        self.assertEqual(self.ids_no_banco(), [3, 4, 5])
+
+        self.assertEqual([row[0] for row in query_jobs(limit=3)], [3, 5, 2])
+        self.assertEqual(self.paginas(2), [3, 5, 2, 4, 1])
+        self.assertEqual(self.paginas(2, JobFilter(date_to=_dias_atras(60)[:10])), [2, 4, 1])
+
+    def test_linha_nos_dois_bancos_aparece_uma_vez(self):
+        self.inserir(_dias_atras(200), _dias_atras(1))
+        apply_retention(POLITICA)
+        # Como depois de uma queda entre a cópia e o DELETE
+        with sqlite3.connect(archive_path(_dias_atras(200)[:7])) as conn:
+            linha = conn.execute(f"SELECT {printbox_core._ARCHIVE_COLUMNS} FROM print_jobs").fetchone()
+        with get_database().transaction() as conn:
+            conn.execute(f"INSERT INTO print_jobs ({printbox_core._ARCHIVE_COLUMNS}) VALUES ({', '.join('?' * 9)})",
+                         linha)
+        self.assertEqual(self.paginas(10), [2, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,201 @@
+import os
+import shutil
+import sqlite3
+import unittest
+from unittest import mock
+
+import printbox_core
+from printbox_core import (
+    SPOOL_CONCLUIDO, SPOOL_IMPRIMINDO, SPOOL_PENDENTE, PrintBackend, SpoolTracker, flush_print_log, get_database,
+    log_print_jobs,
+)
+from printbox_sync import INBOX_DIR, STATION_ENV, CentralStore, merge_batches, push
+
+from base import PrintBoxTestCase
+
+
+class SpoolerFalso(PrintBackend):
+    """Responde ao SpoolTracker com os estados de `self.estados`."""
+    name = "falso"
+
+    def __init__(self):
+        self.estados = {}
+
+    def status(self, job_id: str) -> str:
+        return self.estados.get(job_id, SPOOL_PENDENTE)
+
+
+class SyncTestCase(PrintBoxTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.dict(os.environ, {STATION_ENV: "loja-1"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(printbox_core, "SYNC_DIR", "")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.central = os.path.join(self.dir, "central")
+        self.inbox = os.path.join(self.central, INBOX_DIR)
+
+    def imprimir(self, quantidade: int, com_spooler: bool = False):
+        primeiro = get_database().query_one("SELECT COALESCE(MAX(id), 0) FROM print_jobs")[0] + 1
+        log_print_jobs([(f"{i}.pdf", "Bronco", 2, "Sucesso", 3, f"lp-{i}" if com_spooler else "")
+                        for i in range(primeiro, primeiro + quantidade)])
+        flush_print_log()
+
+    def central_rows(self, colunas: str = "id") -> list:
+        with sqlite3.connect(os.path.join(self.central, "central.db")) as conn:
+            return conn.execute(f"SELECT {colunas} FROM print_jobs ORDER BY station_id, id").fetchall()
+
+    def lotes(self) -> list:
+        return sorted(os.listdir(self.inbox)) if os.path.isdir(self.inbox) else []
+
+
+class TestEnvio(SyncTestCase):
+    def test_envia_em_lotes_e_retoma_do_ponto_certo(self):
+        self.imprimir(12)
+        resultado = push(self.central, batch_size=5)
+        self.assertEqual((resultado.batches, resultado.rows, resultado.high_water), (3, 12, 12))
+        self.assertEqual(push(self.central, batch_size=5).batches, 0)
+        self.imprimir(2)
+        self.assertEqual(push(self.central, batch_size=5).rows, 2)
+        self.assertEqual(len(self.lotes()), 4)
+
+    def test_central_inacessivel_nao_avanca(self):
+        self.imprimir(3)
+        with open(self.central, "w"):
+            pass  # Um arquivo no lugar da pasta: makedirs falha como num compartilhamento fora do ar
+        resultado = push(self.central)
+        self.assertTrue(resultado.offline)
+        self.assertEqual(resultado.high_water, 0)
+        os.remove(self.central)
+        self.assertEqual(push(self.central).rows, 3)
+
+
+class TestJuncao(SyncTestCase):
+    def test_juntar_de_novo_nao_duplica(self):
+        self.imprimir(7)
+        push(self.central, batch_size=3)
+        copia = os.path.join(self.dir, "copia")
+        shutil.copytree(self.inbox, copia)
+
+        resultado = merge_batches(self.central)
+        self.assertEqual((resultado.batches, resultado.rows, resultado.duplicates), (3, 7, 0))
+        self.assertEqual(self.lotes(), [])
+        totais = CentralStore(self.central).get_daily_stats()
+
+        # O mesmo lote chegando de novo (reenvio depois de uma falha, pasta sincronizada restaurada)
+        shutil.rmtree(self.inbox)
+        shutil.copytree(copia, self.inbox)
+        resultado = merge_batches(self.central)
+        self.assertEqual((resultado.rows, resultado.duplicates), (0, 7))
+        self.assertEqual(len(self.central_rows()), 7)
+        self.assertEqual(CentralStore(self.central).get_daily_stats(), totais)
+        self.assertEqual(totais[0][1:], (7, 14, 21, 42))
+
+    def test_lote_ilegivel_fica_na_pasta(self):
+        self.imprimir(1)
+        push(self.central)
+        with open(os.path.join(self.inbox, "loja-2-000000000001-000000000001.json.gz"), "wb") as f:
+            f.write(b"corrompido")
+        resultado = merge_batches(self.central)
+        self.assertEqual(resultado.rejected, ["loja-2-000000000001-000000000001.json.gz"])
+        self.assertEqual(len(self.lotes()), 1)
+        self.assertEqual(len(self.central_rows()), 1)
+
+    def test_estacoes_diferentes_nao_se_misturam(self):
+        self.imprimir(2)
+        push(self.central)
+        merge_batches(self.central)
+        # Outra estação com o próprio print_log.db (ids começando do 1 também)
+        os.makedirs("loja-2")
+        os.chdir("loja-2")
+        printbox_core.close_databases()
+        printbox_core.setup_database()
+        with mock.patch.dict(os.environ, {STATION_ENV: "loja-2"}):
+            self.imprimir(3)
+            push(self.central)
+        merge_batches(self.central)
+        self.assertEqual(self.central_rows("station_id, id"),
+                         [("loja-1", 1), ("loja-1", 2), ("loja-2", 1), ("loja-2", 2), ("loja-2", 3)])
+        self.assertEqual([s[:2] for s in CentralStore(self.central).stations()], [("loja-1", 2), ("loja-2", 3)])
+
+
+class TestSituacaoNoSpooler(SyncTestCase):
+    def setUp(self):
+        super().setUp()
+        self.spooler = SpoolerFalso()
+        self.tracker = SpoolTracker(self.spooler)
+
+    def mudar(self, job_id: str, estado: str):
+        self.spooler.estados[job_id] = estado
+        self.assertEqual(self.tracker.poll_once(), 1)
+
+    def spool_central(self) -> list:
+        return self.central_rows("id, spool_status")
+
+    def test_mudanca_depois_do_envio_chega_a_central(self):
+        self.imprimir(3, com_spooler=True)
+        push(self.central)
+        merge_batches(self.central)
+        self.mudar("lp-2", SPOOL_CONCLUIDO)
+
+        resultado = push(self.central)
+        self.assertEqual((resultado.rows, resultado.updated), (0, 1))
+        resultado = merge_batches(self.central)
+        self.assertEqual((resultado.rows, resultado.updated, resultado.duplicates), (0, 1, 0))
+        self.assertEqual(self.spool_central(), [(1, SPOOL_PENDENTE), (2, SPOOL_CONCLUIDO), (3, SPOOL_PENDENTE)])
+        # A troca de situação não conta a impressão de novo
+        self.assertEqual(CentralStore(self.central).get_daily_stats()[0][1], 3)
+        self.assertEqual(push(self.central).updated, 0)
+
+    def test_versao_antiga_nao_sobrescreve_a_nova(self):
+        self.imprimir(1, com_spooler=True)
+        push(self.central)
+        merge_batches(self.central)
+        self.mudar("lp-1", SPOOL_IMPRIMINDO)
+        push(self.central)
+        antigo = self.lotes()
+        guardados = os.path.join(self.dir, "atrasados")
+        os.makedirs(guardados)
+        for nome in antigo:
+            shutil.move(os.path.join(self.inbox, nome), guardados)
+        self.mudar("lp-1", SPOOL_CONCLUIDO)
+        push(self.central)
+        merge_batches(self.central)
+        self.assertEqual(self.spool_central(), [(1, SPOOL_CONCLUIDO)])
+
+        # O lote da versão anterior chega atrasado
+        for nome in antigo:
+            shutil.move(os.path.join(guardados, nome), self.inbox)
+        resultado = merge_batches(self.central)
+        self.assertEqual((resultado.updated, resultado.duplicates), (0, 1))
+        self.assertEqual(self.spool_central(), [(1, SPOOL_CONCLUIDO)])
+
+    def test_lote_de_spool_antes_do_lote_das_linhas(self):
+        self.imprimir(2, com_spooler=True)
+        push(self.central)
+        linhas = self.lotes()
+        guardados = os.path.join(self.dir, "atrasados")
+        os.makedirs(guardados)
+        for nome in linhas:
+            shutil.move(os.path.join(self.inbox, nome), guardados)
+        self.mudar("lp-1", SPOOL_CONCLUIDO)
+        push(self.central)
+        merge_batches(self.central)  # Só o lote de spool: a linha entra já com a situação nova
+        for nome in linhas:
+            shutil.move(os.path.join(guardados, nome), self.inbox)
+        merge_batches(self.central)
+        self.assertEqual(self.spool_central(), [(1, SPOOL_CONCLUIDO), (2, SPOOL_PENDENTE)])
+        self.assertEqual(CentralStore(self.central).get_daily_stats()[0][1], 2)
+
+    def test_spool_seq_so_muda_com_mudanca_real(self):
+        self.imprimir(1, com_spooler=True)
+        push(self.central)
+        with get_database().transaction() as conn:
+            conn.execute("UPDATE print_jobs SET spool_status = spool_status")
+        self.assertEqual(push(self.central).updated, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()